@@ -0,0 +1,171 @@
+"""
+Activity log writer.
+
+Endpoints record entries on an ActivityLog while they mutate companies and call
+`flush(cur)` right before committing. All entries of the transaction are written by a
+single multi-row INSERT on the same cursor, so they commit or roll back together with
+the change they describe, at the cost of one round trip however many rows changed.
+
+activity_log is range-partitioned by month on created_at (activity_log_YYYYMM, plus a
+default partition for anything outside them). maintain() runs daily and creates the next
+months' partitions ahead of time. History is kept indefinitely unless retention is switched
+on with ACTIVITY_RETENTION_MONTHS: months older than that are rolled up into per-company
+action counts (activity_log_monthly) and their partitions dropped, which is cheap whatever
+their size.
+"""
+import asyncio
+import os
+from datetime import date
+
+import psycopg
+
+import db
+
+# Months of detailed history kept; older months survive only as counts. 0 (the default) keeps everything.
+RETENTION_MONTHS = int(os.environ.get("ACTIVITY_RETENTION_MONTHS", "0"))
+MAINTENANCE_INTERVAL_SECONDS = 24 * 3600
+PARTITION_MONTHS_AHEAD = 2
+# pg_try_advisory_xact_lock key, so one process at a time runs maintenance
+_MAINTENANCE_LOCK_ID = 724_020
+
+_maintenance: asyncio.Task | None = None
+
+
+class ActivityLog:
+    """Entries buffered for one transaction. Discard it (or call clear()) when the transaction rolls back."""
+
+    def __init__(self):
+        self.entries: list[tuple] = []
+
+    def add(self, company_id: int, action: str, old_value: str | None = None, new_value: str | None = None):
+        self.entries.append((company_id, action, old_value, new_value))
+
+    def add_many(self, company_ids, action: str, old_value: str | None = None, new_value: str | None = None):
+        """The same transition for many companies, e.g. the ids returned by a bulk UPDATE."""
+        self.entries.extend((company_id, action, old_value, new_value) for company_id in company_ids)
+
+    def clear(self):
+        self.entries.clear()
+
+    async def flush(self, cur: psycopg.AsyncCursor) -> int:
+        """Write buffered entries in the cursor's transaction. Returns the number written."""
+        if not self.entries:
+            return 0
+        company_ids, actions, old_values, new_values = map(list, zip(*self.entries))
+        await cur.execute(
+            """
+            INSERT INTO activity_log (company_id, action, old_value, new_value)
+            SELECT * FROM unnest(%s::int[], %s::varchar[], %s::varchar[], %s::varchar[])
+            """,
+            (company_ids, actions, old_values, new_values)
+        )
+        written = len(self.entries)
+        self.entries.clear()
+        return written
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"activity_log_{month:%Y%m}"
+
+
+def partition_ddl(month: date) -> str:
+    """CREATE statement for the partition holding `month` (first day of the month)."""
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF activity_log "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+async def _monthly_partitions(cur: psycopg.AsyncCursor) -> dict[date, str]:
+    await cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'activity_log'::regclass AND c.relname ~ '^activity_log_[0-9]{6}$'
+        """
+    )
+    return {date(int(r['relname'][-6:-2]), int(r['relname'][-2:]), 1): r['relname'] for r in await cur.fetchall()}
+
+
+async def _roll_up(cur: psycopg.AsyncCursor, table: str, before: date):
+    await cur.execute(
+        f"""
+        INSERT INTO activity_log_monthly (month, company_id, action, entries)
+        SELECT date_trunc('month', created_at)::date, company_id, action, count(*)
+        FROM {table} WHERE created_at < %s
+        GROUP BY 1, 2, 3
+        ON CONFLICT (month, company_id, action) DO UPDATE SET entries = activity_log_monthly.entries + EXCLUDED.entries
+        """,
+        (before,)
+    )
+
+
+async def maintain(cur: psycopg.AsyncCursor, retention_months: int = RETENTION_MONTHS, today: date | None = None) -> dict:
+    """
+    Create upcoming partitions and apply retention, in the cursor's transaction (the caller commits).
+    Returns what was done; skipped when another process holds the maintenance lock.
+    """
+    await cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (_MAINTENANCE_LOCK_ID,))
+    if not (await cur.fetchone())['locked']:
+        return {"skipped": True}
+
+    this_month = (today or date.today()).replace(day=1)
+    existing = await _monthly_partitions(cur)
+    created, dropped = [], []
+    for ahead in range(PARTITION_MONTHS_AHEAD + 1):
+        month = add_months(this_month, ahead)
+        if month in existing:
+            continue
+        try:
+            async with cur.connection.transaction():
+                await cur.execute(partition_ddl(month))
+            created.append(partition_name(month))
+        except psycopg.errors.CheckViolation:
+            # Rows for that month already landed in the default partition; they stay there
+            print(f"Warning: activity_log_default holds rows for {month:%Y-%m}; partition not created")
+
+    if retention_months > 0:
+        cutoff = add_months(this_month, -retention_months)
+        for month, name in sorted(existing.items()):
+            if add_months(month, 1) <= cutoff:
+                await _roll_up(cur, name, cutoff)
+                await cur.execute(f"ALTER TABLE activity_log DETACH PARTITION {name}")
+                await cur.execute(f"DROP TABLE {name}")
+                dropped.append(name)
+        await _roll_up(cur, "activity_log_default", cutoff)
+        await cur.execute("DELETE FROM activity_log_default WHERE created_at < %s", (cutoff,))
+
+    return {"created": created, "dropped": dropped}
+
+
+async def _run_maintenance():
+    while True:
+        try:
+            async with db.async_connection() as conn:
+                async with conn.cursor() as cur:
+                    result = await maintain(cur)
+                await conn.commit()
+            if result.get("created") or result.get("dropped"):
+                print(f"activity_log maintenance: {result}")
+        except Exception as e:
+            print(f"activity_log maintenance failed: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+
+def start_maintenance():
+    global _maintenance
+    if _maintenance is None:
+        _maintenance = asyncio.create_task(_run_maintenance())
+
+
+async def stop_maintenance():
+    global _maintenance
+    if _maintenance is not None:
+        _maintenance.cancel()
+        await asyncio.gather(_maintenance, return_exceptions=True)
+        _maintenance = None
@@ -0,0 +1,186 @@
+"""
+Cache of Gemini enrichment results.
+
+An entry is keyed by everything its answer depends on: a namespace naming the lookup, the
+model and the prompt version (see ai_service.*_CACHE), plus the company's normalized name
+and location. Entries live in Postgres (ai_cache) for AI_CACHE_TTL_DAYS, so they survive
+restarts and are shared between workers; an in-process LRU sits in front of the table.
+A cache that can't be read or written is logged and treated as a miss: enrichment never
+fails because of it.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import psycopg
+from psycopg.types.json import Jsonb
+
+import db
+import enrichment
+
+ENABLED = os.environ.get("AI_CACHE", "1") != "0"
+TTL_DAYS = float(os.environ.get("AI_CACHE_TTL_DAYS", "30"))
+MEMORY_SIZE = int(os.environ.get("AI_CACHE_MEMORY_SIZE", "10000"))
+PRUNE_BATCH = 1000
+
+
+class ResultCache:
+    """In-process LRU of cached results; an entry expires with the row it was read from."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+memory = ResultCache(MEMORY_SIZE)
+counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stored": 0, "errors": 0}
+
+
+def normalize(value: str | None) -> str:
+    # "ACME, Inc." and "acme inc" are the same company
+    return " ".join(re.sub(r"[^\w]+", " ", (value or "").lower()).split())
+
+
+def cache_key(namespace: str, *parts: str | None) -> str:
+    raw = json.dumps([namespace, *(normalize(p) for p in parts)])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def lookup(keys: list[str]) -> dict[str, dict]:
+    """Cached results for those of `keys` that have an unexpired entry."""
+    if not ENABLED or not keys:
+        return {}
+    found = {}
+    for key in set(keys):
+        value = memory.get(key)
+        if value is not None:
+            found[key] = value
+    counters["memory_hits"] += len(found)
+
+    rest = [key for key in set(keys) if key not in found]
+    if rest:
+        try:
+            async with db.async_connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        """
+                        SELECT cache_key, result, extract(epoch FROM expires_at - LOCALTIMESTAMP) AS ttl
+                        FROM ai_cache
+                        WHERE cache_key = ANY(%s) AND expires_at > LOCALTIMESTAMP
+                        """,
+                        (rest,)
+                    )
+                    rows = await cur.fetchall()
+        except psycopg.Error as e:
+            counters["errors"] += 1
+            print(f"AI cache lookup failed: {e}")
+            rows = []
+        for row in rows:
+            found[row['cache_key']] = row['result']
+            memory.set(row['cache_key'], row['result'], float(row['ttl']))
+        counters["db_hits"] += len(rows)
+    counters["misses"] += len(set(keys)) - len(found)
+    return found
+
+
+async def store(entries: dict[str, dict], namespace: str):
+    """Cache results by key for TTL_DAYS, replacing older entries."""
+    if not ENABLED or not entries:
+        return
+    for key, value in entries.items():
+        memory.set(key, value, TTL_DAYS * 86400)
+    try:
+        async with db.async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    INSERT INTO ai_cache (cache_key, namespace, result, expires_at)
+                    SELECT k, %s, r, LOCALTIMESTAMP + %s * INTERVAL '1 day'
+                    FROM unnest(%s::text[], %s::jsonb[]) AS e(k, r)
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET result = EXCLUDED.result, created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at
+                    """,
+                    (namespace, TTL_DAYS, list(entries), [Jsonb(v) for v in entries.values()])
+                )
+                # Sweep a bounded number of expired rows on every write, so the table doesn't keep them forever
+                await cur.execute("""
+                    DELETE FROM ai_cache WHERE cache_key IN (
+                        SELECT cache_key FROM ai_cache WHERE expires_at <= LOCALTIMESTAMP LIMIT %s
+                    )
+                """, (PRUNE_BATCH,))
+            await conn.commit()
+        counters["stored"] += len(entries)
+    except psycopg.Error as e:
+        counters["errors"] += 1
+        print(f"AI cache store failed: {e}")
+
+
+async def run_cached(namespace: str, fn: enrichment.ChunkFn, companies: list[dict], name_field: str = "name") -> enrichment.Enrichment:
+    """
+    enrichment.run for the companies without a cached result only; answers for the rest
+    come from the cache. Results keep input order and carry the input's id.
+    """
+    keys = [cache_key(namespace, c.get(name_field), c.get("location")) for c in companies]
+    cached = await lookup(keys)
+    misses = [c for c, key in zip(companies, keys) if key not in cached]
+
+    result = await enrichment.run(fn, misses) if misses else enrichment.Enrichment(results=[])
+    fresh = {str(r["id"]): r for r in result.results}
+    await store(
+        {key: {k: v for k, v in fresh[str(c["id"])].items() if k != "id"}
+         for c, key in zip(companies, keys) if key not in cached and str(c["id"]) in fresh},
+        namespace
+    )
+
+    results = []
+    for company, key in zip(companies, keys):
+        if key in cached:
+            results.append({**cached[key], "id": company["id"]})
+        elif str(company["id"]) in fresh:
+            results.append(fresh[str(company["id"])])
+    result.results = results
+    result.cache_hits = len(companies) - len(misses)
+    return result
+
+
+def stats() -> dict:
+    lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+    hits = counters["memory_hits"] + counters["db_hits"]
+    return {
+        "enabled": ENABLED,
+        "memory_size": len(memory),
+        "memory_maxsize": memory.maxsize,
+        "ttl_days": TTL_DAYS,
+        **counters,
+        "hit_rate": round(hits / lookups, 4) if lookups else None,
+    }
@@ -0,0 +1,199 @@
+"""
+Throttling and failure handling for Gemini calls.
+
+Every call goes through `guarded`:
+- A token bucket holds requests and tokens to GEMINI_RPM / GEMINI_TPM, shared by every
+  request of the process. Tokens are estimated from the prompt up front and corrected from
+  the response's usage metadata.
+- 429 and 5xx answers (and transport errors) are retried with exponential backoff, honouring
+  the RetryInfo delay Gemini sends with a 429. A 429 also halves the bucket's rate, which then
+  creeps back up with every success, so parallel users settle just under the quota instead
+  of tripping it over and over.
+- After GEMINI_BREAKER_THRESHOLD calls in a row have failed that way the circuit opens: for
+  GEMINI_BREAKER_COOLDOWN_SECONDS calls fail at once with 503 rather than queueing behind a
+  dead upstream. Then one trial call is let through; its success closes the circuit.
+"""
+import asyncio
+import os
+import random
+import re
+import time
+from typing import Awaitable, Callable
+
+import httpx
+from fastapi import HTTPException
+
+RPM = float(os.environ.get("GEMINI_RPM", "60"))
+TPM = float(os.environ.get("GEMINI_TPM", "1000000"))
+MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "4"))
+BACKOFF_SECONDS = float(os.environ.get("GEMINI_BACKOFF_SECONDS", "2"))
+MAX_BACKOFF_SECONDS = 60.0
+BREAKER_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+# Lowest fraction of RPM/TPM the limiter backs off to after 429s
+MIN_RATE_FACTOR = 0.1
+
+
+class RateLimiter:
+    """Request and token buckets refilled per minute, scaled by an adaptive rate factor."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = rpm
+        self.tokens = tpm
+        self.factor = 1.0
+        self.updated = time.monotonic()
+        self.throttled_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        self.requests = min(self.rpm, self.requests + self.rpm * self.factor * elapsed / 60)
+        self.tokens = min(self.tpm, self.tokens + self.tpm * self.factor * elapsed / 60)
+
+    async def acquire(self, tokens: int):
+        # A prompt larger than the whole budget waits for a full bucket rather than forever
+        tokens = min(tokens, self.tpm)
+        while True:
+            self._refill()
+            wait = max(
+                (1 - self.requests) * 60 / (self.rpm * self.factor),
+                (tokens - self.tokens) * 60 / (self.tpm * self.factor),
+            )
+            if wait <= 0:
+                self.requests -= 1
+                self.tokens -= tokens
+                return
+            self.throttled_seconds += wait
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated: int, actual: int | None):
+        # Charge what the call really used; the bucket may go negative and pay it back over time
+        if actual is not None:
+            self.tokens -= actual - estimated
+
+    def slow_down(self):
+        self.factor = max(MIN_RATE_FACTOR, self.factor / 2)
+
+    def speed_up(self):
+        self.factor = min(1.0, self.factor + 0.05)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_in_flight = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.cooldown else "half_open"
+
+    def before_call(self) -> bool:
+        """Raise 503 while the circuit is open; True when this call is the half-open trial."""
+        state = self.state
+        if state == "open" or (state == "half_open" and self.trial_in_flight):
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Gemini is unavailable, try again later")
+        if state == "half_open":
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None or self.state == "half_open":
+                print(f"Gemini circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+limiter = RateLimiter(RPM, TPM)
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN_SECONDS)
+counters = {"calls": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+
+
+def estimate_tokens(prompt: str) -> int:
+    # About four characters per token, plus room for the answer
+    return len(prompt) // 4 + 1000
+
+
+def is_retryable(e: Exception) -> bool:
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    return isinstance(e, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def retry_delay(e: Exception, attempt: int) -> float:
+    # A 429 from Gemini carries RetryInfo, e.g. 'retryDelay': '7s'
+    match = re.search(r"retryDelay'?\"?:\s*'?\"?(\d+(?:\.\d+)?)s", str(e))
+    if match:
+        return min(MAX_BACKOFF_SECONDS, float(match.group(1)))
+    return min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt) * (0.5 + random.random())
+
+
+async def guarded(call: Callable[[], Awaitable], prompt: str):
+    """Await `call()` (one Gemini request for `prompt`) under the rate limiter, retries and circuit breaker."""
+    estimated = estimate_tokens(prompt)
+    for attempt in range(MAX_RETRIES + 1):
+        trial = breaker.before_call()
+        try:
+            # Waiting for the limiter is part of the trial: a cancel there must free it too
+            await limiter.acquire(estimated)
+            counters["calls"] += 1
+            response = await call()
+        except asyncio.CancelledError:
+            # Only the trial's own cancellation frees the half-open slot
+            if trial:
+                breaker.trial_in_flight = False
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                # The request itself was bad, but Gemini answered it, so it is up
+                breaker.record_success()
+                raise
+            if getattr(e, "code", None) == 429:
+                counters["rate_limited"] += 1
+                limiter.slow_down()
+            # A failed trial reopens the circuit straight away
+            if attempt == MAX_RETRIES or trial:
+                counters["failures"] += 1
+                breaker.record_failure()
+                raise
+            counters["retries"] += 1
+            delay = retry_delay(e, attempt)
+            print(f"Gemini call failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        usage = getattr(response, "usage_metadata", None)
+        limiter.settle(estimated, getattr(usage, "total_token_count", None))
+        limiter.speed_up()
+        breaker.record_success()
+        return response
+
+
+def stats() -> dict:
+    return {
+        **counters,
+        "rpm": RPM,
+        "tpm": TPM,
+        "rate_factor": round(limiter.factor, 3),
+        "throttled_seconds": round(limiter.throttled_seconds, 1),
+        "circuit": breaker.state,
+        "consecutive_failures": breaker.failures,
+        "rejected": breaker.rejected,
+    }
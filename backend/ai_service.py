@@ -5,14 +5,36 @@ from google import genai
 from google.genai import types
 from fastapi import HTTPException
 
+import ai_limits
+import enrichment
+
 # Configure Gemini
 API_KEY = os.environ.get("GEMINI_API_KEY")
 MODEL_NAME = "gemini-3-flash-preview"  # Updated to user preference
 
+# ai_cache namespaces; bump the version when a prompt changes so answers to the old one aren't reused
+HEADCOUNT_CACHE = f"headcount:{MODEL_NAME}:v1"
+HEADCOUNT_PROMPT_CACHE = f"headcount-prompt:{MODEL_NAME}:v1"
+DECISION_MAKER_CACHE = f"decision-maker:{MODEL_NAME}:v1"
+
+_client: Optional[genai.Client] = None
+
 def get_client():
+    # One client per process, so its HTTP connections are reused across calls
+    global _client
     if not API_KEY:
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY is not set")
-    return genai.Client(api_key=API_KEY)
+    if _client is None:
+        _client = genai.Client(api_key=API_KEY)
+    return _client
+
+async def _generate_async(prompt: str, config: types.GenerateContentConfig):
+    # Rate limited, retried on 429/5xx and short-circuited while Gemini is down (see ai_limits.py)
+    client = get_client()
+    return await ai_limits.guarded(
+        lambda: client.aio.models.generate_content(model=MODEL_NAME, contents=prompt, config=config),
+        prompt,
+    )
 
 def safe_json_load(s: str) -> Optional[Dict[str, Any]]:
     s = (s or "").strip()
@@ -32,11 +54,9 @@ def safe_json_load(s: str) -> Optional[Dict[str, Any]]:
             return None
     return None
 
-def estimate_headcount(prompt: str) -> Dict[str, Any]:
-    client = get_client()
-    
+def _headcount_config() -> types.GenerateContentConfig:
     # Configure for JSON response
-    config = types.GenerateContentConfig(
+    return types.GenerateContentConfig(
         response_mime_type="application/json",
         response_schema={
             "type": "OBJECT",
@@ -56,32 +76,41 @@ def estimate_headcount(prompt: str) -> Dict[str, Any]:
         tools=[types.Tool(google_search=types.GoogleSearch())]
     )
 
+def _parse_object(response) -> Dict[str, Any]:
+    raw_text = getattr(response, "text", None)
+    data = safe_json_load(raw_text)
+
+    if not data:
+         raise ValueError("Failed to parse JSON from Gemini response")
+
+    return data
+
+def _parse_list(response) -> list[dict]:
+    raw_text = getattr(response, "text", None)
+    data = safe_json_load(raw_text)
+
+    if not data or not isinstance(data, list):
+         # Fallback or error? Let's try to wrap in list if it's a single object (edge case)
+         if isinstance(data, dict):
+             data = [data]
+         else:
+             raise ValueError("Failed to parse JSON list from Gemini response")
+
+    return data
+
+async def estimate_headcount_async(prompt: str) -> Dict[str, Any]:
+    """Headcount estimate for a free-text prompt, on the SDK's async client so the event loop keeps serving while Gemini works."""
     try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt,
-            config=config,
-        )
-        
-        raw_text = getattr(response, "text", None)
-        data = safe_json_load(raw_text)
-        
-        if not data:
-             raise ValueError("Failed to parse JSON from Gemini response")
-
-        return data
+        response = await _generate_async(prompt, _headcount_config())
+        return _parse_object(response)
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Gemini Error: {e}")
         raise HTTPException(status_code=500, detail=f"Gemini API Error: {str(e)}")
 
-def estimate_headcount_bulk(companies: list[dict]) -> list[dict]:
-    """
-    companies: list of dicts with 'id', 'name', 'location'
-    Returns: list of dicts with 'id' and 'headcount_data' (value, min, max, confidence, source)
-    """
-    client = get_client()
-
+def _headcount_bulk_request(companies: list[dict]) -> tuple[str, types.GenerateContentConfig]:
     # Construct a bulk prompt
     companies_text = ""
     for c in companies:
@@ -135,37 +164,29 @@ JSON format:
         },
         tools=[types.Tool(google_search=types.GoogleSearch())]
     )
+    return prompt, config
 
+async def estimate_headcount_bulk_async(companies: list[dict]) -> list[dict]:
+    """
+    companies: list of dicts with 'id', 'name', 'location'
+    Returns: list of dicts with 'id' and 'headcount_data' (value, min, max, confidence, source)
+    """
+    prompt, config = _headcount_bulk_request(companies)
     try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt,
-            config=config,
-        )
-        
-        raw_text = getattr(response, "text", None)
-        data = safe_json_load(raw_text)
-        
-        if not data or not isinstance(data, list):
-             # Fallback or error? Let's try to wrap in list if it's a single object (edge case)
-             if isinstance(data, dict):
-                 data = [data]
-             else:
-                 raise ValueError("Failed to parse JSON list from Gemini response")
-
-        return data
+        response = await _generate_async(prompt, config)
+        return _parse_list(response)
 
+    except HTTPException:
+        raise
+    except ValueError as e:
+        # Truncated or non-JSON answer; enrichment.run asks for the chunk again
+        print(f"Gemini Bulk Error: {e}")
+        raise enrichment.MalformedAnswer(f"Gemini API Bulk Error: {str(e)}")
     except Exception as e:
         print(f"Gemini Bulk Error: {e}")
         raise HTTPException(status_code=500, detail=f"Gemini API Bulk Error: {str(e)}")
 
-def find_decision_maker_bulk(companies: list[dict]) -> list[dict]:
-    """
-    companies: list of dicts with 'id', 'company_name', 'location'
-    Returns: list of dicts with 'id', 'name', 'sur_name', 'phone_number', 'confidence', 'source_hint'
-    """
-    client = get_client()
-
+def _decision_maker_bulk_request(companies: list[dict]) -> tuple[str, types.GenerateContentConfig]:
     # Construct a bulk prompt
     companies_text = ""
     for c in companies:
@@ -219,25 +240,24 @@ JSON format:
         },
         tools=[types.Tool(google_search=types.GoogleSearch())]
     )
+    return prompt, config
 
+async def find_decision_maker_bulk_async(companies: list[dict]) -> list[dict]:
+    """
+    companies: list of dicts with 'id', 'company_name', 'location'
+    Returns: list of dicts with 'id', 'name', 'sur_name', 'phone_number', 'confidence', 'source_hint'
+    """
+    prompt, config = _decision_maker_bulk_request(companies)
     try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt,
-            config=config,
-        )
-        
-        raw_text = getattr(response, "text", None)
-        data = safe_json_load(raw_text)
-        
-        if not data or not isinstance(data, list):
-             if isinstance(data, dict):
-                 data = [data]
-             else:
-                 raise ValueError("Failed to parse JSON list from Gemini response")
-
-        return data
+        response = await _generate_async(prompt, config)
+        return _parse_list(response)
 
+    except HTTPException:
+        raise
+    except ValueError as e:
+        # Truncated or non-JSON answer; enrichment.run asks for the chunk again
+        print(f"Gemini DM Bulk Error: {e}")
+        raise enrichment.MalformedAnswer(f"Gemini API DM Bulk Error: {str(e)}")
     except Exception as e:
         print(f"Gemini DM Bulk Error: {e}")
         raise HTTPException(status_code=500, detail=f"Gemini API DM Bulk Error: {str(e)}")
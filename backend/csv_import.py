@@ -0,0 +1,235 @@
+"""
+Bulk CSV import of companies.
+
+Rows are streamed into a temporary staging table with COPY and merged into
+`companies` with a single set-based INSERT ... SELECT ... ON CONFLICT, so the
+cost of an import is a handful of round trips regardless of the number of rows.
+"""
+import codecs
+import csv
+import os
+import tempfile
+import time
+import psycopg
+from fastapi import UploadFile
+
+import jobs
+
+# Columns of `companies` that a CSV column can be mapped to
+IMPORT_FIELDS = ("name", "employees", "location", "limit_val", "description")
+
+STAGING_TABLE = "companies_import_staging"
+
+# The upload is read READ_CHUNK_SIZE bytes at a time and flushed to the database every BATCH_SIZE rows,
+# so memory use depends on these two numbers rather than on the file size.
+READ_CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 5000
+
+# In-process copy of company_column_mappings, see get_mappings()
+MAPPINGS_TTL = 60.0
+_mappings: dict[str, str] | None = None
+_mappings_loaded_at = 0.0
+
+
+async def iter_csv_rows(file, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Parse an uploaded CSV incrementally. Yields lists of rows (the header is the first row),
+    one list per chunk read. Quoted fields spanning lines and chunks are kept intact.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    record_lines = []  # lines of the record being assembled
+    quotes = 0         # an odd count means we are inside a quoted field
+    while True:
+        chunk = await file.read(chunk_size)
+        buffer += decoder.decode(chunk, final=not chunk)
+        *lines, buffer = buffer.split("\n")
+        if not chunk and buffer:
+            lines.append(buffer)
+            buffer = ""
+
+        complete = []
+        for line in lines:
+            record_lines.append(line + "\n")
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                complete.extend(record_lines)
+                record_lines = []
+                quotes = 0
+        if not chunk:
+            # Unbalanced quote at EOF: let the csv module deal with what is left
+            complete.extend(record_lines)
+
+        rows = [row for row in csv.reader(complete) if row]
+        if rows:
+            yield rows
+        if not chunk:
+            break
+
+
+async def get_mappings(cur: psycopg.AsyncCursor) -> dict[str, str]:
+    """
+    company_column_mappings as {lowercased csv_header: db_field}, cached in-process.
+    Edits through the API call invalidate_mappings(); MAPPINGS_TTL bounds staleness for other writers.
+    """
+    global _mappings, _mappings_loaded_at
+    if _mappings is None or time.monotonic() - _mappings_loaded_at > MAPPINGS_TTL:
+        await cur.execute("SELECT csv_header, db_field FROM company_column_mappings ORDER BY id")
+        mappings = {}
+        for row in await cur.fetchall():
+            mappings.setdefault(row['csv_header'].strip().lower(), row['db_field'])
+        _mappings, _mappings_loaded_at = mappings, time.monotonic()
+    return _mappings
+
+
+def invalidate_mappings():
+    global _mappings
+    _mappings = None
+
+
+def compile_header(header: list[str], mappings: dict[str, str]) -> list[list[int]]:
+    """
+    Resolve the header row once into a plan: for each of IMPORT_FIELDS, the indexes of the
+    CSV columns mapped to it, in file order. Unmapped columns are ignored.
+    """
+    plan = [[] for _ in IMPORT_FIELDS]
+    for index, csv_header in enumerate(header):
+        db_field = mappings.get(csv_header.strip().lower())
+        if db_field in IMPORT_FIELDS:
+            plan[IMPORT_FIELDS.index(db_field)].append(index)
+    return plan
+
+
+def project_row(plan: list[list[int]], row: list[str]) -> tuple | None:
+    """
+    Map one CSV row onto IMPORT_FIELDS using a compiled plan. When several columns map to
+    the same field, the first non-empty one wins. Returns None when the row has no company name.
+    """
+    width = len(row)
+    values = []
+    for indexes in plan:
+        value = None
+        for i in indexes:
+            if i < width and row[i]:
+                value = row[i]
+                break
+        values.append(value)
+    if not (values[0] or "").strip():
+        return None
+    return tuple(values)
+
+
+async def import_csv(cur: psycopg.AsyncCursor, file, batch_size: int = BATCH_SIZE, on_batch=None) -> dict:
+    """
+    Stream `file` into the staging table in batches of `batch_size` rows and merge it into `companies`.
+
+    Without `on_batch`, everything is merged once at the end in the caller's transaction.
+    With it, each batch is merged as soon as it is staged and `await on_batch(counts)` runs
+    after it; background imports commit and record progress there.
+    """
+    await create_staging_table(cur)
+    mappings = await get_mappings(cur)
+    plan = None
+    batch = []
+    counts = {"processed": 0, "total": 0, "inserted": 0, "skipped": 0}
+
+    async def flush():
+        counts["total"] += await copy_rows(cur, batch, start=counts["total"])
+        batch.clear()
+        if on_batch is not None:
+            counts["inserted"] += await merge_staged(cur)
+            counts["skipped"] = counts["total"] - counts["inserted"]
+            await on_batch(dict(counts))
+
+    async for rows in iter_csv_rows(file):
+        if plan is None:
+            plan, rows = compile_header(rows[0], mappings), rows[1:]
+        for row in rows:
+            counts["processed"] += 1
+            projected = project_row(plan, row)
+            if projected is not None:
+                batch.append(projected)
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+
+    if on_batch is None:
+        counts["inserted"] = await merge_staged(cur)
+        counts["skipped"] = counts["total"] - counts["inserted"]
+    return counts
+
+
+async def spool_upload(file) -> str:
+    """Copy an upload to a temporary file that outlives the request. Returns its path."""
+    fd, path = tempfile.mkstemp(prefix="company-import-", suffix=".csv")
+    with os.fdopen(fd, "wb") as out:
+        while chunk := await file.read(READ_CHUNK_SIZE):
+            out.write(chunk)
+    return path
+
+
+async def run_import_job(job_id: int, path: str, batch_size: int = BATCH_SIZE):
+    """Background import of a spooled file, committing after every batch."""
+    async def work(conn, report):
+        with open(path, "rb") as f:
+            async with conn.cursor() as cur:
+                await import_csv(cur, UploadFile(f), batch_size=batch_size, on_batch=report)
+
+    try:
+        await jobs.run(job_id, work)
+    finally:
+        os.unlink(path)
+
+
+async def create_staging_table(cur: psycopg.AsyncCursor):
+    # Session-local; ON COMMIT DELETE ROWS lets the same table serve several batches on a pooled connection
+    await cur.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+            ord BIGINT NOT NULL,
+            name TEXT,
+            employees TEXT,
+            location TEXT,
+            limit_val TEXT,
+            description TEXT
+        ) ON COMMIT DELETE ROWS
+    """)
+
+
+async def copy_rows(cur: psycopg.AsyncCursor, rows, start: int = 0) -> int:
+    """
+    COPY projected rows (tuples ordered like IMPORT_FIELDS) into the staging table.
+    `start` is the ordinal of the first row, used to keep the first occurrence of duplicates.
+    Returns the number of rows written.
+    """
+    count = 0
+    columns = ", ".join(("ord",) + IMPORT_FIELDS)
+    async with cur.copy(f"COPY {STAGING_TABLE} ({columns}) FROM STDIN") as copy:
+        for row in rows:
+            await copy.write_row((start + count, *row))
+            count += 1
+    return count
+
+
+async def merge_staged(cur: psycopg.AsyncCursor) -> int:
+    """
+    Insert staged rows into `companies`. Names that already exist, or repeat within the file,
+    are skipped by the unique index on lower(name). Empties the staging table.
+    Returns the number of inserted companies.
+    """
+    await cur.execute(f"""
+        INSERT INTO companies (name, employees, location, limit_val, description)
+        SELECT
+            btrim(name),
+            CASE WHEN employees ~ '^\\s*\\d{{1,9}}\\s*$' THEN btrim(employees)::int ELSE 0 END,
+            NULLIF(location, ''),
+            NULLIF(limit_val, ''),
+            NULLIF(description, '')
+        FROM {STAGING_TABLE}
+        WHERE btrim(name) <> ''
+        ORDER BY ord
+        ON CONFLICT ((lower(name))) DO NOTHING
+    """)
+    inserted = cur.rowcount
+    await cur.execute(f"TRUNCATE {STAGING_TABLE}")
+    return inserted
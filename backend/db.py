@@ -1,131 +1,115 @@
 import os
+from contextlib import contextmanager, asynccontextmanager
 import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+
+import migrations
+
+# Process-wide pools, opened in the FastAPI lifespan (see main.py).
+# The async pool serves the async endpoints; the sync pool serves sync handlers and scripts.
+pool: ConnectionPool | None = None
+async_pool: AsyncConnectionPool | None = None
 
 def get_db_connection():
     conn = psycopg.connect(os.environ["DATABASE_URL"], row_factory=dict_row)
     return conn
 
-def init_db():
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    hashed_password VARCHAR(255) NOT NULL,
-                    is_active BOOLEAN DEFAULT TRUE
-                );
-            """)
-            
-            # Create companies table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS companies (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    employees INT DEFAULT 0,
-                    location VARCHAR(255),
-                    limit_val VARCHAR(255),
-                    description TEXT,
-                    status VARCHAR(50) DEFAULT 'new',
-                    scheduled_at TIMESTAMP,
-                    contact_name VARCHAR(255),
-                    contact_surname VARCHAR(255),
-                    contact_phone VARCHAR(255),
-                    is_ready BOOLEAN DEFAULT FALSE,
-                    is_in_kanban BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
+async def get_async_db_connection():
+    return await psycopg.AsyncConnection.connect(os.environ["DATABASE_URL"], row_factory=dict_row)
+
+def _pool_settings() -> dict:
+    """Pool sizes and timeouts, configurable from the environment."""
+    return {
+        "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", "2")),
+        "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", "10")),
+        "max_idle": float(os.environ.get("DB_POOL_MAX_IDLE", "300")),
+        "timeout": float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+    }
 
-            # Create archived_companies table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS archived_companies (
-                    id SERIAL PRIMARY KEY,
-                    company_name VARCHAR(255) NOT NULL,
-                    location VARCHAR(255),
-                    name VARCHAR(255),
-                    sur_name VARCHAR(255),
-                    phone_number VARCHAR(255),
-                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
+def open_pool():
+    """Create and fill the shared connection pool."""
+    global pool
+    if pool is None:
+        pool = ConnectionPool(
+            os.environ["DATABASE_URL"],
+            kwargs={"row_factory": dict_row},
+            # Health check: verify a connection is alive before handing it out
+            check=ConnectionPool.check_connection,
+            name="app",
+            open=False,
+            **_pool_settings(),
+        )
+        pool.open(wait=True)
+    return pool
 
-            # Ensure columns exist for existing tables
-            try:
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS description TEXT;")
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS status VARCHAR(50) DEFAULT 'new';")
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS scheduled_at TIMESTAMP;")
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS contact_name VARCHAR(255);")
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS contact_surname VARCHAR(255);")
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS contact_phone VARCHAR(255);")
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS is_ready BOOLEAN DEFAULT FALSE;")
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS is_in_kanban BOOLEAN DEFAULT FALSE;")
-                # Centralized workflow columns
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS workflow_bucket VARCHAR(10) DEFAULT 'ALL';")
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS kanban_column VARCHAR(30) DEFAULT NULL;")
-                cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;")
-            except Exception:
-                pass # Should not fail with IF NOT EXISTS, but being safe.
+def close_pool():
+    global pool
+    if pool is not None:
+        pool.close()
+        pool = None
 
-            # Backfill workflow_bucket from legacy boolean flags (idempotent)
-            cur.execute("""
-                UPDATE companies SET workflow_bucket = 'KANBAN', kanban_column = status
-                WHERE is_in_kanban = TRUE AND workflow_bucket = 'ALL'
-            """)
-            cur.execute("""
-                UPDATE companies SET workflow_bucket = 'READY'
-                WHERE is_ready = TRUE AND is_in_kanban = FALSE AND workflow_bucket = 'ALL'
-            """)
+async def open_async_pool():
+    """Create and fill the shared async connection pool."""
+    global async_pool
+    if async_pool is None:
+        async_pool = AsyncConnectionPool(
+            os.environ["DATABASE_URL"],
+            kwargs={"row_factory": dict_row},
+            check=AsyncConnectionPool.check_connection,
+            name="app-async",
+            open=False,
+            **_pool_settings(),
+        )
+        await async_pool.open(wait=True)
+    return async_pool
 
-            # Activity log for tracking workflow transitions
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS activity_log (
-                    id SERIAL PRIMARY KEY,
-                    company_id INTEGER NOT NULL,
-                    action VARCHAR(100) NOT NULL,
-                    old_value VARCHAR(255),
-                    new_value VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
+async def close_async_pool():
+    global async_pool
+    if async_pool is not None:
+        await async_pool.close()
+        async_pool = None
 
-            # Create company_column_mappings table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS company_column_mappings (
-                    id SERIAL PRIMARY KEY,
-                    csv_header VARCHAR(255) UNIQUE NOT NULL,
-                    db_field VARCHAR(255) NOT NULL
-                );
-            """)
-            
-            # Seed default mappings
-            # We use ON CONFLICT DO NOTHING to add new defaults without overwriting or duplicating
-            default_mappings = [
-                ('Company Name', 'name'),
-                ('Organization', 'name'),
-                ('Name', 'name'),
-                ('Number of Employees', 'employees'),
-                ('Employees', 'employees'),
-                ('Staff Count', 'employees'),
-                ('Location', 'location'),
-                ('City', 'location'),
-                ('Address', 'location'),
-                ('Limit', 'limit_val'),
-                ('clients_company', 'name'),
-                ('location_office', 'location'),
-                ('previous_call_summary', 'description'), # Just in case they want this mapped to something, but we don't have description field yet?
-                # The companies table has: id, name, employees, location, limit_val, created_at.
-                # Use only what we have.
-            ]
-            for header, field in default_mappings:
-                    cur.execute(
-                    "INSERT INTO company_column_mappings (csv_header, db_field) VALUES (%s, %s) ON CONFLICT (csv_header) DO NOTHING",
-                    (header, field)
-                )
+@contextmanager
+def connection():
+    """
+    Borrow a connection from the shared pool.
+    Falls back to a one-off connection when the pool is not running (scripts, tests without lifespan).
+    """
+    if pool is None:
+        conn = get_db_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+    with pool.connection() as conn:
+        yield conn
 
-            conn.commit()
+@asynccontextmanager
+async def async_connection():
+    """Async counterpart of connection()."""
+    if async_pool is None:
+        conn = await get_async_db_connection()
+        try:
+            yield conn
+        finally:
+            await conn.close()
+        return
+    async with async_pool.connection() as conn:
+        yield conn
+
+def pool_stats() -> dict:
+    """Pool sizes plus checkout/wait counters (requests_num, requests_wait_ms, usage_ms, ...)."""
+    stats = {}
+    for key, p in (("sync", pool), ("async", async_pool)):
+        stats[key] = {"open": True, **p.get_stats()} if p is not None else {"open": False}
+    return stats
+
+def init_db():
+    """Bring the schema up to date; see migrations.py. Cheap when nothing is pending."""
+    conn = psycopg.connect(os.environ["DATABASE_URL"], row_factory=dict_row, autocommit=True)
+    try:
+        migrations.migrate(conn)
     finally:
         conn.close()
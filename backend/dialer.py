@@ -0,0 +1,384 @@
+"""
+Outbound call dispatch to the ElevenLabs loader (`/load_json`).
+
+send-call-queue only enqueues: companies go into the `call_outbox` table and the request
+returns at once. A worker task started in the app lifespan drains the outbox at up to
+DIALER_CALLS_PER_MINUTE, taking entries whose scheduled_at has come (earliest first). It
+claims them with FOR UPDATE SKIP LOCKED and a lease (`locked_until`), sends them, and
+records the outcome on the outbox and on the companies' status. A claim left behind by a
+crash or restart expires with its lease and is picked up again, so nothing is lost; a
+failed send is retried with a growing delay, up to DIALER_MAX_DELIVERIES times. Several
+processes can run the worker side by side; the rate limit applies per process.
+
+Sending reuses one pooled httpx.AsyncClient. A claimed set is split into batches of
+DIALER_BATCH_SIZE companies, posted concurrently (at most DIALER_CONCURRENCY at once).
+Every item carries its own idempotency key, the id of its outbox entry. An entry is
+created per enqueue, so redelivering it reuses the key, however the re-drain groups the
+batches, while queueing the company again gets a new one. The batch's Idempotency-Key
+header is derived from its items' keys. Batches are retried with exponential backoff on
+timeouts, connection errors, 429 and 5xx. No transaction is held open while batches are
+in flight.
+"""
+import asyncio
+import hashlib
+import os
+import random
+from datetime import datetime
+
+import httpx
+import psycopg
+
+import activity
+import db
+
+BATCH_SIZE = int(os.environ.get("DIALER_BATCH_SIZE", "100"))
+CONCURRENCY = int(os.environ.get("DIALER_CONCURRENCY", "4"))
+MAX_ATTEMPTS = int(os.environ.get("DIALER_MAX_ATTEMPTS", "4"))
+BACKOFF_SECONDS = float(os.environ.get("DIALER_BACKOFF_SECONDS", "0.5"))
+TIMEOUT_SECONDS = float(os.environ.get("DIALER_TIMEOUT_SECONDS", "30"))
+
+# Worker: outbox drain rate, polling interval, and redelivery of failed sends
+CALLS_PER_MINUTE = float(os.environ.get("DIALER_CALLS_PER_MINUTE", "60"))
+POLL_SECONDS = float(os.environ.get("DIALER_POLL_SECONDS", "1"))
+MAX_DELIVERIES = int(os.environ.get("DIALER_MAX_DELIVERIES", "5"))
+REDELIVERY_DELAY_SECONDS = int(os.environ.get("DIALER_REDELIVERY_DELAY_SECONDS", "60"))
+# Longest wait between two attempts at a batch. A longer Retry-After ends the attempts and the
+# outbox redelivers the batch later, rather than sleeping while the lease runs out.
+MAX_RETRY_DELAY_SECONDS = float(os.environ.get("DIALER_MAX_RETRY_DELAY_SECONDS", "10"))
+# Longer than a claimed set can take to send with all its retries and the waits between them
+LEASE_SECONDS = int(TIMEOUT_SECONDS * MAX_ATTEMPTS + MAX_RETRY_DELAY_SECONDS * (MAX_ATTEMPTS - 1) + 30)
+WORKER_ENABLED = os.environ.get("DIALER_WORKER", "1") == "1"
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+client: httpx.AsyncClient | None = None
+_counters = {"batches_sent": 0, "batches_failed": 0, "retries": 0,
+             "calls_sent": 0, "calls_requeued": 0, "calls_failed": 0}
+_worker: asyncio.Task | None = None
+_wakeup: asyncio.Event | None = None
+
+
+async def open_client():
+    global client
+    if client is None:
+        # Read here rather than at import so values from .env (loaded by main.py) apply
+        client = httpx.AsyncClient(
+            base_url=os.environ.get("ELEVENLABS_API_URL", "http://127.0.0.1:10050"),
+            timeout=httpx.Timeout(TIMEOUT_SECONDS, connect=5.0),
+            limits=httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY),
+        )
+    return client
+
+
+async def close_client():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+def item_key(company: dict) -> str:
+    # One outbox entry per enqueue: the same entry keeps its key across retries and redeliveries
+    return f"outbox-{company['outbox_id']}"
+
+
+def build_item(company: dict) -> dict:
+    return {
+        "idempotency_key": item_key(company),
+        "company_name": company["name"] or "",
+        "location": company["location"] or "",
+        "contact_name": company["contact_name"] or "",
+        "surname": company["contact_surname"] or "",
+        "phone": company["contact_phone"] or "",
+    }
+
+
+def idempotency_key(agent_id: str, phone_id: str, companies: list[dict]) -> str:
+    """Key of a batch: the same outbox entries give the same key, in whatever order."""
+    digest = hashlib.sha256(f"{agent_id}:{phone_id}".encode())
+    for key in sorted(item_key(c) for c in companies):
+        digest.update(f"|{key}".encode())
+    return digest.hexdigest()
+
+
+def _retry_delay(attempt: int, resp: httpx.Response | None) -> float | None:
+    """Seconds to wait before the next attempt, or None when the server asks for longer than we may wait."""
+    retry_after = resp.headers.get("Retry-After") if resp is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after) if float(retry_after) <= MAX_RETRY_DELAY_SECONDS else None
+    # Full jitter keeps concurrent batches from retrying in lockstep
+    return random.uniform(0, min(MAX_RETRY_DELAY_SECONDS, BACKOFF_SECONDS * 2 ** (attempt - 1)))
+
+
+async def _post_batch(companies: list[dict], agent_id: str, phone_id: str, secret: str) -> dict:
+    payload = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "agent_id": agent_id,
+        "elevenlabs_phone_id": phone_id,
+        "call_type": "twilio",
+        "items": [build_item(c) for c in companies],
+    }
+    headers = {
+        "Authorization": f"Bearer {secret}",
+        "Idempotency-Key": idempotency_key(agent_id, phone_id, companies),
+    }
+    result = {"ids": [c["id"] for c in companies], "ok": False, "status_code": None, "attempts": 0,
+              "error": None, "response": None}
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        result["attempts"] = attempt
+        if attempt > 1:
+            _counters["retries"] += 1
+        resp = None
+        try:
+            resp = await client.post("/load_json", json=payload, headers=headers)
+        except httpx.TransportError as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        else:
+            result["status_code"] = resp.status_code
+            if resp.status_code == 200:
+                result.update(ok=True, error=None, response=resp.json())
+                _counters["batches_sent"] += 1
+                return result
+            result["error"] = f"ElevenLabs API error: {resp.status_code} — {resp.text}"
+            if resp.status_code not in _RETRY_STATUSES:
+                break
+        if attempt < MAX_ATTEMPTS:
+            delay = _retry_delay(attempt, resp)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+    _counters["batches_failed"] += 1
+    return result
+
+
+async def dispatch(companies: list[dict], agent_id: str, phone_id: str, secret: str) -> list[dict]:
+    """
+    Send companies in concurrent batches. Returns one result per batch, in order:
+    {ids, ok, status_code, attempts, error, response}.
+    """
+    if client is None:
+        await open_client()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def send(batch):
+        async with semaphore:
+            try:
+                return await _post_batch(batch, agent_id, phone_id, secret)
+            except Exception as e:
+                # E.g. a 200 whose body isn't JSON: fail this batch only, so the others are still recorded
+                print(f"Dialer batch of {len(batch)} failed: {type(e).__name__}: {e}")
+                _counters["batches_failed"] += 1
+                return {"ids": [c["id"] for c in batch], "ok": False, "status_code": None, "attempts": None,
+                        "error": f"{type(e).__name__}: {e}", "response": None}
+
+    batches = [companies[i:i + BATCH_SIZE] for i in range(0, len(companies), BATCH_SIZE)]
+    return await asyncio.gather(*(send(batch) for batch in batches))
+
+
+async def enqueue(cur: psycopg.AsyncCursor, company_ids: list[int], log: activity.ActivityLog,
+                  created_by: str | None = None) -> tuple[list[int], list[int]]:
+    """
+    Put queued kanban companies (those with a scheduled_at) in the outbox and mark them 'queued'.
+    Returns (eligible_ids, queued_ids); eligible companies already pending are not queued twice.
+    """
+    await cur.execute(
+        """
+        WITH eligible AS (
+            SELECT id, scheduled_at FROM companies
+            WHERE id = ANY(%s) AND workflow_bucket = 'KANBAN' AND scheduled_at IS NOT NULL
+        ),
+        queued AS (
+            INSERT INTO call_outbox (company_id, scheduled_at, created_by)
+            SELECT id, scheduled_at, %s FROM eligible ORDER BY scheduled_at, id
+            ON CONFLICT (company_id) WHERE status = 'pending' DO NOTHING
+            RETURNING company_id
+        ),
+        marked AS (
+            UPDATE companies c SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+            FROM queued WHERE c.id = queued.company_id
+            RETURNING c.id
+        )
+        SELECT id, FALSE AS queued FROM eligible
+        UNION ALL
+        SELECT id, TRUE FROM marked
+        """,
+        (company_ids, created_by)
+    )
+    rows = await cur.fetchall()
+    eligible = sorted(r['id'] for r in rows if not r['queued'])
+    queued = sorted(r['id'] for r in rows if r['queued'])
+    log.add_many(queued, "call_queued", None, "queued")
+    return eligible, queued
+
+
+def wake():
+    """Let the worker look at the outbox now instead of at its next poll."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _claim(limit: int) -> list[dict]:
+    """Lease up to `limit` due entries; entries whose company left the kanban queue are cancelled."""
+    async with db.async_connection() as conn, conn.cursor() as cur:
+        await cur.execute(
+            f"""
+            WITH due AS (
+                SELECT o.id, c.id IS NOT NULL AS live
+                FROM call_outbox o
+                LEFT JOIN companies c ON c.id = o.company_id AND c.workflow_bucket = 'KANBAN'
+                WHERE o.status = 'pending' AND o.scheduled_at <= LOCALTIMESTAMP
+                  AND o.next_attempt_at <= LOCALTIMESTAMP
+                  AND (o.locked_until IS NULL OR o.locked_until < LOCALTIMESTAMP)
+                ORDER BY o.scheduled_at, o.id
+                LIMIT %s
+                FOR UPDATE OF o SKIP LOCKED
+            ),
+            dropped AS (
+                UPDATE call_outbox o SET status = 'cancelled', last_error = 'Company left the call queue', locked_until = NULL
+                FROM due WHERE o.id = due.id AND NOT due.live
+            ),
+            claimed AS (
+                UPDATE call_outbox o
+                SET locked_until = LOCALTIMESTAMP + INTERVAL '{LEASE_SECONDS} seconds', attempts = o.attempts + 1
+                FROM due WHERE o.id = due.id AND due.live
+                RETURNING o.id AS outbox_id, o.company_id, o.scheduled_at, o.attempts
+            )
+            SELECT claimed.*, c.id, c.name, c.location, c.contact_name, c.contact_surname, c.contact_phone
+            FROM claimed JOIN companies c ON c.id = claimed.company_id
+            """,
+            (limit,)
+        )
+        claimed = await cur.fetchall()
+        await conn.commit()
+    return claimed
+
+
+async def _record(claimed: list[dict], batches: list[dict]):
+    """Save the outcome of a send: sent entries are done, failed ones go back to pending or give up."""
+    outbox_ids = {c['company_id']: c['outbox_id'] for c in claimed}
+    sent_outbox, sent_files, failed_outbox, failed_errors = [], [], [], []
+    for b in batches:
+        for company_id in b["ids"]:
+            if b["ok"]:
+                sent_outbox.append(outbox_ids[company_id])
+                sent_files.append((b["response"] or {}).get("file_id"))
+            else:
+                failed_outbox.append(outbox_ids[company_id])
+                failed_errors.append(b["error"])
+
+    log = activity.ActivityLog()
+    async with db.async_connection() as conn, conn.cursor() as cur:
+        await cur.execute(
+            """
+            WITH sent AS (
+                UPDATE call_outbox o
+                SET status = 'sent', sent_at = LOCALTIMESTAMP, locked_until = NULL, last_error = NULL,
+                    provider_file_id = r.file_id
+                FROM unnest(%s::int[], %s::varchar[]) AS r(id, file_id)
+                WHERE o.id = r.id
+                RETURNING o.company_id, 'sent'::text AS status
+            ),
+            failed AS (
+                UPDATE call_outbox o
+                SET status = CASE WHEN o.attempts >= %s THEN 'failed' ELSE 'pending' END,
+                    next_attempt_at = LOCALTIMESTAMP + make_interval(secs => %s * 2 ^ (o.attempts - 1)),
+                    locked_until = NULL, last_error = r.error
+                FROM unnest(%s::int[], %s::text[]) AS r(id, error)
+                WHERE o.id = r.id
+                RETURNING o.company_id, o.status
+            ),
+            outcome AS (
+                SELECT * FROM sent UNION ALL SELECT * FROM failed
+            )
+            UPDATE companies c
+            SET status = CASE WHEN outcome.status = 'sent' THEN 'sent' ELSE 'send_failed' END,
+                updated_at = CURRENT_TIMESTAMP
+            FROM outcome
+            WHERE c.id = outcome.company_id AND outcome.status IN ('sent', 'failed')
+            RETURNING c.id, c.status
+            """,
+            (sent_outbox, sent_files, MAX_DELIVERIES, REDELIVERY_DELAY_SECONDS, failed_outbox, failed_errors)
+        )
+        changed = await cur.fetchall()
+        sent_ids = [r['id'] for r in changed if r['status'] == 'sent']
+        gave_up_ids = [r['id'] for r in changed if r['status'] == 'send_failed']
+        log.add_many(sent_ids, "sent_to_elevenlabs", "queued", "sent")
+        log.add_many(gave_up_ids, "call_send_failed", "queued", "send_failed")
+        await log.flush(cur)
+        await conn.commit()
+
+    _counters["calls_sent"] += len(sent_outbox)
+    _counters["calls_failed"] += len(gave_up_ids)
+    _counters["calls_requeued"] += len(failed_outbox) - len(gave_up_ids)
+
+
+async def drain_once(limit: int) -> int:
+    """
+    Claim, send and record up to `limit` due calls. Returns how many were claimed.
+    Each step borrows its own connection, so none is held while batches are in flight.
+    """
+    agent_id = os.environ.get("ELEVENLABS_AGENT_ID", "")
+    phone_id = os.environ.get("ELEVENLABS_PHONE_ID", "")
+    secret = os.environ.get("ELEVENLABS_SECRET_KEY", "testSecret")
+    if not agent_id or not phone_id:
+        return 0
+
+    claimed = await _claim(limit)
+    if not claimed:
+        return 0
+    batches = await dispatch(claimed, agent_id, phone_id, secret)
+    await _record(claimed, batches)
+    return len(claimed)
+
+
+async def _run_worker():
+    # Token bucket: calls accrue at CALLS_PER_MINUTE; at most one cycle's worth is banked
+    tokens, last = 0.0, asyncio.get_running_loop().time()
+    while True:
+        now = asyncio.get_running_loop().time()
+        elapsed, last = now - last, now
+        cap = max(1.0, CALLS_PER_MINUTE * max(POLL_SECONDS, elapsed) / 60)
+        tokens = min(cap, tokens + CALLS_PER_MINUTE * elapsed / 60)
+
+        claimed = 0
+        if tokens >= 1:
+            try:
+                claimed = await drain_once(min(int(tokens), BATCH_SIZE * CONCURRENCY))
+            except Exception as e:
+                print(f"Dialer worker error: {e}")
+            tokens -= claimed
+
+        if claimed == 0 or tokens < 1:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+def start_worker():
+    global _worker, _wakeup
+    if WORKER_ENABLED and _worker is None:
+        _wakeup = asyncio.Event()
+        _worker = asyncio.create_task(_run_worker())
+
+
+async def stop_worker():
+    """Stop the worker; a send in flight is abandoned and redelivered when its lease expires."""
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        await asyncio.gather(_worker, return_exceptions=True)
+        _worker = None
+
+
+def stats() -> dict:
+    return {
+        "client_open": client is not None,
+        "worker_running": _worker is not None and not _worker.done(),
+        "calls_per_minute": CALLS_PER_MINUTE,
+        "batch_size": BATCH_SIZE,
+        "concurrency": CONCURRENCY,
+        **_counters,
+    }
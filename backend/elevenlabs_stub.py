@@ -0,0 +1,57 @@
+"""
+Local stand-in for the ElevenLabs loader, for trying out and benchmarking send-call-queue.
+
+    STUB_LATENCY=0.2 STUB_FAILURE_RATE=0.1 python elevenlabs_stub.py   # listens on :10050
+
+Then run the backend with ELEVENLABS_API_URL=http://127.0.0.1:10050 (the default).
+`/load_json` waits STUB_LATENCY seconds, fails with 503 at STUB_FAILURE_RATE, and answers a
+repeated Idempotency-Key with the original result instead of loading the items again.
+Items whose own idempotency_key was loaded before are skipped, whatever batch they come in.
+`/stats` reports requests, distinct keys and items loaded.
+"""
+import asyncio
+import os
+import random
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Request
+
+LATENCY = float(os.environ.get("STUB_LATENCY", "0.1"))
+FAILURE_RATE = float(os.environ.get("STUB_FAILURE_RATE", "0"))
+
+app = FastAPI()
+results: dict[str, dict] = {}
+loaded_items: set[str] = set()
+counters = {"requests": 0, "failures": 0, "replays": 0, "items": 0}
+
+
+@app.post("/load_json")
+async def load_json(request: Request, idempotency_key: str | None = Header(default=None)):
+    counters["requests"] += 1
+    payload = await request.json()
+    await asyncio.sleep(LATENCY)
+    if random.random() < FAILURE_RATE:
+        counters["failures"] += 1
+        raise HTTPException(status_code=503, detail="stub failure")
+    if idempotency_key and idempotency_key in results:
+        counters["replays"] += 1
+        return results[idempotency_key]
+
+    items = payload.get("items", [])
+    fresh = [i for i in items if i.get("idempotency_key") not in loaded_items]
+    loaded_items.update(i["idempotency_key"] for i in fresh if i.get("idempotency_key"))
+    counters["items"] += len(fresh)
+    result = {"file_id": str(uuid.uuid4()), "inserted": len(fresh), "skipped": len(items) - len(fresh)}
+    if idempotency_key:
+        results[idempotency_key] = result
+    return result
+
+
+@app.get("/stats")
+def stats():
+    return {**counters, "keys": len(results)}
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.environ.get("STUB_PORT", "10050")), log_level="warning")
@@ -0,0 +1,113 @@
+"""
+Chunked fan-out for bulk AI enrichment.
+
+A whole selection in one prompt runs into the model's output-token limit and loses every
+company when the one request fails. `run` splits the input into chunks of AI_CHUNK_SIZE,
+sends up to AI_CONCURRENCY of them at once and merges what came back by id. A chunk whose
+answer was truncated or isn't valid JSON (MalformedAnswer) is asked again, up to
+AI_CHUNK_ATTEMPTS times. 429/5xx and an open circuit are left to the Gemini call itself
+(ai_limits.guarded), which backs off under the shared rate limiter; retrying those here as
+well would multiply load exactly when the limiter is shedding it. Companies the model left
+out of its answer are reported as missing; companies whose chunk failed as failed.
+"""
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException, Response
+
+CHUNK_SIZE = int(os.environ.get("AI_CHUNK_SIZE", "10"))
+CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", "4"))
+# Tries per chunk when the model's answer can't be parsed
+MAX_ATTEMPTS = int(os.environ.get("AI_CHUNK_ATTEMPTS", "3"))
+
+# Bulk call for one chunk, e.g. ai_service.estimate_headcount_bulk_async
+ChunkFn = Callable[[list[dict]], Awaitable[list[dict]]]
+
+
+class MalformedAnswer(HTTPException):
+    """The model answered, but truncated or not as JSON; asking again usually helps."""
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=500, detail=detail)
+
+
+@dataclass
+class Enrichment:
+    # One result per company the model answered for, in input order, carrying the input's id
+    results: list[dict]
+    missing_ids: list = field(default_factory=list)
+    failed_ids: list = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+    # Status of the first failed chunk, e.g. 503 while Gemini's circuit is open
+    error_status: int | None = None
+    # Companies answered from ai_cache instead of the model
+    cache_hits: int = 0
+
+    def set_headers(self, response: Response):
+        if self.missing_ids:
+            response.headers["X-Missing-Ids"] = ",".join(str(i) for i in self.missing_ids)
+        if self.failed_ids:
+            response.headers["X-Failed-Ids"] = ",".join(str(i) for i in self.failed_ids)
+        response.headers["X-Cache-Hits"] = str(self.cache_hits)
+
+    def raise_if_nothing_answered(self):
+        # Every chunk failed: surface the first failure with its own status
+        if self.errors and not self.results:
+            raise HTTPException(status_code=self.error_status or 500, detail=self.errors[0])
+
+
+def chunked(items: list, size: int) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def _call(fn: ChunkFn, chunk: list[dict], semaphore: asyncio.Semaphore) -> list[dict]:
+    async with semaphore:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                return await fn(chunk)
+            except MalformedAnswer as e:
+                if attempt >= MAX_ATTEMPTS:
+                    raise
+                print(f"AI chunk of {len(chunk)} got a malformed answer ({e.detail}); asking again")
+
+
+async def run(fn: ChunkFn, companies: list[dict], chunk_size: int | None = None,
+              concurrency: int | None = None) -> Enrichment:
+    """
+    Run `fn` over `companies` (dicts with an 'id') chunk by chunk. Results are matched to the
+    input by str(id); answers for ids that weren't asked about, and repeats, are dropped.
+    """
+    chunks = chunked(companies, max(1, chunk_size or CHUNK_SIZE))
+    semaphore = asyncio.Semaphore(max(1, concurrency or CONCURRENCY))
+    outcomes = await asyncio.gather(
+        *(_call(fn, chunk, semaphore) for chunk in chunks), return_exceptions=True
+    )
+
+    answered: dict[str, dict] = {}
+    enrichment = Enrichment(results=[])
+    for chunk, outcome in zip(chunks, outcomes):
+        expected = {str(c["id"]) for c in chunk}
+        if isinstance(outcome, BaseException):
+            enrichment.failed_ids.extend(c["id"] for c in chunk)
+            print(f"AI chunk of {len(chunk)} failed: {outcome}")
+            enrichment.errors.append(str(getattr(outcome, "detail", None) or outcome))
+            if enrichment.error_status is None:
+                enrichment.error_status = getattr(outcome, "status_code", 500)
+            continue
+        for row in outcome:
+            if not isinstance(row, dict):
+                continue
+            key = str(row.get("id"))
+            if key in expected and key not in answered:
+                answered[key] = row
+
+    failed = {str(i) for i in enrichment.failed_ids}
+    for company in companies:
+        key = str(company["id"])
+        if key in answered:
+            enrichment.results.append({**answered[key], "id": company["id"]})
+        elif key not in failed:
+            enrichment.missing_ids.append(company["id"])
+    return enrichment
@@ -0,0 +1,142 @@
+"""
+Server-side AI enrichment jobs.
+
+The UI hands over company ids and polls /jobs/{job_id}; nothing but progress crosses the
+wire. A job (jobs.py) loads the companies, sends them to Gemini BATCH_SIZE at a time
+through the cache and the chunked fan-out (ai_cache.run_cached), and writes each batch's
+answers into `companies` before reporting progress. Every report commits, so a closed tab
+loses nothing and a cancelled or interrupted job keeps the batches already saved.
+"""
+import os
+
+import psycopg
+
+import ai_cache
+import enrichment
+import jobs
+
+# Companies per Gemini round and per UPDATE; each round is chunked and run in parallel
+BATCH_SIZE = int(os.environ.get("AI_JOB_BATCH_SIZE", "100"))
+
+
+def headcount_estimate(result: dict) -> int | None:
+    """Single employee count from a headcount answer: the value, else the middle of its range."""
+    headcount = result.get("headcount") or {}
+    value, low, high = headcount.get("value"), headcount.get("min"), headcount.get("max")
+    if value:
+        return value
+    if low and high:
+        return (low + high) // 2
+    return low or high or None
+
+
+def formal_phone(phone: str | None) -> str | None:
+    # Formalize the phone number: remove non-digits and prepend '1' if missing
+    digits = "".join(filter(str.isdigit, phone or ""))
+    if not digits:
+        return None
+    return digits if digits.startswith("1") else "1" + digits
+
+
+async def save_employees(cur: psycopg.AsyncCursor, ids: list[int], employees: list[int]) -> list[int]:
+    """Set employees per id in one statement; if an id repeats, the last one wins. Returns the ids updated."""
+    await cur.execute("""
+        UPDATE companies c SET employees = u.employees
+        FROM (
+            SELECT DISTINCT ON (id) id, employees
+            FROM unnest(%s::int[], %s::int[]) WITH ORDINALITY AS u(id, employees, ord)
+            ORDER BY id, ord DESC
+        ) u
+        WHERE c.id = u.id
+        RETURNING c.id
+    """, (ids, employees))
+    return [row['id'] for row in await cur.fetchall()]
+
+
+async def save_contacts(cur: psycopg.AsyncCursor, ids: list[int], names: list, sur_names: list, phones: list) -> list[int]:
+    """Set contact fields of ready companies; NULL leaves a field unchanged. Returns the ids updated."""
+    # If an id repeats, the last update wins
+    await cur.execute("""
+        UPDATE companies c SET
+            contact_name = COALESCE(u.name, c.contact_name),
+            contact_surname = COALESCE(u.sur_name, c.contact_surname),
+            contact_phone = COALESCE(u.phone, c.contact_phone)
+        FROM (
+            SELECT DISTINCT ON (id) id, name, sur_name, phone
+            FROM unnest(%s::int[], %s::text[], %s::text[], %s::text[])
+                 WITH ORDINALITY AS u(id, name, sur_name, phone, ord)
+            ORDER BY id, ord DESC
+        ) u
+        WHERE c.id = u.id AND c.workflow_bucket = 'READY'
+        RETURNING c.id
+    """, (ids, names, sur_names, phones))
+    return [row['id'] for row in await cur.fetchall()]
+
+
+async def _save_headcounts(cur: psycopg.AsyncCursor, results: list[dict]) -> list[int]:
+    estimates = [(r["id"], headcount_estimate(r)) for r in results]
+    estimates = [(i, n) for i, n in estimates if n]
+    if not estimates:
+        return []
+    return await save_employees(cur, [i for i, _ in estimates], [n for _, n in estimates])
+
+
+async def _save_decision_makers(cur: psycopg.AsyncCursor, results: list[dict]) -> list[int]:
+    found = [(r["id"], r.get("name"), r.get("sur_name"), formal_phone(r.get("phone_number"))) for r in results]
+    found = [f for f in found if any(f[1:])]
+    if not found:
+        return []
+    return await save_contacts(cur, *(list(column) for column in zip(*found)))
+
+
+async def _run(job_id: int, company_ids: list[int], select_sql: str, namespace: str, fn: enrichment.ChunkFn,
+               save, name_field: str = "name"):
+    async def work(conn, report):
+        async with conn.cursor() as cur:
+            await cur.execute(select_sql, (company_ids,))
+            companies = await cur.fetchall()
+            counters = {
+                "total": len(companies), "processed": 0, "updated": 0, "missing": 0, "failed": 0,
+                "cache_hits": 0, "not_found": len(set(company_ids)) - len(companies),
+            }
+            await report(counters)
+
+            errors = []
+            for batch in enrichment.chunked(companies, BATCH_SIZE):
+                result = await ai_cache.run_cached(namespace, fn, batch, name_field=name_field)
+                updated = await save(cur, result.results)
+                counters["processed"] += len(batch)
+                counters["updated"] += len(updated)
+                counters["missing"] += len(result.missing_ids)
+                counters["failed"] += len(result.failed_ids)
+                counters["cache_hits"] += result.cache_hits
+                errors.extend(result.errors)
+                await report(counters)
+
+            if companies and counters["failed"] == len(companies):
+                raise Exception(errors[0] if errors else "Every AI request failed")
+
+    await jobs.run(job_id, work)
+
+
+async def run_headcount_job(job_id: int, company_ids: list[int]):
+    """Estimate and save employees for companies."""
+    from ai_service import estimate_headcount_bulk_async, HEADCOUNT_CACHE
+    await _run(
+        job_id, company_ids,
+        "SELECT id, name, COALESCE(location, '') AS location FROM companies WHERE id = ANY(%s) ORDER BY id",
+        HEADCOUNT_CACHE, estimate_headcount_bulk_async, _save_headcounts,
+    )
+
+
+async def run_decision_maker_job(job_id: int, company_ids: list[int]):
+    """Find and save the decision maker's name and phone for ready companies."""
+    from ai_service import find_decision_maker_bulk_async, DECISION_MAKER_CACHE
+    await _run(
+        job_id, company_ids,
+        """
+        SELECT id, name AS company_name, COALESCE(location, '') AS location
+        FROM companies WHERE id = ANY(%s) AND workflow_bucket = 'READY' ORDER BY id
+        """,
+        DECISION_MAKER_CACHE, find_decision_maker_bulk_async, _save_decision_makers, name_field="company_name",
+    )
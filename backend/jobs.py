@@ -0,0 +1,210 @@
+"""
+Background jobs.
+
+Job state lives in the `jobs` table, so any worker process can report progress or
+accept a cancel request. The work itself runs as an asyncio task in the process
+that created the job, on its own pooled connection.
+
+Each job records its owner, the process that runs it. That process sends a heartbeat
+for all its unfinished jobs every HEARTBEAT_SECONDS, whether they are running or still
+waiting for a slot. Every process also sweeps periodically: unfinished jobs of another
+owner whose heartbeat is older than STALE_AFTER belonged to a process that died, and
+are marked failed. A live worker's jobs are never swept, however long they queue.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from functools import partial
+
+import psycopg
+from psycopg.types.json import Jsonb
+
+import db
+
+# Jobs that run at once in this process; further jobs wait in 'queued'
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "2"))
+
+HEARTBEAT_SECONDS = 30
+# A queued/running job whose heartbeat is older than this belonged to a worker that died
+STALE_AFTER = "2 minutes"
+
+# This process; unique across restarts, so a restarted process never claims its predecessor's jobs
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_slots = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+_tasks: set[asyncio.Task] = set()
+_heartbeat: asyncio.Task | None = None
+
+
+class JobCancelled(Exception):
+    pass
+
+
+async def create_job(cur: psycopg.AsyncCursor, kind: str, created_by: str | None = None) -> dict:
+    await cur.execute(
+        "INSERT INTO jobs (kind, created_by, owner, heartbeat_at) VALUES (%s, %s, %s, CURRENT_TIMESTAMP) RETURNING *",
+        (kind, created_by, OWNER)
+    )
+    return await cur.fetchone()
+
+
+async def get_job(cur: psycopg.AsyncCursor, job_id: int) -> dict | None:
+    """Job row plus `rate_per_second`: processed items per second of running time."""
+    await cur.execute(
+        """
+        SELECT *, EXTRACT(EPOCH FROM COALESCE(finished_at, CURRENT_TIMESTAMP) - started_at) AS elapsed
+        FROM jobs WHERE id = %s
+        """,
+        (job_id,)
+    )
+    job = await cur.fetchone()
+    if job is None:
+        return None
+    elapsed = job.pop('elapsed')
+    processed = (job['counters'] or {}).get('processed', 0)
+    job['rate_per_second'] = round(processed / float(elapsed), 2) if elapsed else None
+    return job
+
+
+async def request_cancel(cur: psycopg.AsyncCursor, job_id: int) -> bool:
+    """Flag a queued or running job; the worker stops at its next progress report."""
+    await cur.execute(
+        """
+        UPDATE jobs SET cancel_requested = TRUE, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND status IN ('queued', 'running')
+        RETURNING id
+        """,
+        (job_id,)
+    )
+    return await cur.fetchone() is not None
+
+
+def spawn(coro):
+    """Run a job coroutine in the background, keeping a reference so it is not garbage collected."""
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def run(job_id: int, work):
+    """
+    Execute `work(conn, report)` for a job and record its outcome.
+    `report(counters)` saves progress, commits the work done so far on `conn`,
+    and raises JobCancelled if a cancel was requested.
+    """
+    async with _slots:
+        async with db.async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    UPDATE jobs SET status = 'running', started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND NOT cancel_requested
+                    RETURNING id
+                    """,
+                    (job_id,)
+                )
+                started = await cur.fetchone()
+            await conn.commit()
+            if not started:
+                await _finish(conn, job_id, 'cancelled')
+                return
+
+            try:
+                await work(conn, partial(_report, conn, job_id))
+            except JobCancelled:
+                await conn.rollback()
+                await _finish(conn, job_id, 'cancelled')
+            except asyncio.CancelledError:
+                await conn.rollback()
+                await _finish(conn, job_id, 'cancelled', "Worker shut down")
+                raise
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                await conn.rollback()
+                await _finish(conn, job_id, 'failed', str(e))
+            else:
+                await _finish(conn, job_id, 'completed')
+
+
+async def _report(conn: psycopg.AsyncConnection, job_id: int, counters: dict):
+    async with conn.cursor() as cur:
+        await cur.execute(
+            """
+            UPDATE jobs SET counters = %s, updated_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = %s RETURNING cancel_requested
+            """,
+            (Jsonb(counters), job_id)
+        )
+        row = await cur.fetchone()
+    await conn.commit()
+    if row and row['cancel_requested']:
+        raise JobCancelled()
+
+
+async def _finish(conn: psycopg.AsyncConnection, job_id: int, status: str, error: str | None = None):
+    await conn.execute(
+        """
+        UPDATE jobs SET status = %s, error = %s, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+        """,
+        (status, error, job_id)
+    )
+    await conn.commit()
+
+
+async def fail_stale_jobs() -> int:
+    """Mark jobs abandoned by a dead process as failed. Returns how many were."""
+    async with db.async_connection() as conn:
+        cur = await conn.execute(
+            f"""
+            UPDATE jobs SET status = 'failed', error = 'Interrupted: worker stopped',
+                finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE status IN ('queued', 'running') AND owner IS DISTINCT FROM %s
+              AND COALESCE(heartbeat_at, updated_at) < CURRENT_TIMESTAMP - INTERVAL '{STALE_AFTER}'
+            """,
+            (OWNER,)
+        )
+        await conn.commit()
+        return cur.rowcount
+
+
+async def heartbeat():
+    """Tell other processes this one's unfinished jobs are alive."""
+    async with db.async_connection() as conn:
+        await conn.execute(
+            "UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE owner = %s AND status IN ('queued', 'running')",
+            (OWNER,)
+        )
+        await conn.commit()
+
+
+async def _run_heartbeat():
+    while True:
+        try:
+            await heartbeat()
+            failed = await fail_stale_jobs()
+            if failed:
+                print(f"Failed {failed} jobs abandoned by a stopped worker")
+        except Exception as e:
+            print(f"Job heartbeat failed: {e}")
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+
+
+def start_heartbeat():
+    global _heartbeat
+    if _heartbeat is None:
+        _heartbeat = asyncio.create_task(_run_heartbeat())
+
+
+async def shutdown():
+    """Cancel jobs still running in this process; they are recorded as cancelled."""
+    global _heartbeat
+    if _heartbeat is not None:
+        _heartbeat.cancel()
+        await asyncio.gather(_heartbeat, return_exceptions=True)
+        _heartbeat = None
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
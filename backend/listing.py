@@ -0,0 +1,180 @@
+"""
+Paginated, filtered listings.
+
+Pages use keyset (cursor) pagination: the cursor carries the sort value and id of the
+last row returned, and the next page starts strictly after it. Each page is a range scan
+on a (sort key, id) index, so page 500 costs the same as page 1 and rows inserted while
+the client scrolls do not shift or repeat entries.
+"""
+import base64
+import json
+from dataclasses import dataclass
+
+import psycopg
+from fastapi import HTTPException, Response
+
+MAX_PAGE_SIZE = 1000
+
+
+@dataclass(frozen=True)
+class SortKey:
+    # SQL expression rows are ordered by; nullable columns are COALESCEd so keyset comparisons stay total
+    expr: str
+    # Type the cursor value is cast back to
+    sql_type: str
+
+
+# Sortable columns per listing, keyed by the names the UI uses
+COMPANY_SORTS = {
+    "created_at": SortKey("created_at", "timestamp"),
+    "name": SortKey("name", "text"),
+    "employees": SortKey("employees", "int"),
+    "location": SortKey("COALESCE(location, '')", "text"),
+}
+READY_COMPANY_SORTS = {
+    "created_at": SortKey("created_at", "timestamp"),
+    "company_name": SortKey("name", "text"),
+    "location": SortKey("COALESCE(location, '')", "text"),
+    "name": SortKey("COALESCE(contact_name, '')", "text"),
+    "sur_name": SortKey("COALESCE(contact_surname, '')", "text"),
+    "phone_number": SortKey("COALESCE(contact_phone, '')", "text"),
+}
+ARCHIVED_COMPANY_SORTS = {
+    "archived_at": SortKey("archived_at", "timestamp"),
+    "company_name": SortKey("company_name", "text"),
+    "location": SortKey("COALESCE(location, '')", "text"),
+    "name": SortKey("COALESCE(name, '')", "text"),
+    "sur_name": SortKey("COALESCE(sur_name, '')", "text"),
+    "phone_number": SortKey("COALESCE(phone_number, '')", "text"),
+}
+
+ACTIVITY_SORTS = {
+    "created_at": SortKey("created_at", "timestamp"),
+}
+
+
+@dataclass
+class PageParams:
+    """Query parameters shared by paginated endpoints; use as `page: listing.PageParams = Depends()`."""
+    limit: int | None = None
+    cursor: str | None = None
+    order: str = "desc"
+    include_total: bool = False
+
+
+def sort_key(sorts: dict[str, SortKey], sort: str) -> SortKey:
+    if sort not in sorts:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(sorts)}")
+    return sorts[sort]
+
+
+@dataclass
+class Page:
+    rows: list[dict]
+    next_cursor: str | None = None
+    total: int | None = None
+
+    def set_headers(self, response: Response):
+        if self.next_cursor:
+            response.headers["X-Next-Cursor"] = self.next_cursor
+        if self.total is not None:
+            response.headers["X-Total-Count"] = str(self.total)
+
+
+def encode_cursor(sort_value, row_id: int) -> str:
+    value = sort_value.isoformat() if hasattr(sort_value, "isoformat") else sort_value
+    raw = json.dumps([value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, row_id = json.loads(raw)
+        row_id = int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Anything else (lists, objects, null) can't be bound as the sort value
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value, row_id
+
+
+def contains(column: str, value: str | None, where: list[str], params: list):
+    """Case-insensitive substring filter, matching the table's filter inputs."""
+    if value:
+        escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        where.append(f"{column} ILIKE %s")
+        params.append(f"%{escaped}%")
+
+
+def compare(column: str, value: str | None, where: list[str], params: list):
+    """Numeric filter: '>N', '<N' or 'N'. Values that are not numbers are ignored, like in the UI."""
+    if not value:
+        return
+    value = value.strip()
+    op = "="
+    if value[:1] in ("<", ">"):
+        op, value = value[0], value[1:]
+    try:
+        number = int(value)
+    except ValueError:
+        return
+    where.append(f"{column} {op} %s")
+    params.append(number)
+
+
+async def fetch_page(
+    cur: psycopg.AsyncCursor,
+    table: str,
+    where: list[str],
+    params: list,
+    sort: SortKey,
+    page: PageParams,
+) -> Page:
+    """
+    One page of `table` rows matching `where` (ANDed), ordered by `sort` then id.
+    Without `limit` every matching row is returned, as the endpoints did before pagination.
+    """
+    order, limit, cursor = page.order, page.limit, page.cursor
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    total = None
+    if page.include_total:
+        await cur.execute(
+            f"SELECT count(*) AS count FROM {table} WHERE {' AND '.join(where) or 'TRUE'}",
+            params
+        )
+        total = (await cur.fetchone())['count']
+
+    page_where, page_params = list(where), list(params)
+    if cursor:
+        value, row_id = decode_cursor(cursor)
+        page_where.append(f"({sort.expr}, id) {'<' if order == 'desc' else '>'} (%s::{sort.sql_type}, %s)")
+        page_params += [value, row_id]
+
+    query = f"""
+        SELECT *, {sort.expr} AS _sort_value FROM {table}
+        WHERE {' AND '.join(page_where) or 'TRUE'}
+        ORDER BY {sort.expr} {order}, id {order}
+    """
+    if limit is not None:
+        # One extra row tells whether there is a next page
+        query += " LIMIT %s"
+        page_params.append(limit + 1)
+    try:
+        await cur.execute(query, page_params)
+    except psycopg.errors.DataError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = await cur.fetchall()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['_sort_value'], rows[-1]['id'])
+    for row in rows:
+        del row['_sort_value']
+    return Page(rows, next_cursor, total)
@@ -1,29 +1,48 @@
 import os
+import re
 import json
-import httpx
 from contextlib import asynccontextmanager
 from typing import Annotated
-from datetime import datetime
 from dotenv import load_dotenv
-import csv
-import io
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 import psycopg
 from jose import JWTError, jwt
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 import db
 import models
+import activity
+import ai_cache
+import ai_limits
 import auth
+import csv_import
+import dialer
+import enrichment_jobs
+import jobs
+import listing
+import scheduling
+import workflow
 
 load_dotenv()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     db.init_db()
+    db.open_pool()
+    await db.open_async_pool()
+    jobs.start_heartbeat()
+    await dialer.open_client()
+    dialer.start_worker()
+    activity.start_maintenance()
     yield
+    await activity.stop_maintenance()
+    await jobs.shutdown()
+    await dialer.stop_worker()
+    await dialer.close_client()
+    await db.close_async_pool()
+    db.close_pool()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -40,8 +59,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Missing-Ids", "X-Failed-Ids", "X-Cache-Hits"],
 )
 
+def get_db():
+    """Request-scoped connection from the shared pool; returned to the pool when the request ends."""
+    with db.connection() as conn:
+        yield conn
+
+async def get_async_db():
+    """Async variant of get_db for the async endpoints, so queries don't block the event loop."""
+    async with db.async_connection() as conn:
+        yield conn
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -56,21 +86,25 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         token_data = models.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE username = %s", (token_data.username,))
-            user = cur.fetchone()
-            if user is None:
-                raise credentials_exception
-            return models.User(**user)
-    finally:
-        conn.close()
+
+    user = auth.user_cache.get(token_data.username)
+    if user is None:
+        # Only a cache miss borrows a connection, and only for this one lookup
+        async with db.async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT * FROM users WHERE username = %s", (token_data.username,))
+                row = await cur.fetchone()
+        if row is None:
+            raise credentials_exception
+        user = models.User(**row)
+        auth.user_cache.set(token_data.username, user, token_exp=payload.get("exp"))
+
+    if not user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return user
 
 @app.post("/register", response_model=models.User)
-async def register(user: models.UserCreate):
-    conn = db.get_db_connection()
+def register(user: models.UserCreate, conn: psycopg.Connection = Depends(get_db)):
     try:
         with conn.cursor() as cur:
             cur.execute("SELECT * FROM users WHERE username = %s OR email = %s", (user.username, user.email))
@@ -91,32 +125,48 @@ async def register(user: models.UserCreate):
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.post("/token", response_model=models.Token)
-async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE username = %s", (form_data.username,))
-            user = cur.fetchone()
-            if not user or not auth.verify_password(form_data.password, user["hashed_password"]):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Incorrect username or password",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
-            
-            access_token = auth.create_access_token(data={"sub": user["username"]})
-            return {"access_token": access_token, "token_type": "bearer"}
-    finally:
-        conn.close()
+def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], conn: psycopg.Connection = Depends(get_db)):
+    with conn.cursor() as cur:
+        cur.execute("SELECT * FROM users WHERE username = %s", (form_data.username,))
+        user = cur.fetchone()
+        if not user or not auth.verify_password(form_data.password, user["hashed_password"]):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        
+        access_token = auth.create_access_token(data={"sub": user["username"]})
+        return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/users/me", response_model=models.User)
 async def read_users_me(current_user: Annotated[models.User, Depends(get_current_user)]):
     return current_user
 
+@app.post("/users/{username}/deactivate", response_model=models.User)
+async def deactivate_user(username: str, current_user: Annotated[models.User, Depends(get_current_user)], conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """
+    Deactivate your own account. There are no admin roles, so nobody can deactivate someone else.
+    The user cache entry is dropped only in the worker serving this request; other workers keep
+    accepting the user's token until their cached entry expires (USER_CACHE_TTL, 60s by default).
+    """
+    if username != current_user.username:
+        raise HTTPException(status_code=403, detail="You can only deactivate your own account")
+    async with conn.cursor() as cur:
+        await cur.execute(
+            "UPDATE users SET is_active = FALSE WHERE username = %s RETURNING id, username, email, is_active",
+            (username,)
+        )
+        user = await cur.fetchone()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        await conn.commit()
+    # Cached entries would otherwise keep the user authenticated until they expire
+    auth.user_cache.invalidate(username)
+    return models.User(**user)
+
 @app.get("/")
 async def root():
     return {"message": "Hello from FastAPI"}
@@ -133,314 +183,241 @@ def health_db():
             value = cur.fetchone()[0]
     return {"db": "ok", "value": value}
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "db_pool": db.pool_stats(),
+        "user_cache": auth.user_cache.stats(),
+        "dialer": dialer.stats(),
+        "ai_cache": ai_cache.stats(),
+        "gemini": ai_limits.stats(),
+    }
+
 @app.post("/companies/upload", status_code=status.HTTP_201_CREATED)
-async def upload_companies(file: UploadFile = File(...), current_user: models.User = Depends(get_current_user)):
+async def upload_companies(response: Response, file: UploadFile = File(...), background: bool = False, include_total: bool = False, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Invalid file format. Please upload a CSV file.")
 
-    content = await file.read()
-    decoded_content = content.decode('utf-8')
-    csv_reader = csv.DictReader(io.StringIO(decoded_content))
-    
-    # Get column mappings
-    conn = db.get_db_connection()
+    if background:
+        # Large files: hand off to a background job and let the client poll /jobs/{job_id}
+        path = await csv_import.spool_upload(file)
+        try:
+            async with conn.cursor() as cur:
+                job = await jobs.create_job(cur, 'company_import', current_user.username)
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            os.unlink(path)
+            raise HTTPException(status_code=500, detail=str(e))
+        jobs.spawn(csv_import.run_import_job(job['id'], path))
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"message": "Import queued", "job_id": job['id'], "status": job['status']}
+
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT csv_header, db_field FROM company_column_mappings")
-            mappings = {row['csv_header']: row['db_field'] for row in cur.fetchall()}
-            
-            # Prepare to insert
-            companies_to_insert = []
-            for row in csv_reader:
-                company_data = {}
-                for csv_header, value in row.items():
-                    if csv_header is None:
-                        continue
-                        
-                    db_field = None
-                    if csv_header.lower() == "business_owner_name":
-                        db_field = "name"
-                    elif csv_header.lower() == "address_state":
-                        db_field = "location"
-                    else:
-                        for map_header, map_field in mappings.items():
-                            if map_header and map_header.lower() == csv_header.lower():
-                                db_field = map_field
-                                break
-                    
-                    if db_field:
-                        company_data[db_field] = value
-                
-                # Only add if we have at least a name (or other required fields)
-                if 'name' in company_data:
-                    # Provide defaults for missing fields if necessary, though DB handles defaults for employees/created_at
-                     companies_to_insert.append(company_data)
-
-            # Insert companies
-            inserted_count = 0
-            skipped_count = 0
-            
-            # Fetch existing names to prevent duplicates
-            cur.execute("SELECT name FROM companies")
-            existing_names = {row['name'].lower() for row in cur.fetchall()}
-            
-            for company in companies_to_insert:
-                if company['name'].lower() in existing_names:
-                    skipped_count += 1
-                    continue
-                    
-                keys = list(company.keys())
-                if not keys:
-                    continue
-                
-                columns = ', '.join(keys)
-                placeholders = ', '.join(['%s'] * len(keys))
-                values = list(company.values())
-                
-                cur.execute(
-                    f"INSERT INTO companies ({columns}) VALUES ({placeholders})",
-                    values
-                )
-                existing_names.add(company['name'].lower())
-                inserted_count += 1
-            
-            # Get total count
-            cur.execute("SELECT COUNT(*) FROM companies")
-            total_count = cur.fetchone()['count']
-            
-            conn.commit()
+        async with conn.cursor() as cur:
+            # Streams the upload in chunks through COPY into staging, then merges with one INSERT ... SELECT
+            counts = await csv_import.import_csv(cur, file)
+
+            # Counting the whole table costs more than the import itself, so only on request
+            total_count = None
+            if include_total:
+                await cur.execute("SELECT COUNT(*) FROM companies")
+                total_count = (await cur.fetchone())['count']
+
+            await conn.commit()
             return {
-                "message": f"Successfully imported {inserted_count} companies.",
-                "inserted_count": inserted_count,
-                "skipped_count": skipped_count,
-                "total_in_csv": len(companies_to_insert),
+                "message": f"Successfully imported {counts['inserted']} companies.",
+                "inserted_count": counts['inserted'],
+                "skipped_count": counts['skipped'],
+                "total_in_csv": counts['total'],
                 "total_count": total_count
             }
-            
+
+    except UnicodeDecodeError:
+        await conn.rollback()
+        raise HTTPException(status_code=400, detail="Invalid file encoding. Please upload a UTF-8 encoded CSV file.")
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
-@app.post("/companies", response_model=models.Company, status_code=status.HTTP_201_CREATED)
-async def create_company(company: models.CompanyCreate, current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+@app.get("/jobs/{job_id}", response_model=models.Job)
+async def get_job(job_id: int, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    async with conn.cursor() as cur:
+        job = await jobs.get_job(cur, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return models.Job(**job)
+
+@app.post("/jobs/{job_id}/cancel", response_model=models.Job)
+async def cancel_job(job_id: int, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    async with conn.cursor() as cur:
+        if not await jobs.request_cancel(cur, job_id):
+            if not await jobs.get_job(cur, job_id):
+                raise HTTPException(status_code=404, detail="Job not found")
+            raise HTTPException(status_code=409, detail="Job has already finished")
+        await conn.commit()
+        return models.Job(**await jobs.get_job(cur, job_id))
+
+@app.get("/company-column-mappings", response_model=list[models.ColumnMapping])
+async def get_column_mappings(current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    async with conn.cursor() as cur:
+        await cur.execute("SELECT csv_header, db_field FROM company_column_mappings ORDER BY id")
+        return [models.ColumnMapping(**row) for row in await cur.fetchall()]
+
+@app.put("/company-column-mappings", response_model=models.ColumnMapping)
+async def upsert_column_mapping(mapping: models.ColumnMapping, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    if mapping.db_field not in csv_import.IMPORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid db_field: {mapping.db_field}. Must be one of: {', '.join(csv_import.IMPORT_FIELDS)}")
     try:
-        with conn.cursor() as cur:
-            # Check for duplicates by name
-            cur.execute("SELECT id FROM companies WHERE name = %s", (company.name,))
-            if cur.fetchone():
-                raise HTTPException(status_code=400, detail="Company with this name already exists")
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                INSERT INTO company_column_mappings (csv_header, db_field) VALUES (%s, %s)
+                ON CONFLICT (csv_header) DO UPDATE SET db_field = EXCLUDED.db_field
+                RETURNING csv_header, db_field
+                """,
+                (mapping.csv_header, mapping.db_field)
+            )
+            saved = await cur.fetchone()
+            await conn.commit()
+        csv_import.invalidate_mappings()
+        return models.ColumnMapping(**saved)
+    except Exception as e:
+        await conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
 
-            cur.execute(
+@app.post("/companies", response_model=models.Company, status_code=status.HTTP_201_CREATED)
+async def create_company(company: models.CompanyCreate, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    try:
+        async with conn.cursor() as cur:
+            # Duplicate names (case-insensitive) are rejected by the companies_name_lower_key index
+            await cur.execute(
                 """
                 INSERT INTO companies (name, employees, location, workflow_bucket, status)
                 VALUES (%s, %s, %s, 'ALL', 'new')
+                ON CONFLICT ((lower(name))) DO NOTHING
                 RETURNING *
                 """,
                 (company.name, company.employees, company.location)
             )
-            new_company = cur.fetchone()
-            conn.commit()
+            new_company = await cur.fetchone()
+            if not new_company:
+                raise HTTPException(status_code=400, detail="Company with this name already exists")
+            await conn.commit()
             return models.Company(**new_company)
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
+async def list_companies(cur: psycopg.AsyncCursor, bucket: str, page: listing.PageParams, sort: str,
+                         name: str | None, employees: str | None, location: str | None) -> listing.Page:
+    where, params = ["workflow_bucket = %s"], [bucket]
+    listing.contains("name", name, where, params)
+    listing.compare("employees", employees, where, params)
+    listing.contains("location", location, where, params)
+    return await listing.fetch_page(cur, "companies", where, params, listing.sort_key(listing.COMPANY_SORTS, sort), page)
+
 @app.get("/companies", response_model=list[models.Company])
-async def get_companies(current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM companies WHERE workflow_bucket = 'ALL' ORDER BY created_at DESC")
-            companies = cur.fetchall()
-            return [models.Company(**company) for company in companies]
-    finally:
-        conn.close()
+async def get_companies(response: Response, page: listing.PageParams = Depends(), sort: str = "created_at",
+                        name: str | None = None, employees: str | None = None, location: str | None = None,
+                        current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """Companies in the ALL bucket. With `limit`, returns one page and the next cursor in X-Next-Cursor."""
+    async with conn.cursor() as cur:
+        result = await list_companies(cur, 'ALL', page, sort, name, employees, location)
+        result.set_headers(response)
+        return [models.Company(**company) for company in result.rows]
 
 @app.get("/companies/kanban", response_model=list[models.Company])
-async def get_kanban_companies(current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM companies WHERE workflow_bucket = 'KANBAN' ORDER BY created_at DESC")
-            companies = cur.fetchall()
-            return [models.Company(**company) for company in companies]
-    finally:
-        conn.close()
+async def get_kanban_companies(response: Response, page: listing.PageParams = Depends(), sort: str = "created_at",
+                               name: str | None = None, employees: str | None = None, location: str | None = None,
+                               current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    async with conn.cursor() as cur:
+        result = await list_companies(cur, 'KANBAN', page, sort, name, employees, location)
+        result.set_headers(response)
+        return [models.Company(**company) for company in result.rows]
 
 @app.get("/companies/call-queue", response_model=list[models.Company])
-async def get_call_queue(current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT * FROM companies
-                WHERE workflow_bucket = 'KANBAN'
-                  AND scheduled_at IS NOT NULL
-                ORDER BY scheduled_at ASC
-            """)
-            companies = cur.fetchall()
-            return [models.Company(**c) for c in companies]
-    finally:
-        conn.close()
+async def get_call_queue(current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    async with conn.cursor() as cur:
+        await cur.execute("""
+            SELECT * FROM companies
+            WHERE workflow_bucket = 'KANBAN'
+              AND scheduled_at IS NOT NULL
+            ORDER BY scheduled_at ASC
+        """)
+        companies = await cur.fetchall()
+        return [models.Company(**c) for c in companies]
 
 @app.post("/companies/generate-queue")
-async def generate_queue(current_user: models.User = Depends(get_current_user)):
-    """Assign scheduled_at times to all KANBAN companies that don't have one yet."""
-    conn = db.get_db_connection()
+async def generate_queue(config: models.CallScheduleConfig | None = None, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """
+    Assign scheduled_at times to all KANBAN companies that don't have one yet: slots of
+    `slot_minutes` within business hours in each company's local timezone, up to `daily_capacity` per day.
+    """
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT id FROM companies
-                WHERE workflow_bucket = 'KANBAN' AND scheduled_at IS NULL
-                ORDER BY id
-            """)
-            rows = cur.fetchall()
-
-            if not rows:
-                return {"message": "All kanban companies already have scheduled times", "updated_count": 0}
-
-            from datetime import datetime, timedelta
-            now = datetime.now()
-            # Space calls 30 minutes apart starting from next round hour
-            base_time = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
-
-            for i, row in enumerate(rows):
-                call_time = base_time + timedelta(minutes=30 * i)
-                cur.execute(
-                    "UPDATE companies SET scheduled_at = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                    (call_time, row['id'])
-                )
+        async with conn.cursor() as cur:
+            by_timezone = await scheduling.schedule_pending_calls(cur, config or models.CallScheduleConfig())
+            updated_count = sum(row['count'] for row in by_timezone)
+            await conn.commit()
 
-            conn.commit()
-            return {"message": f"Scheduled {len(rows)} companies", "updated_count": len(rows)}
+            if not updated_count:
+                return {"message": "All kanban companies already have scheduled times", "updated_count": 0}
+            return {"message": f"Scheduled {updated_count} companies", "updated_count": updated_count, "by_timezone": by_timezone}
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 class SendCallQueueRequest(BaseModel):
     company_ids: list[int]
 
-@app.post("/companies/send-call-queue")
-async def send_call_queue(body: SendCallQueueRequest, current_user: models.User = Depends(get_current_user)):
-    """Send queued companies to ElevenLabs API for outbound calling."""
+@app.post("/companies/send-call-queue", status_code=status.HTTP_202_ACCEPTED)
+async def send_call_queue(body: SendCallQueueRequest, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """
+    Queue companies for outbound calling. They are written to the call outbox and sent to
+    ElevenLabs by the dialer worker when their scheduled_at comes (see dialer.py).
+    """
     if not body.company_ids:
         raise HTTPException(status_code=400, detail="company_ids list is empty")
 
-    elevenlabs_url = os.environ.get("ELEVENLABS_API_URL", "http://127.0.0.1:10050")
-    elevenlabs_secret = os.environ.get("ELEVENLABS_SECRET_KEY", "testSecret")
-    agent_id = os.environ.get("ELEVENLABS_AGENT_ID", "")
-    phone_id = os.environ.get("ELEVENLABS_PHONE_ID", "")
-
-    if not agent_id or not phone_id:
+    if not os.environ.get("ELEVENLABS_AGENT_ID") or not os.environ.get("ELEVENLABS_PHONE_ID"):
         raise HTTPException(
             status_code=500,
             detail="ELEVENLABS_AGENT_ID and ELEVENLABS_PHONE_ID must be configured in .env"
         )
 
-    conn = db.get_db_connection()
     try:
-        with conn.cursor() as cur:
-            # Fetch companies from DB
-            cur.execute(
-                """
-                SELECT * FROM companies
-                WHERE id = ANY(%s)
-                  AND workflow_bucket = 'KANBAN'
-                  AND scheduled_at IS NOT NULL
-                """,
-                (body.company_ids,)
-            )
-            companies = cur.fetchall()
-
-            if not companies:
+        async with conn.cursor() as cur:
+            log = activity.ActivityLog()
+            eligible_ids, queued_ids = await dialer.enqueue(cur, body.company_ids, log, current_user.username)
+            if not eligible_ids:
                 raise HTTPException(status_code=404, detail="No queued companies found for the given IDs")
-
-            # Build JSON payload per spec
-            items = []
-            for c in companies:
-                items.append({
-                    "company_name": c["name"] or "",
-                    "location": c["location"] or "",
-                    "contact_name": c["contact_name"] or "",
-                    "surname": c["contact_surname"] or "",
-                    "phone": c["contact_phone"] or "",
-                })
-
-            payload = {
-                "generated_at": datetime.utcnow().isoformat(),
-                "agent_id": agent_id,
-                "elevenlabs_phone_id": phone_id,
-                "call_type": "twilio",
-                "items": items,
-            }
-
-            # Send to ElevenLabs API
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                resp = await client.post(
-                    f"{elevenlabs_url}/load_json",
-                    json=payload,
-                    headers={
-                        "Authorization": f"Bearer {elevenlabs_secret}",
-                        "Content-Type": "application/json",
-                    },
-                )
-
-            if resp.status_code != 200:
-                raise HTTPException(
-                    status_code=502,
-                    detail=f"ElevenLabs API error: {resp.status_code} — {resp.text}"
-                )
-
-            elevenlabs_result = resp.json()
-
-            # Mark as sent but keep scheduled_at so they stay in the queue view
-            sent_ids = [c["id"] for c in companies]
-            cur.execute(
-                "UPDATE companies SET status = 'sent', updated_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)",
-                (sent_ids,)
-            )
-
-            # Activity log for each company
-            for cid in sent_ids:
-                cur.execute(
-                    "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                    (cid, "sent_to_elevenlabs", "queued", "sent")
-                )
-
-            conn.commit()
-
-            return {
-                "message": f"Successfully sent {len(items)} companies to ElevenLabs",
-                "sent_count": len(items),
-                "elevenlabs_file_id": elevenlabs_result.get("file_id"),
-                "elevenlabs_inserted": elevenlabs_result.get("inserted"),
-                "elevenlabs_skipped": elevenlabs_result.get("skipped"),
-            }
-    except HTTPException:
-        raise
+            await log.flush(cur)
+            await conn.commit()
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+
+    dialer.wake()
+    return {
+        "message": f"Queued {len(queued_ids)} companies for calling",
+        "queued_count": len(queued_ids),
+        "already_queued_count": len(eligible_ids) - len(queued_ids),
+        "queued_ids": queued_ids,
+    }
 
 @app.put("/companies/{company_id}", response_model=models.Company)
-async def update_company(company_id: int, company_update: models.CompanyCreate, current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def update_company(company_id: int, company_update: models.CompanyCreate, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
-            cur.execute(
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 UPDATE companies
                 SET name = %s, employees = %s, location = %s,
@@ -451,30 +428,30 @@ async def update_company(company_id: int, company_update: models.CompanyCreate,
                 (company_update.name, company_update.employees, company_update.location,
                  company_update.scheduled_at, company_id)
             )
-            updated_company = cur.fetchone()
+            updated_company = await cur.fetchone()
             if not updated_company:
                 raise HTTPException(status_code=404, detail="Company not found")
-            conn.commit()
+            await conn.commit()
             return models.Company(**updated_company)
+    except psycopg.errors.UniqueViolation:
+        await conn.rollback()
+        raise HTTPException(status_code=400, detail="Company with this name already exists")
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.patch("/companies/{company_id}/status", response_model=models.Company)
-async def update_company_status(company_id: int, status_update: models.CompanyStatusUpdate, current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def update_company_status(company_id: int, status_update: models.CompanyStatusUpdate, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
+        async with conn.cursor() as cur:
             # Read old kanban_column for activity log
-            cur.execute("SELECT kanban_column FROM companies WHERE id = %s", (company_id,))
-            old_row = cur.fetchone()
+            await cur.execute("SELECT kanban_column FROM companies WHERE id = %s", (company_id,))
+            old_row = await cur.fetchone()
             old_column = old_row['kanban_column'] if old_row else None
 
-            cur.execute(
+            await cur.execute(
                 """
                 UPDATE companies
                 SET status = %s, kanban_column = %s, updated_at = CURRENT_TIMESTAMP
@@ -483,33 +460,29 @@ async def update_company_status(company_id: int, status_update: models.CompanySt
                 """,
                 (status_update.status, status_update.status, company_id)
             )
-            updated_company = cur.fetchone()
+            updated_company = await cur.fetchone()
             if not updated_company:
                 raise HTTPException(status_code=404, detail="Company not found")
 
             # Activity log for kanban column change
+            log = activity.ActivityLog()
             if old_column != status_update.status:
-                cur.execute(
-                    "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                    (company_id, 'kanban_column_change', old_column, status_update.status)
-                )
+                log.add(company_id, 'kanban_column_change', old_column, status_update.status)
+            await log.flush(cur)
 
-            conn.commit()
+            await conn.commit()
             return models.Company(**updated_company)
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.post("/companies/bulk-delete")
-async def bulk_delete_companies(ids: list[int | str], current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def bulk_delete_companies(ids: list[int | str], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
+        async with conn.cursor() as cur:
             # Convert string IDs to int if necessary
             int_ids = []
             for id_val in ids:
@@ -521,39 +494,37 @@ async def bulk_delete_companies(ids: list[int | str], current_user: models.User
             if not int_ids:
                 return {"message": "No valid IDs provided", "deleted_count": 0}
             
-            cur.execute("DELETE FROM companies WHERE id = ANY(%s)", (int_ids,))
+            await cur.execute("DELETE FROM companies WHERE id = ANY(%s)", (int_ids,))
             deleted_count = cur.rowcount
-            conn.commit()
+            await conn.commit()
             return {"message": f"Successfully deleted {deleted_count} companies", "deleted_count": deleted_count}
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.patch("/companies/bulk-enrich")
-async def bulk_enrich_companies(updates: list[models.CompanyEnrich], current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def bulk_enrich_companies(updates: list[models.CompanyEnrich], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """Set employees for many companies in one statement. Reports which ids matched a company."""
     try:
-        with conn.cursor() as cur:
-            for update in updates:
-                cur.execute(
-                    "UPDATE companies SET employees = %s WHERE id = %s",
-                    (update.employees, update.id)
-                )
-            conn.commit()
-            return {"message": f"Successfully enriched {len(updates)} companies"}
+        async with conn.cursor() as cur:
+            # If an id repeats, the last update wins, as it did when rows were updated one by one
+            updated_ids = await enrichment_jobs.save_employees(cur, [u.id for u in updates], [u.employees for u in updates])
+            await conn.commit()
+            matched = set(updated_ids)
+            return {
+                "message": f"Successfully enriched {len(updated_ids)} companies",
+                "updated_count": len(updated_ids),
+                "updated_ids": sorted(updated_ids),
+                "not_found_ids": sorted({u.id for u in updates} - matched),
+            }
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.patch("/companies/bulk-ready")
-async def bulk_ready_companies(ids: list[int | str], current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def bulk_ready_companies(ids: list[int | str], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
+        async with conn.cursor() as cur:
             # Convert string IDs to int if necessary
             int_ids = []
             for id_val in ids:
@@ -566,55 +537,57 @@ async def bulk_ready_companies(ids: list[int | str], current_user: models.User =
                 return {"message": "No valid IDs provided", "updated_count": 0}
             
             # Update workflow_bucket and legacy is_ready flag
-            cur.execute(
-                "UPDATE companies SET workflow_bucket = 'READY', is_ready = TRUE, updated_at = CURRENT_TIMESTAMP WHERE id = ANY(%s) AND workflow_bucket = 'ALL'",
+            await cur.execute(
+                "UPDATE companies SET workflow_bucket = 'READY', is_ready = TRUE, updated_at = CURRENT_TIMESTAMP WHERE id = ANY(%s) AND workflow_bucket = 'ALL' RETURNING id",
                 (int_ids,)
             )
-            updated_count = cur.rowcount
+            updated_ids = [row['id'] for row in await cur.fetchall()]
+            updated_count = len(updated_ids)
 
-            # Activity log entries
-            for cid in int_ids:
-                cur.execute(
-                    "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                    (cid, 'workflow_bucket_change', 'ALL', 'READY')
-                )
+            # Activity log entries, only for companies that actually moved
+            log = activity.ActivityLog()
+            log.add_many(updated_ids, 'workflow_bucket_change', 'ALL', 'READY')
+            await log.flush(cur)
 
-            conn.commit()
+            await conn.commit()
             return {"message": f"Successfully marked {updated_count} companies as Ready", "updated_count": updated_count}
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.get("/ready-companies", response_model=list[models.ReadyCompany])
-async def get_ready_companies(current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM companies WHERE workflow_bucket = 'READY' ORDER BY created_at DESC")
-            companies = cur.fetchall()
-            # Map database fields to ReadyCompany model
-            ready_companies = []
-            for c in companies:
-                ready_companies.append(models.ReadyCompany(
-                    id=c['id'],
-                    company_name=c['name'],
-                    location=c['location'],
-                    name=c['contact_name'],
-                    sur_name=c['contact_surname'],
-                    phone_number=c['contact_phone'],
-                    created_at=c['created_at']
-                ))
-            return ready_companies
-    finally:
-        conn.close()
+async def get_ready_companies(response: Response, page: listing.PageParams = Depends(), sort: str = "created_at",
+                              company_name: str | None = None, location: str | None = None, name: str | None = None,
+                              sur_name: str | None = None, phone_number: str | None = None,
+                              current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    async with conn.cursor() as cur:
+        where, params = ["workflow_bucket = 'READY'"], []
+        listing.contains("name", company_name, where, params)
+        listing.contains("location", location, where, params)
+        listing.contains("contact_name", name, where, params)
+        listing.contains("contact_surname", sur_name, where, params)
+        listing.contains("contact_phone", phone_number, where, params)
+        result = await listing.fetch_page(cur, "companies", where, params, listing.sort_key(listing.READY_COMPANY_SORTS, sort), page)
+        result.set_headers(response)
+        companies = result.rows
+        # Map database fields to ReadyCompany model
+        ready_companies = []
+        for c in companies:
+            ready_companies.append(models.ReadyCompany(
+                id=c['id'],
+                company_name=c['name'],
+                location=c['location'],
+                name=c['contact_name'],
+                sur_name=c['contact_surname'],
+                phone_number=c['contact_phone'],
+                created_at=c['created_at']
+            ))
+        return ready_companies
 
 @app.post("/ready-companies/bulk-delete")
-async def bulk_delete_ready_companies(ids: list[int | str], current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def bulk_delete_ready_companies(ids: list[int | str], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
+        async with conn.cursor() as cur:
             int_ids = []
             for id_val in ids:
                 try:
@@ -626,22 +599,19 @@ async def bulk_delete_ready_companies(ids: list[int | str], current_user: models
                 return {"message": "No valid IDs provided", "deleted_count": 0}
             
             # We delete from companies table but filter by workflow_bucket just in case
-            cur.execute("DELETE FROM companies WHERE id = ANY(%s) AND workflow_bucket = 'READY'", (int_ids,))
+            await cur.execute("DELETE FROM companies WHERE id = ANY(%s) AND workflow_bucket = 'READY'", (int_ids,))
             deleted_count = cur.rowcount
-            conn.commit()
+            await conn.commit()
             return {"message": f"Successfully deleted {deleted_count} ready companies", "deleted_count": deleted_count}
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.put("/ready-companies/{company_id}", response_model=models.ReadyCompany)
-async def update_ready_company(company_id: int, company_update: models.ReadyCompanyCreate, current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def update_ready_company(company_id: int, company_update: models.ReadyCompanyCreate, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
-            cur.execute(
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 UPDATE companies 
                 SET name = %s, location = %s, contact_name = %s, contact_surname = %s, contact_phone = %s
@@ -651,10 +621,10 @@ async def update_ready_company(company_id: int, company_update: models.ReadyComp
                 (company_update.company_name, company_update.location, company_update.name,
                  company_update.sur_name, company_update.phone_number, company_id)
             )
-            updated = cur.fetchone()
+            updated = await cur.fetchone()
             if not updated:
                 raise HTTPException(status_code=404, detail="Ready company not found")
-            conn.commit()
+            await conn.commit()
             return models.ReadyCompany(
                 id=updated['id'],
                 company_name=updated['name'],
@@ -664,124 +634,48 @@ async def update_ready_company(company_id: int, company_update: models.ReadyComp
                 phone_number=updated['contact_phone'],
                 created_at=updated['created_at']
             )
+    except psycopg.errors.UniqueViolation:
+        await conn.rollback()
+        raise HTTPException(status_code=400, detail="Company with this name already exists")
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.post("/ready-companies/{company_id}/move-to-kanban", response_model=models.Company)
-async def move_to_kanban(company_id: int, current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def move_to_kanban(company_id: int, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
-            # 1. Fetch from companies
-            cur.execute("SELECT * FROM companies WHERE id = %s AND workflow_bucket = 'READY'", (company_id,))
-            ready_comp = cur.fetchone()
-            if not ready_comp:
-                raise HTTPException(status_code=404, detail="Ready company not found")
-
-            # Validation: Check if all fields are filled
-            missing_fields = []
-            if not ready_comp.get('name'): missing_fields.append("Company Name")
-            if not ready_comp.get('location'): missing_fields.append("Location")
-            if not ready_comp.get('contact_name'): missing_fields.append("Contact Name")
-            if not ready_comp.get('contact_surname'): missing_fields.append("Surname")
-            if not ready_comp.get('contact_phone'): missing_fields.append("Phone Number")
-
-            if missing_fields:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"I cannot transfer because the following fields are not filled: {', '.join(missing_fields)}"
-                )
-
-            # 2. Update status, workflow, and flags
-            cur.execute(
-                """
-                UPDATE companies
-                SET workflow_bucket = 'KANBAN', kanban_column = 'new',
-                    status = 'new', is_in_kanban = TRUE, is_ready = FALSE,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-                RETURNING *
-                """,
-                (company_id,)
-            )
-            updated_company = cur.fetchone()
-
-            # Activity log
-            cur.execute(
-                "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                (company_id, 'workflow_bucket_change', 'READY', 'KANBAN')
-            )
-
-            conn.commit()
-            return models.Company(**updated_company)
+        async with conn.cursor() as cur:
+            log = activity.ActivityLog()
+            moved, rejected = await workflow.move_ready_to_kanban(cur, [company_id], log)
+            if rejected:
+                if not rejected[0]['missing_fields']:
+                    raise HTTPException(status_code=404, detail="Ready company not found")
+                raise HTTPException(status_code=400, detail=rejected[0]['reason'])
+
+            await log.flush(cur)
+            await conn.commit()
+            return models.Company(**moved[0])
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
-@app.post("/ready-companies/bulk-move-to-kanban", response_model=list[models.Company])
-async def bulk_move_to_kanban(company_ids: list[int], current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+@app.post("/ready-companies/bulk-move-to-kanban", response_model=models.BulkMoveResult)
+async def bulk_move_to_kanban(company_ids: list[int], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """Move every eligible company; the others are returned in `rejected` with the reason."""
     try:
-        moved_companies = []
-        with conn.cursor() as cur:
-            for company_id in company_ids:
-                # 1. Fetch
-                cur.execute("SELECT * FROM companies WHERE id = %s AND workflow_bucket = 'READY'", (company_id,))
-                ready_comp = cur.fetchone()
-                if not ready_comp:
-                    continue
-
-                # Validation
-                missing_fields = []
-                if not ready_comp.get('name'): missing_fields.append("Company Name")
-                if not ready_comp.get('location'): missing_fields.append("Location")
-                if not ready_comp.get('contact_name'): missing_fields.append("Contact Name")
-                if not ready_comp.get('contact_surname'): missing_fields.append("Surname")
-                if not ready_comp.get('contact_phone'): missing_fields.append("Phone Number")
-
-                if missing_fields:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"I cannot transfer because the following fields are not filled: {', '.join(missing_fields)}"
-                    )
-
-                # 2. Update
-                cur.execute(
-                    """
-                    UPDATE companies
-                    SET workflow_bucket = 'KANBAN', kanban_column = 'new',
-                        status = 'new', is_in_kanban = TRUE, is_ready = FALSE,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
-                    RETURNING *
-                    """,
-                    (company_id,)
-                )
-                updated_company = cur.fetchone()
-                moved_companies.append(models.Company(**updated_company))
-
-                # Activity log
-                cur.execute(
-                    "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                    (company_id, 'workflow_bucket_change', 'READY', 'KANBAN')
-                )
-
-            conn.commit()
-            return moved_companies
+        async with conn.cursor() as cur:
+            log = activity.ActivityLog()
+            moved, rejected = await workflow.move_ready_to_kanban(cur, company_ids, log)
+            await log.flush(cur)
+            await conn.commit()
+            return {"moved": moved, "rejected": rejected}
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 class HeadcountPrompt(BaseModel):
     prompt: str
@@ -789,12 +683,19 @@ class HeadcountPrompt(BaseModel):
 @app.post("/companies/ai-estimate-headcount")
 async def estimate_headcount_ep(body: HeadcountPrompt, current_user: models.User = Depends(get_current_user)):
     try:
-        from ai_service import estimate_headcount
+        from ai_service import estimate_headcount_async, HEADCOUNT_PROMPT_CACHE
+        key = ai_cache.cache_key(HEADCOUNT_PROMPT_CACHE, body.prompt)
+        cached = (await ai_cache.lookup([key])).get(key)
+        if cached is not None:
+            return cached
         # The service expects a string prompt.
-        result = estimate_headcount(body.prompt)
+        result = await estimate_headcount_async(body.prompt)
+        await ai_cache.store({key: result}, HEADCOUNT_PROMPT_CACHE)
         return result
     except Exception as e:
         print(f"Error in estimate_headcount endpoint: {e}")
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
 
 class CompanyInfo(BaseModel):
@@ -806,238 +707,227 @@ class BulkHeadcountRequest(BaseModel):
     companies: list[CompanyInfo]
 
 @app.post("/companies/ai-bulk-estimate-headcount")
-async def estimate_headcount_bulk_ep(body: BulkHeadcountRequest, current_user: models.User = Depends(get_current_user)):
+async def estimate_headcount_bulk_ep(body: BulkHeadcountRequest, response: Response, current_user: models.User = Depends(get_current_user)):
+    """
+    Headcount estimates for many companies, asked of Gemini in parallel chunks (see enrichment.py).
+    Ids the model left out are listed in X-Missing-Ids, ids whose chunk kept failing in X-Failed-Ids;
+    X-Cache-Hits counts the companies answered from ai_cache.
+    """
     try:
-        from ai_service import estimate_headcount_bulk
+        from ai_service import estimate_headcount_bulk_async, HEADCOUNT_CACHE
         # Convert Pydantic models to dicts
         companies_dicts = [c.model_dump() for c in body.companies]
-        results = estimate_headcount_bulk(companies_dicts)
-        return results
+        # Only companies without a cached estimate go to Gemini
+        result = await ai_cache.run_cached(HEADCOUNT_CACHE, estimate_headcount_bulk_async, companies_dicts)
+        result.raise_if_nothing_answered()
+        result.set_headers(response)
+        return result.results
     except Exception as e:
         print(f"Error in estimate_headcount_bulk endpoint: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _queue_enrichment_job(conn: psycopg.AsyncConnection, kind: str, created_by: str, run_job, ids: list[int]):
+    try:
+        async with conn.cursor() as cur:
+            job = await jobs.create_job(cur, kind, created_by)
+        await conn.commit()
+    except Exception as e:
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    jobs.spawn(run_job(job['id'], ids))
+    return {"message": "Enrichment queued", "job_id": job['id'], "status": job['status']}
+
+@app.post("/companies/ai-enrich-headcount", status_code=status.HTTP_202_ACCEPTED)
+async def enrich_headcount_job(body: models.EnrichmentJobRequest, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """
+    Estimate headcounts and save them as employees in a background job (enrichment_jobs.py).
+    The client polls /jobs/{job_id} for progress.
+    """
+    return await _queue_enrichment_job(conn, 'ai_headcount', current_user.username, enrichment_jobs.run_headcount_job, body.ids)
 
 @app.patch("/ready-companies/bulk-enrich")
-async def bulk_enrich_ready_companies(updates: list[models.ReadyCompanyEnrich], current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def bulk_enrich_ready_companies(updates: list[models.ReadyCompanyEnrich], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """
+    Set contact fields for many ready companies in one statement. Fields left out (None) keep their value.
+    Reports which ids were updated, which are not ready companies, and which had nothing to update.
+    """
     try:
-        with conn.cursor() as cur:
+        async with conn.cursor() as cur:
+            ids, names, sur_names, phones = [], [], [], []
+            skipped_ids = set()
             for update in updates:
-                # Build dynamic update query based on provided fields
-                update_fields = []
-                values = []
-                
-                if update.name is not None:
-                    update_fields.append("contact_name = %s")
-                    values.append(update.name)
-                
-                if update.sur_name is not None:
-                    update_fields.append("contact_surname = %s")
-                    values.append(update.sur_name)
-                    
-                if update.phone_number is not None:
-                    # Formalize the phone number: remove non-digits and prepend '1' if missing
-                    digits = "".join(filter(str.isdigit, update.phone_number))
-                    if digits:
-                        if not digits.startswith("1"):
-                            digits = "1" + digits
-                        update_fields.append("contact_phone = %s")
-                        values.append(digits)
-                
-                if not update_fields:
+                phone = enrichment_jobs.formal_phone(update.phone_number)
+                if update.name is None and update.sur_name is None and phone is None:
+                    skipped_ids.add(update.id)
                     continue
-                    
-                values.append(update.id)
-                query = f"UPDATE companies SET {', '.join(update_fields)} WHERE id = %s AND workflow_bucket = 'READY'"
-                
-                cur.execute(query, values)
-                
-            conn.commit()
-            return {"message": f"Successfully enriched {len(updates)} ready companies"}
+                ids.append(update.id)
+                names.append(update.name)
+                sur_names.append(update.sur_name)
+                phones.append(phone)
+
+            updated_ids = []
+            if ids:
+                updated_ids = await enrichment_jobs.save_contacts(cur, ids, names, sur_names, phones)
+
+            await conn.commit()
+            matched = set(updated_ids)
+            return {
+                "message": f"Successfully enriched {len(updated_ids)} ready companies",
+                "updated_count": len(updated_ids),
+                "updated_ids": sorted(updated_ids),
+                "not_found_ids": sorted(set(ids) - matched),
+                "skipped_ids": sorted(skipped_ids - matched - set(ids)),
+            }
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.post("/ready-companies/ai-bulk-find-decision-maker")
-async def find_decision_maker_bulk_ep(body: models.BulkDecisionMakerRequest, current_user: models.User = Depends(get_current_user)):
+async def find_decision_maker_bulk_ep(body: models.BulkDecisionMakerRequest, response: Response, current_user: models.User = Depends(get_current_user)):
+    """Decision makers for many ready companies, chunked like /companies/ai-bulk-estimate-headcount."""
     try:
-        from ai_service import find_decision_maker_bulk
+        from ai_service import find_decision_maker_bulk_async, DECISION_MAKER_CACHE
         # Convert Pydantic models to dicts
         companies_dicts = [c.model_dump() for c in body.companies]
-        results = find_decision_maker_bulk(companies_dicts)
-        return results
+        result = await ai_cache.run_cached(DECISION_MAKER_CACHE, find_decision_maker_bulk_async, companies_dicts, name_field="company_name")
+        result.raise_if_nothing_answered()
+        result.set_headers(response)
+        return result.results
     except Exception as e:
         print(f"Error in find_decision_maker_bulk endpoint: {e}")
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ready-companies/ai-enrich-decision-makers", status_code=status.HTTP_202_ACCEPTED)
+async def enrich_decision_makers_job(body: models.EnrichmentJobRequest, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """Find decision makers for ready companies and save them as contacts in a background job."""
+    return await _queue_enrichment_job(conn, 'ai_decision_makers', current_user.username, enrichment_jobs.run_decision_maker_job, body.ids)
+
 # --- Archived Companies ---
 
 @app.get("/archived-companies", response_model=list[models.ArchivedCompany])
-async def get_archived_companies(current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM archived_companies ORDER BY archived_at DESC")
-            archived = cur.fetchall()
-            return [models.ArchivedCompany(**a) for a in archived]
-    finally:
-        conn.close()
+async def get_archived_companies(response: Response, page: listing.PageParams = Depends(), sort: str = "archived_at",
+                                 company_name: str | None = None, location: str | None = None, name: str | None = None,
+                                 sur_name: str | None = None, phone_number: str | None = None,
+                                 current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    async with conn.cursor() as cur:
+        where, params = [], []
+        for column, value in (("company_name", company_name), ("location", location), ("name", name),
+                              ("sur_name", sur_name), ("phone_number", phone_number)):
+            listing.contains(column, value, where, params)
+        result = await listing.fetch_page(cur, "archived_companies", where, params, listing.sort_key(listing.ARCHIVED_COMPANY_SORTS, sort), page)
+        result.set_headers(response)
+        return [models.ArchivedCompany(**a) for a in result.rows]
 
 @app.post("/ready-companies/{company_id}/archive", response_model=models.ArchivedCompany)
-async def archive_ready_company(company_id: int, current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def archive_ready_company(company_id: int, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
-            # 1. Fetch from companies
-            cur.execute("SELECT * FROM companies WHERE id = %s AND workflow_bucket = 'READY'", (company_id,))
-            ready_comp = cur.fetchone()
-            if not ready_comp:
+        async with conn.cursor() as cur:
+            log = activity.ActivityLog()
+            archived = await workflow.archive_companies(cur, [company_id], log, bucket='READY')
+            if not archived:
                 raise HTTPException(status_code=404, detail="Ready company not found")
-
-            # 2. Insert into archived_companies
-            cur.execute(
-                """
-                INSERT INTO archived_companies (company_name, location, name, sur_name, phone_number)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING *
-                """,
-                (ready_comp['name'], ready_comp['location'], ready_comp['contact_name'],
-                 ready_comp['contact_surname'], ready_comp['contact_phone'])
-            )
-            archived_company = cur.fetchone()
-
-            # 3. Activity log before deletion
-            cur.execute(
-                "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                (company_id, 'archived', 'READY', 'ARCHIVED')
-            )
-
-            # 4. Delete from companies
-            cur.execute("DELETE FROM companies WHERE id = %s", (company_id,))
-
-            conn.commit()
-            return models.ArchivedCompany(**archived_company)
+            await log.flush(cur)
+            await conn.commit()
+            return models.ArchivedCompany(**archived[0])
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.post("/companies/{company_id}/archive", response_model=models.ArchivedCompany)
-async def archive_lifecycle_company(company_id: int, current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def archive_lifecycle_company(company_id: int, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
-            # 1. Fetch from companies
-            cur.execute("SELECT * FROM companies WHERE id = %s", (company_id,))
-            comp = cur.fetchone()
-            if not comp:
+        async with conn.cursor() as cur:
+            log = activity.ActivityLog()
+            archived = await workflow.archive_companies(cur, [company_id], log)
+            if not archived:
                 raise HTTPException(status_code=404, detail="Company not found")
+            await log.flush(cur)
+            await conn.commit()
+            return models.ArchivedCompany(**archived[0])
+    except Exception as e:
+        await conn.rollback()
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
 
-            # 2. Insert into archived_companies
-            cur.execute(
-                """
-                INSERT INTO archived_companies (company_name, location, name, sur_name, phone_number)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING *
-                """,
-                (comp['name'], comp['location'], comp['contact_name'],
-                 comp['contact_surname'], comp['contact_phone'])
-            )
-            archived_company = cur.fetchone()
-
-            # 3. Activity log before deletion
-            cur.execute(
-                "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                (company_id, 'archived', comp.get('workflow_bucket', 'UNKNOWN'), 'ARCHIVED')
-            )
-
-            # 4. Delete from companies
-            cur.execute("DELETE FROM companies WHERE id = %s", (company_id,))
-
-            conn.commit()
-            return models.ArchivedCompany(**archived_company)
+async def bulk_archive(company_ids: list[int], conn: psycopg.AsyncConnection, bucket: str | None = None):
+    try:
+        async with conn.cursor() as cur:
+            log = activity.ActivityLog()
+            archived = await workflow.archive_companies(cur, company_ids, log, bucket=bucket)
+            await log.flush(cur)
+            await conn.commit()
+            return {
+                "message": f"Successfully archived {len(archived)} companies",
+                "archived_count": len(archived),
+                "archived": archived,
+            }
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+
+@app.post("/ready-companies/bulk-archive")
+async def bulk_archive_ready_companies(company_ids: list[int], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """Archive the selected ready companies; ids that are not ready companies are ignored."""
+    return await bulk_archive(company_ids, conn, bucket='READY')
+
+@app.post("/companies/bulk-archive")
+async def bulk_archive_companies(company_ids: list[int], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """Archive the selected companies from any bucket."""
+    return await bulk_archive(company_ids, conn)
 
 @app.post("/archived-companies/bulk-delete")
-async def bulk_delete_archived_companies(company_ids: list[int], current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def bulk_delete_archived_companies(company_ids: list[int], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
+        async with conn.cursor() as cur:
             if not company_ids:
                 return {"message": "No IDs provided", "deleted_count": 0}
             
-            cur.execute("DELETE FROM archived_companies WHERE id = ANY(%s)", (company_ids,))
+            await cur.execute("DELETE FROM archived_companies WHERE id = ANY(%s)", (company_ids,))
             deleted_count = cur.rowcount
-            conn.commit()
+            await conn.commit()
             return {"message": f"Successfully deleted {deleted_count} archived companies", "deleted_count": deleted_count}
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.post("/archived-companies/bulk-restore")
-async def bulk_restore_archived_companies(company_ids: list[int], current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def bulk_restore_archived_companies(company_ids: list[int], current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
+        async with conn.cursor() as cur:
             if not company_ids:
                 return {"message": "No IDs provided", "restored_count": 0}
-            
-            # Get data from archived_companies
-            cur.execute(
-                "SELECT company_name, location, name, sur_name, phone_number FROM archived_companies WHERE id = ANY(%s)",
-                (company_ids,)
-            )
-            companies = cur.fetchall()
-            
-            restored_count = 0
-            for company in companies:
-                # Insert into companies (Kanban) with 'new' status, workflow_bucket=KANBAN
-                cur.execute(
-                    """INSERT INTO companies
-                       (name, location, contact_name, contact_surname, contact_phone,
-                        status, is_in_kanban, workflow_bucket, kanban_column)
-                       VALUES (%s, %s, %s, %s, %s, 'new', TRUE, 'KANBAN', 'new')
-                       RETURNING id""",
-                    (company['company_name'], company['location'], company['name'], company['sur_name'], company['phone_number'])
-                )
-                new_row = cur.fetchone()
-                if new_row:
-                    cur.execute(
-                        "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                        (new_row['id'], 'restored', 'ARCHIVED', 'KANBAN')
-                    )
-                restored_count += 1
-            
-            # Delete from archived_companies
-            cur.execute("DELETE FROM archived_companies WHERE id = ANY(%s)", (company_ids,))
-            
-            conn.commit()
-            return {"message": f"Successfully restored {restored_count} companies to Kanban", "restored_count": restored_count}
+
+            # Skipped when a company with the same name is already active; those stay archived
+            log = activity.ActivityLog()
+            restored = await workflow.restore_archived(cur, company_ids, log)
+            await log.flush(cur)
+
+            await conn.commit()
+            return {
+                "message": f"Successfully restored {len(restored)} companies to Kanban",
+                "restored_count": len(restored),
+                "restored": restored,
+            }
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 # --- Centralized Workflow Endpoints ---
 
 @app.patch("/companies/{company_id}/workflow", response_model=models.Company)
-async def update_company_workflow(company_id: int, workflow_update: models.WorkflowUpdate, current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def update_company_workflow(company_id: int, workflow_update: models.WorkflowUpdate, current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
     try:
-        with conn.cursor() as cur:
+        async with conn.cursor() as cur:
             # Fetch current state
-            cur.execute("SELECT * FROM companies WHERE id = %s", (company_id,))
-            company = cur.fetchone()
+            await cur.execute("SELECT * FROM companies WHERE id = %s", (company_id,))
+            company = await cur.fetchone()
             if not company:
                 raise HTTPException(status_code=404, detail="Company not found")
 
@@ -1064,7 +954,7 @@ async def update_company_workflow(company_id: int, workflow_update: models.Workf
             is_in_kanban = (new_bucket == 'KANBAN')
             status_val = new_column or 'new'
 
-            cur.execute(
+            await cur.execute(
                 """
                 UPDATE companies
                 SET workflow_bucket = %s, kanban_column = %s,
@@ -1075,64 +965,133 @@ async def update_company_workflow(company_id: int, workflow_update: models.Workf
                 """,
                 (new_bucket, new_column, is_ready, is_in_kanban, status_val, company_id)
             )
-            updated = cur.fetchone()
+            updated = await cur.fetchone()
 
             # Activity log
+            log = activity.ActivityLog()
             if old_bucket != new_bucket:
-                cur.execute(
-                    "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                    (company_id, 'workflow_bucket_change', old_bucket, new_bucket)
-                )
+                log.add(company_id, 'workflow_bucket_change', old_bucket, new_bucket)
             if new_bucket == 'KANBAN' and old_column != new_column:
-                cur.execute(
-                    "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                    (company_id, 'kanban_column_change', old_column, new_column)
-                )
+                log.add(company_id, 'kanban_column_change', old_column, new_column)
+            await log.flush(cur)
 
-            conn.commit()
+            await conn.commit()
             return models.Company(**updated)
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.get("/companies/{company_id}/activity-log", response_model=list[models.ActivityLog])
-async def get_company_activity_log(company_id: int, current_user: models.User = Depends(get_current_user)):
-    conn = db.get_db_connection()
+async def get_company_activity_log(company_id: int, response: Response, page: listing.PageParams = Depends(), current_user: models.User = Depends(get_current_user), conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """Newest entries first, 50 per page by default; pass X-Next-Cursor back as `cursor` for older ones."""
+    if page.limit is None:
+        page.limit = 50
+    async with conn.cursor() as cur:
+        result = await listing.fetch_page(cur, "activity_log", ["company_id = %s"], [company_id], listing.ACTIVITY_SORTS["created_at"], page)
+        result.set_headers(response)
+        return [models.ActivityLog(**log) for log in result.rows]
+
+async def read_phone_outcomes(request: Request):
+    """Yield raw items of a JSON array body, or of an NDJSON body (one object per line) as it streams in."""
+    if "ndjson" not in request.headers.get("content-type", ""):
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        for item in items:
+            yield item
+        return
+
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+@app.post("/companies/update-status-by-phone/batch")
+async def update_company_status_by_phone_batch(request: Request, conn: psycopg.AsyncConnection = Depends(get_async_db)):
+    """
+    Batch form of update-status-by-phone for the 'find' service: a JSON array or an NDJSON stream of
+    {phone_number, status}. All outcomes are resolved and applied in one statement; the response
+    has one result per item, in input order ('updated', 'superseded', 'not_found' or 'invalid').
+    """
+    results = []
+    outcomes = []
+    async for raw in read_phone_outcomes(request):
+        index = len(results)
+        try:
+            item = json.loads(raw) if isinstance(raw, bytes) else raw
+            update = models.CompanyStatusUpdateByPhone.model_validate(item)
+        except ValidationError as e:
+            error = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in e.errors())
+            results.append({"index": index, "result": "invalid", "error": error})
+            continue
+        except ValueError:
+            results.append({"index": index, "result": "invalid", "error": "Not valid JSON"})
+            continue
+        result = {"index": index, "phone_number": update.phone_number, "status": update.status}
+        digits = re.sub(r'\D', '', update.phone_number)
+        if update.status not in models.VALID_KANBAN_COLUMNS:
+            result.update(result="invalid", error=f"Invalid status: {update.status}")
+        elif not digits:
+            result.update(result="not_found", company_id=None)
+        else:
+            outcomes.append((index, digits, update.status))
+        results.append(result)
+
     try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT * FROM activity_log WHERE company_id = %s ORDER BY created_at DESC LIMIT 50",
-                (company_id,)
-            )
-            logs = cur.fetchall()
-            return [models.ActivityLog(**log) for log in logs]
-    finally:
-        conn.close()
+        async with conn.cursor() as cur:
+            log = activity.ActivityLog()
+            for applied in await workflow.apply_phone_outcomes(cur, outcomes, log):
+                results[applied['position']].update(result=applied['result'], company_id=applied['company_id'])
+            await log.flush(cur)
+            await conn.commit()
+    except Exception as e:
+        await conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    counts = {}
+    for r in results:
+        counts[r['result']] = counts.get(r['result'], 0) + 1
+    return {
+        "updated_count": counts.get('updated', 0),
+        "not_found_count": counts.get('not_found', 0),
+        "invalid_count": counts.get('invalid', 0),
+        "results": results,
+    }
 
 @app.post("/companies/update-status-by-phone", response_model=models.Company)
-async def update_company_status_by_phone(update: models.CompanyStatusUpdateByPhone):
+async def update_company_status_by_phone(update: models.CompanyStatusUpdateByPhone, conn: psycopg.AsyncConnection = Depends(get_async_db)):
     """
     Update company status in Kanban based on phone number (for external integrations like 'find' service).
     No authentication required for this internal service endpoint (or could add API key later).
     """
-    conn = db.get_db_connection()
     try:
-        with conn.cursor() as cur:
-            # 1. Find company by phone number (checking multiple phone fields if necessary, usually contact_phone)
-            # Normalize phone number if needed, here assuming exact match or simple stripping of non-digits might be needed
-            # For now, let's try exact match on contact_phone
-            cur.execute("SELECT * FROM companies WHERE contact_phone = %s OR contact_phone = %s", (update.phone_number, "+" + update.phone_number))
-            company = cur.fetchone()
-            
-            if not company:
-                # Try creating a lenient search if exact match fails
-                # e.g. if input is +1619... and db has 619...
-                 cur.execute("SELECT * FROM companies WHERE contact_phone LIKE %s", ("%" + update.phone_number[-10:],))
-                 company = cur.fetchone()
+        async with conn.cursor() as cur:
+            # 1. Find company by phone number: compare digits only, on the last 10 (national number),
+            # so "+1 619-555-0100" matches "(619) 555 0100"; an exact digits match wins over a suffix match
+            digits = re.sub(r'\D', '', update.phone_number)
+            company = None
+            if digits:
+                await cur.execute(
+                    """
+                    SELECT * FROM companies
+                    WHERE right(contact_phone_digits, 10) = right(%s, 10) AND contact_phone_digits <> ''
+                    ORDER BY contact_phone_digits = %s DESC, id
+                    LIMIT 1
+                    FOR UPDATE
+                    """,
+                    (digits, digits)
+                )
+                company = await cur.fetchone()
 
             if not company:
                 # If still not found, we can't update
@@ -1153,7 +1112,7 @@ async def update_company_status_by_phone(update: models.CompanyStatusUpdateByPho
             # 3. Update company
             # We move it to KANBAN bucket if not already there, and set status/column
             
-            cur.execute(
+            await cur.execute(
                 """
                 UPDATE companies
                 SET workflow_bucket = 'KANBAN', kanban_column = %s, status = %s, is_in_kanban = TRUE, updated_at = CURRENT_TIMESTAMP
@@ -1162,22 +1121,19 @@ async def update_company_status_by_phone(update: models.CompanyStatusUpdateByPho
                 """,
                 (new_status, new_status, company_id)
             )
-            updated_company = cur.fetchone()
+            updated_company = await cur.fetchone()
 
             # 4. Activity log
+            log = activity.ActivityLog()
             if old_column != new_status or old_bucket != 'KANBAN':
-                 cur.execute(
-                    "INSERT INTO activity_log (company_id, action, old_value, new_value) VALUES (%s, %s, %s, %s)",
-                    (company_id, 'status_change_by_phone', f"{old_bucket}/{old_column}", f"KANBAN/{new_status}")
-                )
+                log.add(company_id, 'status_change_by_phone', f"{old_bucket}/{old_column}", f"KANBAN/{new_status}")
+            await log.flush(cur)
             
-            conn.commit()
+            await conn.commit()
             return models.Company(**updated_company)
             
     except Exception as e:
-        conn.rollback()
+        await conn.rollback()
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
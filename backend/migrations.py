@@ -0,0 +1,397 @@
+"""
+Versioned schema migrations.
+
+Each migration is a numbered step, applied at most once and recorded in `schema_version`.
+db.init_db() runs migrate() at startup: when every step is already recorded it costs a
+single SELECT, so booting a worker no longer re-runs DDL or backfills over whole tables.
+Pending steps run under a Postgres advisory lock, each in its own transaction, so workers
+starting together apply them once and never see a half-applied step.
+
+Steps 1-7 are the schema init_db used to (re)create on every boot; they are written to be
+safe on databases that already have it. Add new steps at the end; never edit applied ones.
+"""
+from datetime import date
+
+import psycopg
+
+import activity
+
+# Arbitrary key for pg_advisory_lock, shared by every process running migrations
+MIGRATION_LOCK_ID = 724_019
+
+
+def _base_tables(conn: psycopg.Connection, cur: psycopg.Cursor):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            username VARCHAR(255) UNIQUE NOT NULL,
+            hashed_password VARCHAR(255) NOT NULL,
+            is_active BOOLEAN DEFAULT TRUE
+        );
+    """)
+
+    # Create companies table
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS companies (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            employees INT DEFAULT 0,
+            location VARCHAR(255),
+            limit_val VARCHAR(255),
+            description TEXT,
+            status VARCHAR(50) DEFAULT 'new',
+            scheduled_at TIMESTAMP,
+            contact_name VARCHAR(255),
+            contact_surname VARCHAR(255),
+            contact_phone VARCHAR(255),
+            is_ready BOOLEAN DEFAULT FALSE,
+            is_in_kanban BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+    # Create archived_companies table
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS archived_companies (
+            id SERIAL PRIMARY KEY,
+            company_name VARCHAR(255) NOT NULL,
+            location VARCHAR(255),
+            name VARCHAR(255),
+            sur_name VARCHAR(255),
+            phone_number VARCHAR(255),
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+    # Ensure columns exist for tables created by older versions
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS description TEXT;")
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS status VARCHAR(50) DEFAULT 'new';")
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS scheduled_at TIMESTAMP;")
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS contact_name VARCHAR(255);")
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS contact_surname VARCHAR(255);")
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS contact_phone VARCHAR(255);")
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS is_ready BOOLEAN DEFAULT FALSE;")
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS is_in_kanban BOOLEAN DEFAULT FALSE;")
+
+    # Create company_column_mappings table
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS company_column_mappings (
+            id SERIAL PRIMARY KEY,
+            csv_header VARCHAR(255) UNIQUE NOT NULL,
+            db_field VARCHAR(255) NOT NULL
+        );
+    """)
+
+    # Seed default mappings
+    # We use ON CONFLICT DO NOTHING to add new defaults without overwriting or duplicating
+    default_mappings = [
+        ('Company Name', 'name'),
+        ('Organization', 'name'),
+        ('Name', 'name'),
+        ('Number of Employees', 'employees'),
+        ('Employees', 'employees'),
+        ('Staff Count', 'employees'),
+        ('Location', 'location'),
+        ('City', 'location'),
+        ('Address', 'location'),
+        ('Limit', 'limit_val'),
+        ('clients_company', 'name'),
+        ('location_office', 'location'),
+        ('previous_call_summary', 'description'), # Just in case they want this mapped to something, but we don't have description field yet?
+        ('business_owner_name', 'name'),
+        ('address_state', 'location'),
+        # The companies table has: id, name, employees, location, limit_val, created_at.
+        # Use only what we have.
+    ]
+    cur.executemany(
+        "INSERT INTO company_column_mappings (csv_header, db_field) VALUES (%s, %s) ON CONFLICT (csv_header) DO NOTHING",
+        default_mappings
+    )
+
+
+def _workflow_columns(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Centralized workflow columns
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS workflow_bucket VARCHAR(10) DEFAULT 'ALL';")
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS kanban_column VARCHAR(30) DEFAULT NULL;")
+    cur.execute("ALTER TABLE companies ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;")
+
+    # Backfill workflow_bucket from legacy boolean flags
+    cur.execute("""
+        UPDATE companies SET workflow_bucket = 'KANBAN', kanban_column = status
+        WHERE is_in_kanban = TRUE AND workflow_bucket = 'ALL'
+    """)
+    cur.execute("""
+        UPDATE companies SET workflow_bucket = 'READY'
+        WHERE is_ready = TRUE AND is_in_kanban = FALSE AND workflow_bucket = 'ALL'
+    """)
+
+
+def _unique_company_names(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Normalized-name unique index: imports and creates dedupe with ON CONFLICT ((lower(name))) DO NOTHING.
+    # Names differing only by case keep their oldest row (lowest id), like workflow.restore_archived;
+    # the others move to archived_companies, where they can be reviewed or restored under a new name.
+    cur.execute("""
+        WITH dropped AS (
+            DELETE FROM companies c
+            USING companies kept
+            WHERE lower(kept.name) = lower(c.name) AND kept.id < c.id
+            RETURNING c.id, c.name, c.location, c.contact_name, c.contact_surname, c.contact_phone
+        )
+        INSERT INTO archived_companies (company_name, location, name, sur_name, phone_number)
+        SELECT name, location, contact_name, contact_surname, contact_phone FROM dropped ORDER BY id
+        RETURNING company_name
+    """)
+    archived = [row['company_name'] for row in cur.fetchall()]
+    if archived:
+        print(f"Archived {len(archived)} companies whose name repeats an older one: {', '.join(archived[:20])}")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS companies_name_lower_key ON companies (lower(name))")
+
+
+def _activity_log_and_jobs(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Activity log for tracking workflow transitions
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS activity_log (
+            id SERIAL PRIMARY KEY,
+            company_id INTEGER NOT NULL,
+            action VARCHAR(100) NOT NULL,
+            old_value VARCHAR(255),
+            new_value VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+    # Background jobs (CSV imports, ...); progress counters are kept in JSONB
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id SERIAL PRIMARY KEY,
+            kind VARCHAR(50) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            counters JSONB NOT NULL DEFAULT '{}'::jsonb,
+            error TEXT,
+            cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+            created_by VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+
+def _listing_indexes(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Keyset pagination compares (sort key, id) row values, which needs non-null sort keys
+    cur.execute("UPDATE companies SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    cur.execute("UPDATE companies SET employees = 0 WHERE employees IS NULL")
+    cur.execute("UPDATE archived_companies SET archived_at = CURRENT_TIMESTAMP WHERE archived_at IS NULL")
+    cur.execute("ALTER TABLE companies ALTER COLUMN created_at SET NOT NULL, ALTER COLUMN employees SET NOT NULL")
+    cur.execute("ALTER TABLE archived_companies ALTER COLUMN archived_at SET NOT NULL")
+
+    # Listing indexes: one (bucket, sort key, id) index per sortable column of the companies table,
+    # scanned forwards or backwards for asc/desc
+    cur.execute("CREATE INDEX IF NOT EXISTS companies_bucket_created_idx ON companies (workflow_bucket, created_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS companies_bucket_name_idx ON companies (workflow_bucket, name, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS companies_bucket_employees_idx ON companies (workflow_bucket, employees, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS companies_bucket_location_idx ON companies (workflow_bucket, (COALESCE(location, '')), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archived_companies_archived_idx ON archived_companies (archived_at, id)")
+
+    # Trigram indexes serve the ILIKE '%...%' filters; pg_trgm is a contrib extension and may be missing
+    try:
+        with conn.transaction():
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cur.execute("CREATE INDEX IF NOT EXISTS companies_name_trgm_idx ON companies USING gin (name gin_trgm_ops)")
+            cur.execute("CREATE INDEX IF NOT EXISTS companies_location_trgm_idx ON companies USING gin (location gin_trgm_ops)")
+    except psycopg.Error as e:
+        print(f"Warning: pg_trgm unavailable, name/location filters will scan: {e}")
+
+
+def _call_outbox(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Outbound call outbox: send-call-queue enqueues, the dialer worker (dialer.py) drains it.
+    # locked_until is a lease on a claimed row; once it expires the row is due again, so sends
+    # interrupted by a restart are retried (under the same idempotency key).
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS call_outbox (
+            id SERIAL PRIMARY KEY,
+            company_id INTEGER NOT NULL,
+            scheduled_at TIMESTAMP NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_until TIMESTAMP,
+            last_error TEXT,
+            provider_file_id VARCHAR(255),
+            created_by VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        );
+    """)
+    # One pending entry per company; enqueueing again is a no-op
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS call_outbox_pending_company_key ON call_outbox (company_id) WHERE status = 'pending'")
+    cur.execute("CREATE INDEX IF NOT EXISTS call_outbox_pending_due_idx ON call_outbox (scheduled_at, id) WHERE status = 'pending'")
+
+
+def _phone_digits(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Digits-only contact phone, kept in sync by Postgres on every insert/update/import path.
+    # Lookups by phone probe its last 10 digits, so "+1 (415) 555-0100" and "4155550100" meet.
+    cur.execute("""
+        ALTER TABLE companies ADD COLUMN IF NOT EXISTS contact_phone_digits VARCHAR(255)
+        GENERATED ALWAYS AS (regexp_replace(contact_phone, '[^0-9]', '', 'g')) STORED
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS companies_phone_suffix_idx ON companies (right(contact_phone_digits, 10))
+        WHERE contact_phone_digits <> ''
+    """)
+
+
+def _queue_and_activity_indexes(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Call queue (KANBAN, ordered by scheduled_at) and the scheduler's "KANBAN without a time" pick
+    cur.execute("CREATE INDEX IF NOT EXISTS companies_bucket_scheduled_idx ON companies (workflow_bucket, scheduled_at, id)")
+    # A company's activity, newest first
+    cur.execute("CREATE INDEX IF NOT EXISTS activity_log_company_created_idx ON activity_log (company_id, created_at)")
+
+
+def _partition_activity_log(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Monthly range partitions on created_at (maintained by activity.maintain); rows are copied
+    # over once, which takes a while on a large log but happens a single time
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = 'activity_log'::regclass")
+    if cur.fetchone()['relkind'] == 'p':
+        return
+    cur.execute("ALTER TABLE activity_log RENAME TO activity_log_unpartitioned")
+    cur.execute("ALTER INDEX activity_log_pkey RENAME TO activity_log_unpartitioned_pkey")
+    cur.execute("DROP INDEX IF EXISTS activity_log_company_created_idx")
+    # Keep the id sequence (and its position) for the new table
+    cur.execute("ALTER SEQUENCE activity_log_id_seq OWNED BY NONE")
+    cur.execute("""
+        CREATE TABLE activity_log (
+            id INTEGER NOT NULL DEFAULT nextval('activity_log_id_seq'),
+            company_id INTEGER NOT NULL,
+            action VARCHAR(100) NOT NULL,
+            old_value VARCHAR(255),
+            new_value VARCHAR(255),
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+    """)
+    cur.execute("ALTER SEQUENCE activity_log_id_seq OWNED BY activity_log.id")
+    cur.execute("CREATE TABLE activity_log_default PARTITION OF activity_log DEFAULT")
+
+    cur.execute("SELECT min(created_at)::date AS first FROM activity_log_unpartitioned")
+    first = cur.fetchone()['first'] or date.today()
+    month = first.replace(day=1)
+    last = activity.add_months(date.today().replace(day=1), activity.PARTITION_MONTHS_AHEAD)
+    while month <= last:
+        cur.execute(activity.partition_ddl(month))
+        month = activity.add_months(month, 1)
+
+    cur.execute("""
+        INSERT INTO activity_log (id, company_id, action, old_value, new_value, created_at)
+        SELECT id, company_id, action, old_value, new_value, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM activity_log_unpartitioned
+    """)
+    cur.execute("DROP TABLE activity_log_unpartitioned")
+
+    # A company's activity, newest first; keyset pages continue on (created_at, id)
+    cur.execute("CREATE INDEX activity_log_company_created_idx ON activity_log (company_id, created_at DESC, id DESC)")
+
+    # What retention leaves of dropped months: entries per company and action
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS activity_log_monthly (
+            month DATE NOT NULL,
+            company_id INTEGER NOT NULL,
+            action VARCHAR(100) NOT NULL,
+            entries INTEGER NOT NULL,
+            PRIMARY KEY (month, company_id, action)
+        );
+    """)
+
+
+def _ai_cache(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Gemini enrichment results (ai_cache.py); expired rows are ignored on read and swept on write
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ai_cache (
+            cache_key CHAR(64) PRIMARY KEY,
+            namespace VARCHAR(100) NOT NULL,
+            result JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS ai_cache_expires_idx ON ai_cache (expires_at)")
+
+
+def _job_owners(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # Process running each job and its last sign of life (jobs.py), so only orphaned jobs are failed
+    cur.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS owner VARCHAR(100)")
+    cur.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP")
+    cur.execute("CREATE INDEX IF NOT EXISTS jobs_unfinished_idx ON jobs (owner) WHERE status IN ('queued', 'running')")
+
+
+def _contact_listing_indexes(conn: psycopg.Connection, cur: psycopg.Cursor):
+    # (sort key, id) indexes for the remaining keyset sorts (listing.READY_COMPANY_SORTS and
+    # ARCHIVED_COMPANY_SORTS); the expressions must match SortKey.expr for the planner to use them
+    cur.execute("CREATE INDEX IF NOT EXISTS companies_bucket_contact_name_idx ON companies (workflow_bucket, (COALESCE(contact_name, '')), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS companies_bucket_contact_surname_idx ON companies (workflow_bucket, (COALESCE(contact_surname, '')), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS companies_bucket_contact_phone_idx ON companies (workflow_bucket, (COALESCE(contact_phone, '')), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archived_companies_company_name_idx ON archived_companies (company_name, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archived_companies_location_idx ON archived_companies ((COALESCE(location, '')), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archived_companies_name_idx ON archived_companies ((COALESCE(name, '')), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archived_companies_sur_name_idx ON archived_companies ((COALESCE(sur_name, '')), id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archived_companies_phone_number_idx ON archived_companies ((COALESCE(phone_number, '')), id)")
+
+
+MIGRATIONS = [
+    (1, "Base tables and column mappings", _base_tables),
+    (2, "Workflow bucket columns", _workflow_columns),
+    (3, "Unique lower(name) on companies", _unique_company_names),
+    (4, "Activity log and jobs", _activity_log_and_jobs),
+    (5, "Keyset listing indexes", _listing_indexes),
+    (6, "Call outbox", _call_outbox),
+    (7, "Normalized contact phone", _phone_digits),
+    (8, "Call queue and activity log indexes", _queue_and_activity_indexes),
+    (9, "Partition activity_log by month", _partition_activity_log),
+    (10, "AI enrichment cache", _ai_cache),
+    (11, "Job owners and heartbeats", _job_owners),
+    (12, "Keyset listing indexes for contact and archive sorts", _contact_listing_indexes),
+]
+
+
+def _applied_versions(cur: psycopg.Cursor) -> set[int]:
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    cur.execute("SELECT version FROM schema_version")
+    return {row['version'] for row in cur.fetchall()}
+
+
+def migrate(conn: psycopg.Connection) -> list[int]:
+    """Apply pending migrations on an autocommit connection. Returns the versions applied."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_version') IS NOT NULL AS ready")
+        if cur.fetchone()['ready']:
+            cur.execute("SELECT max(version) AS version FROM schema_version")
+            if (cur.fetchone()['version'] or 0) >= MIGRATIONS[-1][0]:
+                return []
+
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            # Re-read under the lock: another worker may have migrated while we waited
+            applied = _applied_versions(cur)
+            done = []
+            for version, description, step in MIGRATIONS:
+                if version in applied:
+                    continue
+                with conn.transaction():
+                    step(conn, cur)
+                    cur.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (version, description)
+                    )
+                print(f"Applied migration {version}: {description}")
+                done.append(version)
+            return done
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional, Literal
-from datetime import datetime
+from datetime import datetime, time
 
 class UserCreate(BaseModel):
     username: str
@@ -58,6 +58,10 @@ class Company(BaseModel):
     kanban_column: Optional[str] = None
     updated_at: Optional[datetime] = None
 
+class ColumnMapping(BaseModel):
+    csv_header: str
+    db_field: str
+
 class CompanyStatusUpdate(BaseModel):
     status: str
 
@@ -85,6 +89,24 @@ class ReadyCompany(BaseModel):
     phone_number: Optional[str]
     created_at: Optional[datetime] = None
 
+class CallScheduleConfig(BaseModel):
+    # Unset fields fall back to the CALL_* environment settings, see scheduling.py
+    slot_minutes: Optional[int] = None
+    day_start: Optional[time] = None
+    day_end: Optional[time] = None
+    daily_capacity: Optional[int] = None
+    weekdays_only: bool = True
+    default_timezone: Optional[str] = None
+
+class BulkMoveRejection(BaseModel):
+    id: int
+    reason: str
+    missing_fields: list[str] = []
+
+class BulkMoveResult(BaseModel):
+    moved: list[Company]
+    rejected: list[BulkMoveRejection]
+
 class ReadyCompanyEnrich(BaseModel):
     id: int
     name: Optional[str] = None
@@ -99,6 +121,9 @@ class DecisionMakerRequestItem(BaseModel):
 class BulkDecisionMakerRequest(BaseModel):
     companies: list[DecisionMakerRequestItem]
 
+class EnrichmentJobRequest(BaseModel):
+    ids: list[int]
+
 class ArchivedCompanyCreate(BaseModel):
     company_name: str
     location: Optional[str] = None
@@ -129,3 +154,16 @@ class ActivityLog(BaseModel):
     old_value: Optional[str] = None
     new_value: Optional[str] = None
     created_at: Optional[datetime] = None
+
+class Job(BaseModel):
+    id: int
+    kind: str
+    status: str
+    counters: dict = {}
+    rate_per_second: Optional[float] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    created_by: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,165 @@
+"""
+Call queue scheduling.
+
+Kanban companies without a call time are given one by a single UPDATE. Companies are
+grouped by the timezone of their location and numbered with row_number() inside each
+group; a company's number picks its business day and its slot within that day's window
+(local time), after any calls already scheduled in the same timezone. Days are computed
+arithmetically rather than joined from a calendar, so the cost is linear in the queue.
+"""
+import os
+from datetime import time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import psycopg
+from fastapi import HTTPException
+
+DEFAULT_SLOT_MINUTES = int(os.environ.get("CALL_SLOT_MINUTES", "30"))
+DEFAULT_DAY_START = time.fromisoformat(os.environ.get("CALL_DAY_START", "09:00"))
+DEFAULT_DAY_END = time.fromisoformat(os.environ.get("CALL_DAY_END", "17:00"))
+# Calls per timezone per day; unset means as many as fit in the window
+DEFAULT_DAILY_CAPACITY = int(os.environ["CALL_DAILY_CAPACITY"]) if os.environ.get("CALL_DAILY_CAPACITY") else None
+# Used for locations that don't name a known state
+DEFAULT_TIMEZONE = os.environ.get("CALL_DEFAULT_TIMEZONE", "America/New_York")
+
+# Timezone of a location, keyed by its last comma-separated part ("Austin, TX" -> "TX").
+# States spanning several zones use the zone of most of their population.
+_STATE_TIMEZONES = {
+    "America/New_York": "CT DE DC FL GA IN KY ME MD MA MI NH NJ NY NC OH PA RI SC VT VA WV",
+    "America/Chicago": "AL AR IL IA KS LA MN MS MO NE ND OK SD TN TX WI",
+    "America/Denver": "CO ID MT NM UT WY",
+    "America/Phoenix": "AZ",
+    "America/Los_Angeles": "CA NV OR WA",
+    "America/Anchorage": "AK",
+    "Pacific/Honolulu": "HI",
+}
+_STATE_NAMES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+    "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+    "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+    "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+    "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+    "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota",
+    "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia",
+    "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming",
+}
+LOCATION_TIMEZONES = {}
+for _zone, _states in _STATE_TIMEZONES.items():
+    for _state in _states.split():
+        LOCATION_TIMEZONES[_state] = _zone
+        LOCATION_TIMEZONES[_STATE_NAMES[_state].upper()] = _zone
+
+_SCHEDULE_SQL = """
+WITH located AS (
+    SELECT c.id, c.scheduled_at, COALESCE(z.timezone, %(default_tz)s) AS tz
+    FROM companies c
+    LEFT JOIN unnest(%(keys)s::text[], %(zones)s::text[]) AS z(key, timezone)
+        ON z.key = upper(btrim(regexp_replace(COALESCE(c.location, ''), '^.*,', '')))
+    WHERE c.workflow_bucket = 'KANBAN'
+),
+pending AS (
+    SELECT id, tz, row_number() OVER (PARTITION BY tz ORDER BY id) - 1 AS n
+    FROM located
+    WHERE scheduled_at IS NULL
+),
+queues AS (
+    -- Per timezone: local time from which calls may be placed, i.e. now or after the last call already scheduled
+    SELECT p.tz, count(*) AS pending,
+           GREATEST(
+               now() AT TIME ZONE p.tz,
+               (SELECT max(l.scheduled_at::timestamptz AT TIME ZONE p.tz) + %(slot)s::interval
+                FROM located l WHERE l.tz = p.tz AND l.scheduled_at >= LOCALTIMESTAMP)
+           ) AS start_local
+    FROM pending p
+    GROUP BY p.tz
+),
+openings AS (
+    -- First call day and first free slot on it; a start past the window moves to the next day's first slot
+    SELECT tz, first_day, extract(isodow FROM first_day)::int AS first_dow,
+           CASE WHEN first_day > start_local::date THEN 0
+                ELSE LEAST(%(per_day)s, GREATEST(0, ceil(
+                    extract(epoch FROM start_local::time - %(day_start)s::time) / extract(epoch FROM %(slot)s::interval)
+                )))::int
+           END AS first_slot
+    FROM (
+        SELECT tz, start_local,
+               -- With weekdays_only, a start on Saturday or Sunday moves to Monday
+               start_local::date + CASE WHEN NOT %(weekdays_only)s THEN 0
+                                        WHEN extract(isodow FROM start_local) = 6 THEN 2
+                                        WHEN extract(isodow FROM start_local) = 7 THEN 1
+                                        ELSE 0 END AS first_day
+        FROM queues
+    ) q
+),
+slots AS (
+    SELECT p.id, p.tz,
+           (p.call_day + %(day_start)s::time + p.slot * %(slot)s::interval) AT TIME ZONE p.tz AS call_at
+    FROM (
+        SELECT p.id, p.tz, pos %% %(per_day)s AS slot,
+               CASE WHEN NOT %(weekdays_only)s THEN o.first_day + day_no
+                    -- day_no-th business day after first_day, skipping weekends
+                    ELSE o.first_day + day_no / 5 * 7 + day_no %% 5
+                         + CASE WHEN o.first_dow + day_no %% 5 > 5 THEN 2 ELSE 0 END
+               END AS call_day
+        FROM pending p
+        JOIN openings o ON o.tz = p.tz
+        CROSS JOIN LATERAL (SELECT (p.n + o.first_slot)::int AS pos, ((p.n + o.first_slot) / %(per_day)s)::int AS day_no) x
+    ) p
+),
+scheduled AS (
+    UPDATE companies c
+    SET scheduled_at = s.call_at::timestamp, updated_at = CURRENT_TIMESTAMP
+    FROM slots s
+    WHERE c.id = s.id AND c.scheduled_at IS NULL
+    RETURNING c.id, s.tz, c.scheduled_at
+)
+SELECT tz, count(*) AS count, min(scheduled_at) AS first_call_at, max(scheduled_at) AS last_call_at
+FROM scheduled
+GROUP BY tz
+ORDER BY tz
+"""
+
+
+def slots_per_day(slot_minutes: int, day_start: time, day_end: time, daily_capacity: int | None) -> int:
+    window = (day_end.hour * 60 + day_end.minute) - (day_start.hour * 60 + day_start.minute)
+    per_day = window // slot_minutes
+    if daily_capacity is not None:
+        per_day = min(per_day, daily_capacity)
+    return per_day
+
+
+async def schedule_pending_calls(cur: psycopg.AsyncCursor, config) -> list[dict]:
+    """
+    Give every kanban company without a call time a slot, per `config` (models.CallScheduleConfig;
+    fields left unset use the CALL_* environment defaults). Calls take the first `daily_capacity`
+    slots of each day's window. Returns per-timezone counts and first/last call times.
+    """
+    slot_minutes = config.slot_minutes or DEFAULT_SLOT_MINUTES
+    day_start = config.day_start or DEFAULT_DAY_START
+    day_end = config.day_end or DEFAULT_DAY_END
+    daily_capacity = config.daily_capacity if config.daily_capacity is not None else DEFAULT_DAILY_CAPACITY
+    default_timezone = config.default_timezone or DEFAULT_TIMEZONE
+
+    try:
+        ZoneInfo(default_timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {default_timezone}")
+    if slot_minutes <= 0:
+        raise HTTPException(status_code=400, detail="slot_minutes must be positive")
+    per_day = slots_per_day(slot_minutes, day_start, day_end, daily_capacity)
+    if per_day < 1:
+        raise HTTPException(status_code=400, detail="The business-hours window has no room for a call")
+
+    await cur.execute(_SCHEDULE_SQL, {
+        "keys": list(LOCATION_TIMEZONES),
+        "zones": list(LOCATION_TIMEZONES.values()),
+        "default_tz": default_timezone,
+        "slot": f"{slot_minutes} minutes",
+        "day_start": day_start,
+        "per_day": per_day,
+        "weekdays_only": config.weekdays_only,
+    })
+    return await cur.fetchall()
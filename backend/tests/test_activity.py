@@ -0,0 +1,72 @@
+import asyncio
+from datetime import date
+
+import db
+import activity
+
+
+async def _count(cur, action):
+    await cur.execute("SELECT count(*) AS count FROM activity_log WHERE action = %s", (action,))
+    return (await cur.fetchone())['count']
+
+
+def test_flush_writes_with_the_transaction():
+    db.init_db()
+
+    async def run():
+        async with db.async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM activity_log WHERE action LIKE 'test_%%'")
+                log = activity.ActivityLog()
+                log.add_many([1, 2, 3], 'test_flush', 'ALL', 'READY')
+                log.add(4, 'test_flush')
+                assert await log.flush(cur) == 4
+                assert log.entries == []
+                await conn.commit()
+                assert await _count(cur, 'test_flush') == 4
+
+                # Entries flushed in a transaction that rolls back are gone with it
+                log.add(5, 'test_rollback')
+                await log.flush(cur)
+                await conn.rollback()
+                assert await _count(cur, 'test_rollback') == 0
+
+                await cur.execute("DELETE FROM activity_log WHERE action LIKE 'test_%%'")
+                await conn.commit()
+
+    asyncio.run(run())
+
+
+def test_maintenance_rolls_up_and_drops_old_months():
+    db.init_db()
+
+    async def run():
+        async with db.async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(activity.partition_ddl(date(2001, 1, 1)))
+                await cur.execute(
+                    """
+                    INSERT INTO activity_log (company_id, action, created_at) VALUES
+                        (1, 'test_old', '2001-01-05'), (1, 'test_old', '2001-01-20'),
+                        (2, 'test_old', '2000-06-01'),
+                        (3, 'test_recent', CURRENT_TIMESTAMP)
+                    """
+                )
+                result = await activity.maintain(cur, retention_months=12)
+                assert "activity_log_200101" in result["dropped"]
+                assert await _count(cur, 'test_old') == 0
+                assert await _count(cur, 'test_recent') == 1
+
+                await cur.execute(
+                    "SELECT month, company_id, entries FROM activity_log_monthly WHERE action = 'test_old' ORDER BY month"
+                )
+                assert [tuple(r.values()) for r in await cur.fetchall()] == [(date(2000, 6, 1), 2, 1), (date(2001, 1, 1), 1, 2)]
+                # Partitions for the coming months exist
+                await cur.execute("SELECT to_regclass(%s) IS NOT NULL AS exists", (activity.partition_name(activity.add_months(date.today().replace(day=1), 2)),))
+                assert (await cur.fetchone())['exists']
+
+                await cur.execute("DELETE FROM activity_log_monthly WHERE action LIKE 'test_%%'")
+                await cur.execute("DELETE FROM activity_log WHERE action LIKE 'test_%%'")
+                await conn.commit()
+
+    asyncio.run(run())
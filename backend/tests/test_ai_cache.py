@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+import ai_cache
+import db
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    db.init_db()
+    monkeypatch.setattr(ai_cache, "ENABLED", True)
+    monkeypatch.setattr(ai_cache, "counters", dict.fromkeys(ai_cache.counters, 0))
+    ai_cache.memory.clear()
+    yield
+    ai_cache.memory.clear()
+    with db.get_db_connection() as conn:
+        conn.execute("DELETE FROM ai_cache WHERE namespace = 'test'")
+
+
+def test_only_misses_go_to_the_model_and_hits_survive_the_memory_cache(cache):
+    sent = []
+
+    async def fake_bulk(chunk):
+        sent.append([c["id"] for c in chunk])
+        return [{"id": str(c["id"]), "headcount": {"value": c["id"] * 10}} for c in chunk]
+
+    first = [{"id": 1, "name": "Acme, Inc.", "location": "Austin, TX"}, {"id": 2, "name": "Globex", "location": "Ohio"}]
+    result = asyncio.run(ai_cache.run_cached("test", fake_bulk, first))
+    assert [r["headcount"]["value"] for r in result.results] == [10, 20]
+    assert result.cache_hits == 0
+
+    # Another process: nothing in memory, the rows in Postgres answer
+    ai_cache.memory.clear()
+    second = [{"id": 7, "name": "ACME inc", "location": "austin tx"}, {"id": 3, "name": "Initech", "location": "Ohio"}]
+    result = asyncio.run(ai_cache.run_cached("test", fake_bulk, second))
+
+    assert sent == [[1, 2], [3]]
+    assert result.results == [{"id": 7, "headcount": {"value": 10}}, {"id": 3, "headcount": {"value": 30}}]
+    assert result.cache_hits == 1
+    stats = ai_cache.stats()
+    assert (stats["db_hits"], stats["misses"], stats["stored"]) == (1, 3, 3)
+    assert stats["hit_rate"] == 0.25
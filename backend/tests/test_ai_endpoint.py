@@ -1,4 +1,4 @@
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from fastapi.testclient import TestClient
 from main import app
 
@@ -14,7 +14,7 @@ app.dependency_overrides[app.router.dependencies[0].dependency] = mock_get_curre
 from main import get_current_user
 app.dependency_overrides[get_current_user] = mock_get_current_user
 
-@patch("ai_service.estimate_headcount")
+@patch("ai_service.estimate_headcount_async", new_callable=AsyncMock)
 def test_estimate_headcount_success(mock_estimate):
     # Mock the return value of the service
     mock_estimate.return_value = {
@@ -33,9 +33,9 @@ def test_estimate_headcount_success(mock_estimate):
     assert data["headcount"]["value"] == 150
     assert data["confidence"] == 0.9
     assert data["source_hint"] == "LinkedIn"
-    mock_estimate.assert_called_once_with("Test prompt")
+    mock_estimate.assert_awaited_once_with("Test prompt")
 
-@patch("ai_service.estimate_headcount")
+@patch("ai_service.estimate_headcount_async", new_callable=AsyncMock)
 def test_estimate_headcount_error(mock_estimate):
     # Mock an error
     mock_estimate.side_effect = Exception("Gemini error")
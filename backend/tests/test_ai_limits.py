@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+from google.genai import errors
+
+import ai_limits
+
+
+@pytest.fixture(autouse=True)
+def fresh_limits(monkeypatch):
+    monkeypatch.setattr(ai_limits, "BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(ai_limits, "MAX_RETRIES", 2)
+    monkeypatch.setattr(ai_limits, "limiter", ai_limits.RateLimiter(rpm=6000, tpm=10_000_000))
+    monkeypatch.setattr(ai_limits, "breaker", ai_limits.CircuitBreaker(threshold=2, cooldown=60))
+    monkeypatch.setattr(ai_limits, "counters", dict.fromkeys(ai_limits.counters, 0))
+
+
+def _failing(code, results=None):
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if results and len(calls) > results:
+            return "ok"
+        raise errors.APIError(code, {"error": {"code": code, "message": "x", "status": "X",
+                                               "details": [{"retryDelay": "0s"}]}})
+
+    return call, calls
+
+
+def test_429_is_retried_and_slows_the_limiter():
+    call, calls = _failing(429, results=1)
+
+    assert asyncio.run(ai_limits.guarded(call, "prompt")) == "ok"
+    assert len(calls) == 2
+    assert ai_limits.limiter.factor < 1
+    assert ai_limits.counters["rate_limited"] == 1
+
+
+def test_client_errors_are_not_retried():
+    call, calls = _failing(400)
+
+    with pytest.raises(errors.APIError):
+        asyncio.run(ai_limits.guarded(call, "prompt"))
+    assert len(calls) == 1
+    assert ai_limits.breaker.state == "closed"
+
+
+def test_circuit_opens_fails_fast_and_closes_after_a_good_trial():
+    call, calls = _failing(503)
+    for _ in range(2):
+        with pytest.raises(errors.APIError):
+            asyncio.run(ai_limits.guarded(call, "prompt"))
+    assert len(calls) == 6
+    assert ai_limits.breaker.state == "open"
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(ai_limits.guarded(call, "prompt"))
+    assert exc.value.status_code == 503
+    assert len(calls) == 6
+
+    # Cooldown over: one trial goes through and closes the circuit
+    ai_limits.breaker.opened_at = time.monotonic() - 61
+
+    async def healthy():
+        return "ok"
+
+    assert asyncio.run(ai_limits.guarded(healthy, "prompt")) == "ok"
+    assert ai_limits.breaker.state == "closed"
+
+
+def test_limiter_waits_for_request_budget():
+    limiter = ai_limits.RateLimiter(rpm=600, tpm=10_000_000)
+    limiter.requests = 0
+
+    start = time.monotonic()
+    asyncio.run(limiter.acquire(10))
+    # 600 rpm refills a request every 0.1s
+    assert 0.05 < time.monotonic() - start < 0.5
+
+
+def test_trial_cancelled_while_throttled_frees_the_circuit():
+    ai_limits.breaker.opened_at = time.monotonic() - 61
+    # An empty request bucket keeps the trial waiting on the limiter
+    ai_limits.limiter.requests = -1000
+
+    async def healthy():
+        return "ok"
+
+    async def cancel_trial():
+        task = asyncio.create_task(ai_limits.guarded(healthy, "prompt"))
+        await asyncio.sleep(0.01)
+        assert ai_limits.breaker.trial_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    assert not ai_limits.breaker.trial_in_flight
+    assert ai_limits.breaker.state == "half_open"
+
+    ai_limits.limiter.requests = 6000
+    assert asyncio.run(ai_limits.guarded(healthy, "prompt")) == "ok"
+    assert ai_limits.breaker.state == "closed"
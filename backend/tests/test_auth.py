@@ -1,6 +1,8 @@
+import time
 import pytest
 from fastapi.testclient import TestClient
-from main import app
+from main import app, get_current_user
+import auth
 import db
 
 client = TestClient(app)
@@ -15,7 +17,12 @@ def setup_db():
         cur.execute("DELETE FROM users WHERE username LIKE 'testuser%'")
         conn.commit()
     conn.close()
+    auth.user_cache.invalidate()
+    # Other test modules override get_current_user at import time; these tests need the real one
+    override = app.dependency_overrides.pop(get_current_user, None)
     yield
+    if override is not None:
+        app.dependency_overrides[get_current_user] = override
 
 def test_register_user():
     response = client.post(
@@ -71,3 +78,78 @@ def test_read_users_me():
     data = response.json()
     assert data["username"] == "testuser_me"
     assert data["email"] == "test_me@example.com"
+
+def test_user_cache_expiry_and_invalidation():
+    cache = auth.UserCache(maxsize=2, ttl=60)
+    cache.set("a", "user-a")
+    assert cache.get("a") == "user-a"
+    # Entries never outlive the token that populated them
+    cache.set("b", "user-b", token_exp=time.time() - 1)
+    assert cache.get("b") is None
+    cache.set("b", "user-b")
+    cache.set("c", "user-c")  # evicts least recently used "a"
+    assert cache.get("a") is None
+    cache.invalidate("c")
+    assert cache.get("c") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+
+def test_deactivated_user_is_rejected():
+    client.post(
+        "/register",
+        json={"username": "testuser_deact", "email": "test_deact@example.com", "password": "password123"},
+    )
+    login_response = client.post(
+        "/token",
+        data={"username": "testuser_deact", "password": "password123"},
+        headers={"content-type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    # Populates the user cache
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+    response = client.post("/users/testuser_deact/deactivate", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["is_active"] is False
+
+    response = client.get("/users/me", headers=headers)
+    assert response.status_code == 400
+
+def test_cannot_deactivate_another_user():
+    for name in ("testuser_victim", "testuser_other"):
+        client.post(
+            "/register",
+            json={"username": name, "email": f"{name}@example.com", "password": "password123"},
+        )
+    login_response = client.post(
+        "/token",
+        data={"username": "testuser_other", "password": "password123"},
+        headers={"content-type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    response = client.post("/users/testuser_victim/deactivate", headers=headers)
+    assert response.status_code == 403
+
+def test_cached_user_needs_no_connection(monkeypatch):
+    client.post(
+        "/register",
+        json={"username": "testuser_cached", "email": "test_cached@example.com", "password": "password123"},
+    )
+    login_response = client.post(
+        "/token",
+        data={"username": "testuser_cached", "password": "password123"},
+        headers={"content-type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+    # Populates the user cache
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+    def no_connection():
+        raise AssertionError("a cached user must not check out a connection")
+    monkeypatch.setattr(db, "async_connection", no_connection)
+    response = client.get("/users/me", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["username"] == "testuser_cached"
@@ -1,4 +1,4 @@
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from fastapi.testclient import TestClient
 from main import app
 
@@ -13,7 +13,15 @@ async def mock_get_current_user():
 from main import get_current_user
 app.dependency_overrides[get_current_user] = mock_get_current_user
 
-@patch("ai_service.estimate_headcount_bulk")
+import pytest
+import ai_cache
+import enrichment
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.setattr(ai_cache, "ENABLED", False)
+
+@patch("ai_service.estimate_headcount_bulk_async", new_callable=AsyncMock)
 def test_estimate_headcount_bulk_success(mock_estimate_bulk):
     # Mock the return value of the service
     mock_estimate_bulk.return_value = [
@@ -48,12 +56,12 @@ def test_estimate_headcount_bulk_success(mock_estimate_bulk):
     assert data[1]["headcount"]["value"] == 50
     
     # Verify service was called with correct data
-    mock_estimate_bulk.assert_called_once()
+    mock_estimate_bulk.assert_awaited_once()
     args = mock_estimate_bulk.call_args[0][0]
     assert len(args) == 2
     assert args[0]["name"] == "Company A"
 
-@patch("ai_service.estimate_headcount_bulk")
+@patch("ai_service.estimate_headcount_bulk_async", new_callable=AsyncMock)
 def test_estimate_headcount_bulk_error(mock_estimate_bulk):
     # Mock an error
     mock_estimate_bulk.side_effect = Exception("Gemini bulk error")
@@ -65,3 +73,93 @@ def test_estimate_headcount_bulk_error(mock_estimate_bulk):
 
     assert response.status_code == 500
     assert "Gemini bulk error" in response.json()["detail"]
+
+def test_async_variant_awaits_the_async_client():
+    import asyncio
+    import ai_service
+
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = AsyncMock(return_value=MagicMock(text='[{"id": "1", "confidence": 0.5}]', usage_metadata=None))
+    with patch("ai_service.get_client", return_value=fake_client):
+        result = asyncio.run(ai_service.estimate_headcount_bulk_async([{"id": 1, "name": "A", "location": "B"}]))
+
+    assert result == [{"id": "1", "confidence": 0.5}]
+    fake_client.aio.models.generate_content.assert_awaited_once()
+    fake_client.models.generate_content.assert_not_called()
+
+def test_bulk_is_chunked_and_failed_chunks_are_reported(monkeypatch):
+    monkeypatch.setattr(enrichment, "CHUNK_SIZE", 2)
+    calls = []
+
+    async def fake_bulk(chunk):
+        ids = [c["id"] for c in chunk]
+        calls.append(ids)
+        if ids == [5, 6]:
+            raise Exception("always down")
+        # The model drops company 2 and answers for one nobody asked about
+        return [{"id": str(i), "confidence": 0.5} for i in ids if i != 2] + [{"id": "99"}]
+
+    with patch("ai_service.estimate_headcount_bulk_async", new=fake_bulk):
+        response = client.post(
+            "/companies/ai-bulk-estimate-headcount",
+            json={"companies": [{"id": i, "name": f"C{i}", "location": "L"} for i in range(1, 8)]}
+        )
+
+    assert response.status_code == 200
+    assert [r["id"] for r in response.json()] == [1, 3, 4, 7]
+    assert response.headers["X-Missing-Ids"] == "2"
+    assert response.headers["X-Failed-Ids"] == "5,6"
+    # 429/5xx retries belong to ai_limits.guarded; a plain failure is not retried here
+    assert sorted(map(tuple, calls)) == [(1, 2), (3, 4), (5, 6), (7,)]
+
+def test_open_circuit_is_passed_through_as_503():
+    from fastapi import HTTPException
+
+    async def circuit_open(chunk):
+        raise HTTPException(status_code=503, detail="Gemini is unavailable, try again later")
+
+    with patch("ai_service.find_decision_maker_bulk_async", new=circuit_open):
+        response = client.post(
+            "/ready-companies/ai-bulk-find-decision-maker",
+            json={"companies": [{"id": 1, "company_name": "A", "location": "B"}]}
+        )
+
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Gemini is unavailable, try again later"
+
+def test_malformed_answer_is_asked_again():
+    import ai_service
+
+    fake_client = MagicMock()
+    fake_client.aio.models.generate_content = AsyncMock(side_effect=[
+        MagicMock(text='[{"id": "1", "confid', usage_metadata=None),  # cut off at the output-token limit
+        MagicMock(text='[{"id": "1", "confidence": 0.5}]', usage_metadata=None),
+    ])
+    with patch("ai_service.get_client", return_value=fake_client):
+        response = client.post(
+            "/companies/ai-bulk-estimate-headcount",
+            json={"companies": [{"id": 1, "name": "A", "location": "B"}]}
+        )
+
+    assert response.status_code == 200
+    assert response.json() == [{"id": 1, "confidence": 0.5}]
+    assert "X-Failed-Ids" not in response.headers
+    assert fake_client.aio.models.generate_content.await_count == 2
+
+def test_malformed_answers_stop_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(enrichment, "MAX_ATTEMPTS", 2)
+    calls = []
+
+    async def never_json(chunk):
+        calls.append(chunk)
+        raise enrichment.MalformedAnswer("Gemini API Bulk Error: Failed to parse JSON list from Gemini response")
+
+    with patch("ai_service.estimate_headcount_bulk_async", new=never_json):
+        response = client.post(
+            "/companies/ai-bulk-estimate-headcount",
+            json={"companies": [{"id": 1, "name": "A", "location": "B"}]}
+        )
+
+    assert response.status_code == 500
+    assert "Failed to parse JSON" in response.json()["detail"]
+    assert len(calls) == 2
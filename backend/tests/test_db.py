@@ -1,5 +1,6 @@
 import pytest
 import db
+import migrations
 import os
 import psycopg
 from dotenv import load_dotenv
@@ -26,3 +27,40 @@ def test_init_db():
             
     finally:
         conn.close()
+
+def test_init_db_applies_each_migration_once():
+    db.init_db()
+    conn = psycopg.connect(os.environ["DATABASE_URL"], row_factory=psycopg.rows.dict_row, autocommit=True)
+    try:
+        # Everything is recorded, so a second run has nothing to do
+        assert migrations.migrate(conn) == []
+        with conn.cursor() as cur:
+            cur.execute("SELECT array_agg(version ORDER BY version) AS versions FROM schema_version")
+            assert cur.fetchone()['versions'] == [version for version, _, _ in migrations.MIGRATIONS]
+    finally:
+        conn.close()
+
+def test_unique_name_migration_archives_case_duplicates():
+    db.init_db()
+    conn = psycopg.connect(os.environ["DATABASE_URL"], row_factory=psycopg.rows.dict_row)
+    try:
+        with conn.cursor() as cur:
+            # Everything below is rolled back
+            cur.execute("DROP INDEX companies_name_lower_key")
+            cur.execute("""
+                INSERT INTO companies (name, contact_phone) VALUES
+                    ('Case Dup Co', '111'), ('case dup co', '222'), ('CASE DUP CO', '333')
+                RETURNING id
+            """)
+            kept = cur.fetchall()[0]['id']
+            migrations._unique_company_names(conn, cur)
+
+            cur.execute("SELECT id FROM companies WHERE lower(name) = 'case dup co'")
+            assert [row['id'] for row in cur.fetchall()] == [kept]
+            cur.execute("SELECT company_name, phone_number FROM archived_companies WHERE lower(company_name) = 'case dup co' ORDER BY id")
+            assert [(r['company_name'], r['phone_number']) for r in cur.fetchall()] == [('case dup co', '222'), ('CASE DUP CO', '333')]
+            cur.execute("SELECT to_regclass('companies_name_lower_key') IS NOT NULL AS ready")
+            assert cur.fetchone()['ready']
+    finally:
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,176 @@
+import asyncio
+import json
+
+import httpx
+
+import activity
+import db
+import dialer
+
+
+def _companies(n):
+    return [
+        {"id": i, "outbox_id": 100 + i, "name": f"Company {i}", "location": "Austin, TX", "contact_name": "Ann",
+         "contact_surname": "Lee", "contact_phone": "555", "scheduled_at": "2026-03-02T09:00:00"}
+        for i in range(1, n + 1)
+    ]
+
+
+def _run_dispatch(monkeypatch, handler, companies):
+    monkeypatch.setattr(dialer, "BATCH_SIZE", 10)
+    monkeypatch.setattr(dialer, "BACKOFF_SECONDS", 0.001)
+
+    async def run():
+        dialer.client = httpx.AsyncClient(base_url="http://stub", transport=httpx.MockTransport(handler))
+        try:
+            return await dialer.dispatch(companies, "agent", "phone", "secret")
+        finally:
+            await dialer.close_client()
+
+    return asyncio.run(run())
+
+
+def test_dispatch_batches_and_retries_with_the_same_key(monkeypatch):
+    keys = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        keys.append((request.headers["Idempotency-Key"], len(body["items"])))
+        # First attempt of every batch fails
+        if [k for k, _ in keys].count(request.headers["Idempotency-Key"]) == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"file_id": "f", "inserted": len(body["items"]), "skipped": 0})
+
+    batches = _run_dispatch(monkeypatch, handler, _companies(25))
+
+    assert [len(b["ids"]) for b in batches] == [10, 10, 5]
+    assert all(b["ok"] and b["attempts"] == 2 for b in batches)
+    assert len({k for k, _ in keys}) == 3
+    assert sum(n for _, n in keys) == 50
+
+
+def test_dispatch_does_not_retry_client_errors(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(400, text="bad payload")
+
+    [batch] = _run_dispatch(monkeypatch, handler, _companies(3))
+
+    assert not batch["ok"]
+    assert batch["status_code"] == 400
+    assert len(calls) == 1
+
+
+def test_unexpected_error_fails_only_its_batch(monkeypatch):
+    def handler(request):
+        body = json.loads(request.content)
+        if body["items"][0]["company_name"] == "Company 1":
+            return httpx.Response(200, text="OK")
+        return httpx.Response(200, json={"file_id": "f", "inserted": len(body["items"]), "skipped": 0})
+
+    first, second = _run_dispatch(monkeypatch, handler, _companies(15))
+
+    assert not first["ok"]
+    assert first["error"].startswith("JSONDecodeError")
+    assert second["ok"]
+    assert second["ids"] == list(range(11, 16))
+
+
+def test_outbox_sends_due_calls_and_redelivers_expired_claims(monkeypatch):
+    db.init_db()
+    monkeypatch.setenv("ELEVENLABS_AGENT_ID", "agent")
+    monkeypatch.setenv("ELEVENLABS_PHONE_ID", "phone")
+    monkeypatch.setattr(dialer, "MAX_DELIVERIES", 1)
+    loaded = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        loaded.extend(item["company_name"] for item in body["items"])
+        if any(item["company_name"] == "Outbox Failing" for item in body["items"]):
+            return httpx.Response(400, text="bad payload")
+        return httpx.Response(200, json={"file_id": "f1", "inserted": len(body["items"]), "skipped": 0})
+
+    async def run():
+        dialer.client = httpx.AsyncClient(base_url="http://stub", transport=httpx.MockTransport(handler))
+        async with db.async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM companies WHERE name LIKE 'Outbox %%'")
+                await cur.execute(
+                    """
+                    INSERT INTO companies (name, workflow_bucket, kanban_column, scheduled_at) VALUES
+                        ('Outbox Due', 'KANBAN', 'new', LOCALTIMESTAMP - INTERVAL '1 minute'),
+                        ('Outbox Later', 'KANBAN', 'new', LOCALTIMESTAMP + INTERVAL '1 day'),
+                        ('Outbox Failing', 'KANBAN', 'new', LOCALTIMESTAMP - INTERVAL '2 minutes')
+                    RETURNING id
+                    """
+                )
+                ids = [r['id'] for r in await cur.fetchall()]
+                log = activity.ActivityLog()
+                eligible, queued = await dialer.enqueue(cur, ids, log)
+                assert queued == eligible == sorted(ids)
+                # Enqueueing again while pending is a no-op
+                assert (await dialer.enqueue(cur, ids, log))[1] == []
+                await conn.commit()
+
+                # A claim abandoned by a dead worker is due again once its lease has expired
+                await cur.execute(
+                    "UPDATE call_outbox SET locked_until = LOCALTIMESTAMP - INTERVAL '1 second' WHERE company_id = %s",
+                    (ids[0],)
+                )
+                await conn.commit()
+
+                # Batches of one so the failing company doesn't take the due one down with it
+                monkeypatch.setattr(dialer, "BATCH_SIZE", 1)
+                assert await dialer.drain_once(10) == 2
+                assert await dialer.drain_once(10) == 0
+
+                await cur.execute(
+                    """
+                    SELECT c.name, c.status AS company_status, o.status, o.provider_file_id
+                    FROM call_outbox o JOIN companies c ON c.id = o.company_id
+                    WHERE c.id = ANY(%s) ORDER BY c.id
+                    """,
+                    (ids,)
+                )
+                rows = await cur.fetchall()
+                await cur.execute("DELETE FROM call_outbox WHERE company_id = ANY(%s)", (ids,))
+                await cur.execute("DELETE FROM companies WHERE id = ANY(%s)", (ids,))
+                await conn.commit()
+        await dialer.close_client()
+        return rows
+
+    rows = asyncio.run(run())
+    assert sorted(loaded) == ["Outbox Due", "Outbox Failing"]
+    assert [(r['name'], r['company_status'], r['status'], r['provider_file_id']) for r in rows] == [
+        ("Outbox Due", "sent", "sent", "f1"),
+        ("Outbox Later", "queued", "pending", None),
+        ("Outbox Failing", "send_failed", "failed", None),
+    ]
+
+
+def test_long_retry_after_leaves_the_batch_to_redelivery(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        # Longer than a worker may sleep while holding the claim's lease
+        return httpx.Response(429, headers={"Retry-After": str(int(dialer.LEASE_SECONDS))})
+
+    [batch] = _run_dispatch(monkeypatch, handler, _companies(3))
+
+    assert not batch["ok"]
+    assert batch["status_code"] == 429
+    assert len(calls) == 1
+
+
+def test_batch_key_follows_outbox_entries():
+    a, b, c = _companies(3)
+
+    # Same entries regrouped or reordered: same key
+    assert dialer.idempotency_key("agent", "phone", [a, b]) == dialer.idempotency_key("agent", "phone", [b, a])
+    # The same company queued again is a new outbox entry with a new key
+    requeued = {**a, "outbox_id": 999}
+    assert dialer.idempotency_key("agent", "phone", [a]) != dialer.idempotency_key("agent", "phone", [requeued])
+    assert [dialer.build_item(x)["idempotency_key"] for x in (a, requeued)] == ["outbox-101", "outbox-999"]
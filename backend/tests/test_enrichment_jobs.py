@@ -0,0 +1,59 @@
+import asyncio
+from unittest.mock import patch
+
+import ai_cache
+import db
+import enrichment_jobs
+import jobs
+
+
+def test_headcount_job_saves_estimates_in_batches(monkeypatch):
+    db.init_db()
+    monkeypatch.setattr(ai_cache, "ENABLED", False)
+    monkeypatch.setattr(enrichment_jobs, "BATCH_SIZE", 2)
+    sent = []
+
+    async def fake_bulk(chunk):
+        sent.append([c["name"] for c in chunk])
+        answers = {
+            "Enrich A": {"value": 120},
+            "Enrich B": {"min": 10, "max": 20},
+            "Enrich C": {"value": None, "min": None, "max": None},
+        }
+        # Enrich D is left out of the answer
+        return [{"id": str(c["id"]), "headcount": answers[c["name"]]} for c in chunk if c["name"] in answers]
+
+    async def run():
+        async with db.async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM companies WHERE name LIKE 'Enrich %%'")
+                await cur.execute(
+                    "INSERT INTO companies (name, location) VALUES ('Enrich A', 'Austin, TX'), ('Enrich B', NULL), "
+                    "('Enrich C', 'Ohio'), ('Enrich D', 'Ohio') RETURNING id"
+                )
+                ids = [r['id'] for r in await cur.fetchall()]
+                job = await jobs.create_job(cur, 'ai_headcount')
+            await conn.commit()
+
+            with patch("ai_service.estimate_headcount_bulk_async", new=fake_bulk):
+                await enrichment_jobs.run_headcount_job(job['id'], ids + [-1])
+
+            async with conn.cursor() as cur:
+                finished = await jobs.get_job(cur, job['id'])
+                await cur.execute("SELECT name, employees FROM companies WHERE id = ANY(%s) ORDER BY name", (ids,))
+                employees = {r['name']: r['employees'] for r in await cur.fetchall()}
+                await cur.execute("DELETE FROM companies WHERE id = ANY(%s)", (ids,))
+                await cur.execute("DELETE FROM jobs WHERE id = %s", (job['id'],))
+            await conn.commit()
+            return finished, employees
+
+    job, employees = asyncio.run(run())
+
+    assert sent == [["Enrich A", "Enrich B"], ["Enrich C", "Enrich D"]]
+    assert job['status'] == 'completed'
+    assert {k: job['counters'][k] for k in ("total", "processed", "updated", "missing", "not_found")} == {
+        "total": 4, "processed": 4, "updated": 2, "missing": 1, "not_found": 1,
+    }
+    assert employees["Enrich A"] == 120
+    assert employees["Enrich B"] == 15
+    assert not employees["Enrich C"]
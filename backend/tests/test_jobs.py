@@ -0,0 +1,45 @@
+import asyncio
+
+import db
+import jobs
+
+
+def test_sweep_fails_only_jobs_of_dead_workers():
+    db.init_db()
+
+    async def run():
+        async with db.async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    INSERT INTO jobs (kind, status, owner, heartbeat_at) VALUES
+                        ('sweep_test', 'queued', %s, CURRENT_TIMESTAMP - INTERVAL '1 hour'),
+                        ('sweep_test', 'running', 'live-worker', CURRENT_TIMESTAMP),
+                        ('sweep_test', 'running', 'dead-worker', CURRENT_TIMESTAMP - INTERVAL '1 hour'),
+                        ('sweep_test', 'queued', NULL, NULL)
+                    RETURNING id
+                    """,
+                    (jobs.OWNER,)
+                )
+                ids = [r['id'] for r in await cur.fetchall()]
+                # A job from before owners were recorded, idle for long
+                await cur.execute("UPDATE jobs SET updated_at = CURRENT_TIMESTAMP - INTERVAL '1 hour' WHERE id = %s", (ids[3],))
+            await conn.commit()
+
+            await jobs.fail_stale_jobs()
+            # This process's heartbeat keeps its own queued job alive for other sweepers
+            await jobs.heartbeat()
+
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT status, heartbeat_at > CURRENT_TIMESTAMP - INTERVAL '1 minute' AS fresh FROM jobs WHERE id = ANY(%s) ORDER BY id",
+                    (ids,)
+                )
+                rows = await cur.fetchall()
+                await cur.execute("DELETE FROM jobs WHERE id = ANY(%s)", (ids,))
+            await conn.commit()
+            return rows
+
+    rows = asyncio.run(run())
+    assert [r['status'] for r in rows] == ['queued', 'running', 'failed', 'failed']
+    assert rows[0]['fresh']
@@ -36,3 +36,116 @@ def test_health_check():
 
 
 
+def test_update_status_by_phone_matches_any_format():
+    db.init_db()
+    conn = db.get_db_connection()
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM companies WHERE name LIKE 'Phone Test %%'")
+        cur.execute(
+            """
+            INSERT INTO companies (name, contact_phone, workflow_bucket, kanban_column) VALUES
+                ('Phone Test National', '(619) 555-0142', 'KANBAN', 'new'),
+                ('Phone Test Blank', '', 'KANBAN', 'new')
+            RETURNING id
+            """
+        )
+        company_id = cur.fetchone()['id']
+        conn.commit()
+
+    try:
+        response = client.post("/companies/update-status-by-phone", json={"phone_number": "+1 619.555.0142", "status": "ivr"})
+        assert response.status_code == 200
+        assert response.json()["id"] == company_id
+        assert response.json()["kanban_column"] == "ivr"
+
+        # No digits must not match companies without a phone
+        response = client.post("/companies/update-status-by-phone", json={"phone_number": "n/a", "status": "ivr"})
+        assert response.status_code == 404
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM companies WHERE name LIKE 'Phone Test %%'")
+            conn.commit()
+        conn.close()
+
+def test_update_status_by_phone_batch():
+    db.init_db()
+    conn = db.get_db_connection()
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM companies WHERE name LIKE 'Phone Batch %%'")
+        cur.execute(
+            """
+            INSERT INTO companies (name, contact_phone, workflow_bucket, kanban_column) VALUES
+                ('Phone Batch A', '(619) 555-0201', 'KANBAN', 'new'),
+                ('Phone Batch B', '619-555-0202', 'READY', NULL)
+            RETURNING id
+            """
+        )
+        a_id, b_id = [row['id'] for row in cur.fetchall()]
+        conn.commit()
+
+    try:
+        response = client.post("/companies/update-status-by-phone/batch", json=[
+            {"phone_number": "+16195550201", "status": "ivr"},
+            {"phone_number": "6195550202", "status": "voicemail"},
+            {"phone_number": "619 555 0201", "status": "hang-up"},
+            {"phone_number": "0000000000", "status": "ivr"},
+            {"phone_number": "6195550202", "status": "bogus"},
+            {"status": "ivr"},
+        ])
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [r["result"] for r in results] == ["superseded", "updated", "updated", "not_found", "invalid", "invalid"]
+        assert results[1]["company_id"] == b_id and results[2]["company_id"] == a_id
+
+        # NDJSON streams the same items one per line
+        body = '{"phone_number": "6195550201", "status": "new"}\nnot json\n'
+        response = client.post("/companies/update-status-by-phone/batch", content=body,
+                               headers={"Content-Type": "application/x-ndjson"})
+        assert [r["result"] for r in response.json()["results"]] == ["updated", "invalid"]
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, workflow_bucket, kanban_column FROM companies WHERE id = ANY(%s) ORDER BY id", ([a_id, b_id],))
+            assert [(r['workflow_bucket'], r['kanban_column']) for r in cur.fetchall()] == [("KANBAN", "new"), ("KANBAN", "voicemail")]
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM companies WHERE name LIKE 'Phone Batch %%'")
+            conn.commit()
+        conn.close()
+
+
+def test_upload_reports_table_total(auth_token):
+    db.init_db()
+    conn = db.get_db_connection()
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM companies WHERE name LIKE 'Upload Total %%'")
+        conn.commit()
+
+    try:
+        csv_file = io.BytesIO(b"name,location\nUpload Total One,San Diego\nUpload Total Two,Austin\n")
+        response = client.post(
+            "/companies/upload",
+            files={"file": ("companies.csv", csv_file, "text/csv")},
+            headers={"Authorization": f"Bearer {auth_token}"},
+        )
+        assert response.status_code == 201
+        data = response.json()
+        assert data["inserted_count"] == 2
+        assert data["total_in_csv"] == 2
+        # The table isn't counted unless asked for
+        assert data["total_count"] is None
+
+        csv_file = io.BytesIO(b"name,location\nUpload Total Three,Denver\n")
+        response = client.post(
+            "/companies/upload?include_total=true",
+            files={"file": ("companies.csv", csv_file, "text/csv")},
+            headers={"Authorization": f"Bearer {auth_token}"},
+        )
+        assert response.status_code == 201
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM companies")
+            assert response.json()["total_count"] == cur.fetchone()['count']
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM companies WHERE name LIKE 'Upload Total %%'")
+            conn.commit()
+        conn.close()
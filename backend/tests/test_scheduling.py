@@ -0,0 +1,73 @@
+import asyncio
+from datetime import time
+
+import db
+import models
+import scheduling
+
+
+def test_slots_per_day_respects_window_and_capacity():
+    assert scheduling.slots_per_day(30, time(9), time(17), None) == 16
+    assert scheduling.slots_per_day(45, time(9), time(17), None) == 10
+    assert scheduling.slots_per_day(30, time(9), time(17), 5) == 5
+    assert scheduling.slots_per_day(30, time(17), time(9), None) < 1
+
+
+def test_locations_map_to_timezones():
+    assert scheduling.LOCATION_TIMEZONES["TX"] == "America/Chicago"
+    assert scheduling.LOCATION_TIMEZONES["CALIFORNIA"] == "America/Los_Angeles"
+    assert len({k for k in scheduling.LOCATION_TIMEZONES if len(k) == 2}) == 51
+
+
+def test_schedule_fills_windows_per_timezone_and_overflows_to_monday():
+    db.init_db()
+    config = models.CallScheduleConfig(slot_minutes=30, day_start=time(9), day_end=time(17),
+                                       daily_capacity=3, default_timezone="America/New_York")
+
+    async def run():
+        async with db.async_connection() as conn:
+            try:
+                async with conn.cursor() as cur:
+                    # Everything below is rolled back; scheduled_at is read and written in UTC
+                    await cur.execute("SET LOCAL TimeZone = 'UTC'")
+                    await cur.execute("UPDATE companies SET workflow_bucket = 'ALL' WHERE workflow_bucket = 'KANBAN'")
+                    # Calls already booked on Friday 2037-01-02: 15:00 in Chicago, 09:00 in New York
+                    await cur.execute("""
+                        INSERT INTO companies (name, location, workflow_bucket, scheduled_at) VALUES
+                            ('Sched Anchor Chicago', 'Waco, TX', 'KANBAN', '2037-01-02 21:00'),
+                            ('Sched Anchor New York', 'Albany, NY', 'KANBAN', '2037-01-02 14:00')
+                    """)
+                    await cur.execute("""
+                        INSERT INTO companies (name, location, workflow_bucket) VALUES
+                            ('Sched Austin', 'Austin, TX', 'KANBAN'),
+                            ('Sched Springfield', 'Texas, Springfield', 'KANBAN'),
+                            ('Sched Chicago', 'Chicago, Illinois', 'KANBAN'),
+                            ('Sched Houston', 'Suite 5, Houston, tx', 'KANBAN'),
+                            ('Sched Nowhere', NULL, 'KANBAN'),
+                            ('Sched Dallas', 'Dallas,TX', 'KANBAN'),
+                            ('Sched Boston', 'Boston, MA', 'KANBAN')
+                    """)
+                    by_timezone = await scheduling.schedule_pending_calls(cur, config)
+                    await cur.execute("""
+                        SELECT name, to_char(scheduled_at, 'Dy YYYY-MM-DD HH24:MI') AS at
+                        FROM companies WHERE name LIKE 'Sched %%' AND name NOT LIKE 'Sched Anchor%%'
+                        ORDER BY id
+                    """)
+                    return by_timezone, {r['name']: r['at'] for r in await cur.fetchall()}
+            finally:
+                await conn.rollback()
+
+    by_timezone, scheduled = asyncio.run(run())
+
+    assert [(r['tz'], r['count']) for r in by_timezone] == [("America/Chicago", 4), ("America/New_York", 3)]
+    assert scheduled == {
+        # Chicago (UTC-6): Friday's window is past its 3 calls, so Monday 09:00 onwards, then Tuesday
+        "Sched Austin": "Mon 2037-01-05 15:00",
+        "Sched Chicago": "Mon 2037-01-05 15:30",
+        "Sched Houston": "Mon 2037-01-05 16:00",
+        "Sched Dallas": "Tue 2037-01-06 15:00",
+        # New York (UTC-5): the rest of Friday's 3 slots after the 09:00 call, then Monday
+        "Sched Springfield": "Fri 2037-01-02 14:30",
+        "Sched Nowhere": "Fri 2037-01-02 15:00",
+        "Sched Boston": "Mon 2037-01-05 14:00",
+    }
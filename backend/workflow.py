@@ -0,0 +1,222 @@
+"""
+Bulk workflow transitions.
+
+Each transition handles the whole selection in a single statement built from CTEs, so
+its cost stays flat as selections grow. Moving to kanban computes, per id, whether the
+company is in the source bucket and which required fields are empty, and an UPDATE in
+the same statement moves only the rows that passed; ineligible companies are reported
+back instead of failing the whole batch. Archiving and restoring move rows between
+`companies` and `archived_companies` with DELETE ... RETURNING / INSERT ... SELECT.
+
+Activity entries are recorded on the caller's ActivityLog, which flushes them with the
+rest of the transaction.
+"""
+import psycopg
+
+import activity
+
+# Fields a ready company needs before it can go on the kanban board, with the names shown to users
+KANBAN_REQUIRED_FIELDS = (
+    ("name", "Company Name"),
+    ("location", "Location"),
+    ("contact_name", "Contact Name"),
+    ("contact_surname", "Surname"),
+    ("contact_phone", "Phone Number"),
+)
+
+
+def _missing_fields_sql(alias: str) -> str:
+    checks = ", ".join(
+        f"CASE WHEN COALESCE({alias}.{column}, '') = '' THEN '{label}' END"
+        for column, label in KANBAN_REQUIRED_FIELDS
+    )
+    return f"array_remove(ARRAY[{checks}]::text[], NULL)"
+
+
+async def move_ready_to_kanban(cur: psycopg.AsyncCursor, company_ids: list[int], log: activity.ActivityLog):
+    """
+    Move READY companies to the 'new' kanban column in one statement.
+    Returns (moved, rejected): moved company rows, and {id, reason, missing_fields} for the rest.
+    Moves are recorded on `log`; the caller flushes it and commits.
+    """
+    await cur.execute(
+        f"""
+        WITH requested AS (
+            SELECT DISTINCT unnest(%s::int[]) AS id
+        ),
+        checked AS (
+            SELECT r.id, c.id IS NOT NULL AS is_ready, {_missing_fields_sql('c')} AS missing_fields
+            FROM requested r
+            LEFT JOIN companies c ON c.id = r.id AND c.workflow_bucket = 'READY'
+        ),
+        moved AS (
+            UPDATE companies c
+            SET workflow_bucket = 'KANBAN', kanban_column = 'new',
+                status = 'new', is_in_kanban = TRUE, is_ready = FALSE,
+                updated_at = CURRENT_TIMESTAMP
+            FROM checked
+            WHERE c.id = checked.id AND checked.is_ready AND cardinality(checked.missing_fields) = 0
+              AND c.workflow_bucket = 'READY'
+            RETURNING c.*
+        )
+        -- Moved rows plus the checks of every requested id; no join, so row estimates don't matter
+        SELECT id, TRUE AS moved, NULL::boolean AS is_ready, NULL::text[] AS missing_fields, to_jsonb(moved.*) AS company
+        FROM moved
+        UNION ALL
+        SELECT id, FALSE, is_ready, missing_fields, NULL
+        FROM checked
+        """,
+        (company_ids,)
+    )
+    rows = await cur.fetchall()
+    moved = sorted((row['company'] for row in rows if row['moved']), key=lambda c: c['id'])
+    moved_ids = {c['id'] for c in moved}
+    rejected = []
+    for row in sorted((r for r in rows if not r['moved'] and r['id'] not in moved_ids), key=lambda r: r['id']):
+        if not row['is_ready']:
+            rejected.append({"id": row['id'], "reason": "Not a ready company", "missing_fields": []})
+        elif row['missing_fields']:
+            rejected.append({
+                "id": row['id'],
+                "reason": f"I cannot transfer because the following fields are not filled: {', '.join(row['missing_fields'])}",
+                "missing_fields": row['missing_fields'],
+            })
+        else:
+            # Passed the checks but left READY before the UPDATE ran (concurrent change)
+            rejected.append({"id": row['id'], "reason": "Company changed while moving", "missing_fields": []})
+
+    log.add_many([c['id'] for c in moved], 'workflow_bucket_change', 'READY', 'KANBAN')
+    return moved, rejected
+
+
+async def archive_companies(cur: psycopg.AsyncCursor, company_ids: list[int], log: activity.ActivityLog,
+                            bucket: str | None = None) -> list[dict]:
+    """
+    Move companies to archived_companies in one statement (DELETE ... RETURNING feeding INSERT ... SELECT).
+    With `bucket`, only companies in that workflow bucket are archived.
+    Returns the archived_companies rows; ids that matched nothing are simply absent.
+    """
+    await cur.execute(
+        """
+        WITH removed AS (
+            DELETE FROM companies
+            WHERE id = ANY(%s) AND (%s::text IS NULL OR workflow_bucket = %s)
+            RETURNING id, name, location, contact_name, contact_surname, contact_phone, workflow_bucket
+        ),
+        archived AS (
+            INSERT INTO archived_companies (company_name, location, name, sur_name, phone_number)
+            SELECT name, location, contact_name, contact_surname, contact_phone
+            FROM removed ORDER BY id
+            RETURNING *
+        )
+        SELECT id, workflow_bucket, NULL::jsonb AS archived FROM removed
+        UNION ALL
+        SELECT id, NULL, to_jsonb(archived.*) FROM archived
+        """,
+        (company_ids, bucket, bucket)
+    )
+    archived = []
+    for row in await cur.fetchall():
+        if row['archived'] is None:
+            log.add(row['id'], 'archived', row['workflow_bucket'] or 'UNKNOWN', 'ARCHIVED')
+        else:
+            archived.append(row['archived'])
+    archived.sort(key=lambda a: a['id'])
+    return archived
+
+
+async def restore_archived(cur: psycopg.AsyncCursor, archived_ids: list[int], log: activity.ActivityLog) -> list[dict]:
+    """
+    Move archived companies back to the kanban board ('new' column) in one statement.
+    Names that are already active, and repeats within the selection, are skipped and stay archived.
+    Returns [{archived_id, company_id}] for the restored ones.
+    """
+    await cur.execute(
+        """
+        WITH picked AS (
+            -- One row per name; the unique index on lower(name) would reject the others anyway
+            SELECT DISTINCT ON (lower(company_name)) *
+            FROM archived_companies
+            WHERE id = ANY(%s)
+            ORDER BY lower(company_name), id
+        ),
+        inserted AS (
+            INSERT INTO companies
+                (name, location, contact_name, contact_surname, contact_phone,
+                 status, is_in_kanban, workflow_bucket, kanban_column)
+            SELECT company_name, location, name, sur_name, phone_number, 'new', TRUE, 'KANBAN', 'new'
+            FROM picked ORDER BY id
+            ON CONFLICT ((lower(name))) DO NOTHING
+            RETURNING id, name
+        )
+        DELETE FROM archived_companies a
+        USING picked p, inserted i
+        WHERE a.id = p.id AND lower(i.name) = lower(p.company_name)
+        RETURNING a.id AS archived_id, i.id AS company_id
+        """,
+        (archived_ids,)
+    )
+    restored = sorted(await cur.fetchall(), key=lambda r: r['archived_id'])
+    log.add_many([r['company_id'] for r in restored], 'restored', 'ARCHIVED', 'KANBAN')
+    return restored
+
+
+async def apply_phone_outcomes(cur: psycopg.AsyncCursor, outcomes: list[tuple[int, str, str]],
+                               log: activity.ActivityLog) -> list[dict]:
+    """
+    Apply call outcomes, given as (position, phone digits, kanban column), in one statement.
+    Each phone resolves like update-status-by-phone (last 10 digits on the phone index, exact
+    match first); matched companies move to that kanban column. When a batch holds several
+    outcomes for one company, the last one wins and the earlier ones are reported as superseded.
+    Returns {position, company_id, result} with result 'updated', 'superseded' or 'not_found'.
+    """
+    if not outcomes:
+        return []
+    positions, digits, columns = map(list, zip(*outcomes))
+    await cur.execute(
+        """
+        WITH input AS (
+            SELECT * FROM unnest(%s::int[], %s::text[], %s::text[]) AS i(pos, digits, new_column)
+        ),
+        matched AS (
+            SELECT i.pos, i.new_column, m.id, m.kanban_column AS old_column, m.workflow_bucket AS old_bucket
+            FROM input i
+            LEFT JOIN LATERAL (
+                SELECT c.id, c.kanban_column, c.workflow_bucket
+                FROM companies c
+                WHERE right(c.contact_phone_digits, 10) = right(i.digits, 10) AND c.contact_phone_digits <> ''
+                ORDER BY c.contact_phone_digits = i.digits DESC, c.id
+                LIMIT 1
+            ) m ON TRUE
+        ),
+        latest AS (
+            SELECT DISTINCT ON (id) * FROM matched WHERE id IS NOT NULL ORDER BY id, pos DESC
+        ),
+        updated AS (
+            UPDATE companies c
+            SET workflow_bucket = 'KANBAN', kanban_column = l.new_column, status = l.new_column,
+                is_in_kanban = TRUE, updated_at = CURRENT_TIMESTAMP
+            FROM latest l
+            WHERE c.id = l.id
+            RETURNING c.id
+        )
+        SELECT pos, id, old_column, old_bucket, new_column, FALSE AS applied FROM matched
+        UNION ALL
+        SELECT l.pos, l.id, NULL, NULL, NULL, TRUE FROM latest l WHERE l.id IN (SELECT id FROM updated)
+        """,
+        (positions, digits, columns)
+    )
+    rows = await cur.fetchall()
+    applied = {row['pos'] for row in rows if row['applied']}
+    results = []
+    for row in sorted((r for r in rows if not r['applied']), key=lambda r: r['pos']):
+        if row['id'] is None:
+            results.append({"position": row['pos'], "company_id": None, "result": "not_found"})
+        elif row['pos'] in applied:
+            results.append({"position": row['pos'], "company_id": row['id'], "result": "updated"})
+            if row['old_column'] != row['new_column'] or row['old_bucket'] != 'KANBAN':
+                log.add(row['id'], 'status_change_by_phone',
+                        f"{row['old_bucket']}/{row['old_column']}", f"KANBAN/{row['new_column']}")
+        else:
+            results.append({"position": row['pos'], "company_id": row['id'], "result": "superseded"})
+    return results
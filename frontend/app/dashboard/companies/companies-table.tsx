@@ -16,6 +16,7 @@ import { Plus, MoreVertical, Trash2, ArrowUpDown, ChevronUp, ChevronDown, Search
 import { Company, CompanySheet } from "./company-sheet"
 import { Checkbox } from "@/components/ui/checkbox"
 import { formatCompanyName } from "@/lib/utils"
+import { waitForJob } from "@/lib/api"
 import {
     DropdownMenu,
     DropdownMenuContent,
@@ -394,80 +395,35 @@ export function CompaniesTable({
                 return
             }
 
-            // 2. Chunk into groups of 10
-            const chunkSize = 10
-            const chunks = []
-            for (let i = 0; i < companiesToProcess.length; i += chunkSize) {
-                chunks.push(companiesToProcess.slice(i, i + chunkSize))
+            // 2. The backend estimates headcounts and saves them in a background job; we only poll its progress
+            const jobResponse = await fetch("http://localhost:8000/companies/ai-enrich-headcount", {
+                method: "POST",
+                headers: {
+                    "Content-Type": "application/json",
+                    Authorization: `Bearer ${token}`,
+                },
+                body: JSON.stringify({ ids: companiesToProcess.map(c => c.id) }),
+            })
+
+            if (!jobResponse.ok) {
+                console.error("Bulk AI request failed")
+                toast.error(t('error'))
+                return
             }
 
-            let updatedCount = 0
-
-            // 3. Process each chunk
-            for (const chunk of chunks) {
-                // Prepare payload for AI Bulk Endpoint
-                const payload = {
-                    companies: chunk.map(c => ({
-                        id: c.id,
-                        name: c.name,
-                        location: c.location
-                    }))
-                }
-
-                const aiResponse = await fetch("http://localhost:8000/companies/ai-bulk-estimate-headcount", {
-                    method: "POST",
-                    headers: {
-                        "Content-Type": "application/json",
-                        Authorization: `Bearer ${token}`,
-                    },
-                    body: JSON.stringify(payload),
+            const { job_id } = await jobResponse.json()
+            const job = await waitForJob(job_id, token, (progress) => {
+                toast.loading(t('loading') || "Processing...", {
+                    id: loadingToast,
+                    description: `${progress.counters.processed ?? 0} / ${progress.counters.total ?? companiesToProcess.length}`,
                 })
+            })
+            const updatedCount = job.counters.updated ?? 0
+            const unanswered = (job.counters.missing ?? 0) + (job.counters.failed ?? 0)
 
-                if (!aiResponse.ok) {
-                    console.error("Bulk AI request failed")
-                    continue // Try next chunk
-                }
-
-                const aiResults = await aiResponse.json()
-
-                // Prepare updates for Bulk Enrich Endpoint
-                const updates = []
-                for (const result of aiResults) {
-                    let estimatedCount = 0
-                    if (result.headcount?.value) {
-                        estimatedCount = result.headcount.value
-                    } else if (result.headcount?.min && result.headcount?.max) {
-                        estimatedCount = Math.floor((result.headcount.min + result.headcount.max) / 2)
-                    } else if (result.headcount?.min) {
-                        estimatedCount = result.headcount.min
-                    } else if (result.headcount?.max) {
-                        estimatedCount = result.headcount.max
-                    }
-
-                    if (estimatedCount > 0) {
-                        updates.push({
-                            id: result.id, // ID from AI result (string/number)
-                            employees: estimatedCount
-                        })
-                    }
-                }
-
-                if (updates.length > 0) {
-                    const saveResponse = await fetch("http://localhost:8000/companies/bulk-enrich", {
-                        method: "PATCH",
-                        headers: {
-                            "Content-Type": "application/json",
-                            Authorization: `Bearer ${token}`,
-                        },
-                        body: JSON.stringify(updates),
-                    })
-
-                    if (saveResponse.ok) {
-                        updatedCount += updates.length
-                    }
-                }
+            if (unanswered > 0) {
+                toast.warning(`No estimate for ${unanswered} companies.`)
             }
-
             toast.success(`Updated ${updatedCount} companies.`)
             onUpdate()
             setSelectedIds(new Set())
@@ -26,6 +26,12 @@ import {
 
 import { ReadyCompaniesTable, ReadyCompany } from "./ready-companies-table"
 
+// Companies fetched per page; further pages are loaded with the cursor the API returns
+const COMPANIES_PAGE_SIZE = 200
+
+// Uploads above this size are imported in the background instead of inside the request
+const BACKGROUND_IMPORT_THRESHOLD = 5 * 1024 * 1024
+
 export default function CompaniesPage() {
     const router = useRouter()
     const [mounted, setMounted] = React.useState(false)
@@ -39,11 +45,37 @@ export default function CompaniesPage() {
     const [importResult, setImportResult] = React.useState<{ inserted: number, total: number } | null>(null)
     const [isSuccessDialogOpen, setIsSuccessDialogOpen] = React.useState(false)
     const fileInputRef = React.useRef<HTMLInputElement>(null)
+    const [nextCursor, setNextCursor] = React.useState<string | null>(null)
+    const [totalCompanies, setTotalCompanies] = React.useState<number | null>(null)
+    const [isLoadingMore, setIsLoadingMore] = React.useState(false)
+
+    const [sortConfig, setSortConfig] = React.useState<{ key: string, direction: 'asc' | 'desc' | null }>({ key: '', direction: null })
+    const [filters, setFilters] = React.useState({ name: '', employees: '', location: '' })
+    const [debouncedFilters, setDebouncedFilters] = React.useState(filters)
+
+    React.useEffect(() => {
+        const timeout = setTimeout(() => setDebouncedFilters(filters), 300)
+        return () => clearTimeout(timeout)
+    }, [filters])
 
     React.useEffect(() => {
         setMounted(true)
     }, [])
 
+    // Filtering and sorting happen on the server; the table only shows the pages loaded so far
+    const companiesUrl = React.useCallback((cursor: string | null) => {
+        const params = new URLSearchParams({ limit: String(COMPANIES_PAGE_SIZE), include_total: "true" })
+        if (sortConfig.key && sortConfig.direction) {
+            params.set("sort", sortConfig.key)
+            params.set("order", sortConfig.direction)
+        }
+        Object.entries(debouncedFilters).forEach(([key, value]) => {
+            if (value.trim()) params.set(key, value.trim())
+        })
+        if (cursor) params.set("cursor", cursor)
+        return `http://localhost:8000/companies?${params}`
+    }, [sortConfig, debouncedFilters])
+
     const fetchCompanies = React.useCallback(async () => {
         setIsLoading(true)
         try {
@@ -53,7 +85,7 @@ export default function CompaniesPage() {
                 return
             }
 
-            const response = await fetch("http://localhost:8000/companies", {
+            const response = await fetch(companiesUrl(null), {
                 headers: {
                     Authorization: `Bearer ${token}`,
                 },
@@ -68,13 +100,40 @@ export default function CompaniesPage() {
             if (response.ok) {
                 const data = await response.json()
                 setCompanies(data)
+                setNextCursor(response.headers.get("X-Next-Cursor"))
+                setTotalCompanies(Number(response.headers.get("X-Total-Count") ?? data.length))
             }
         } catch (error) {
             console.error("Error fetching companies:", error)
         } finally {
             setIsLoading(false)
         }
-    }, [router])
+    }, [router, companiesUrl])
+
+    const loadMoreCompanies = async () => {
+        if (!nextCursor) return
+        setIsLoadingMore(true)
+        try {
+            const token = localStorage.getItem("token")
+            if (!token) return
+
+            const response = await fetch(companiesUrl(nextCursor), {
+                headers: {
+                    Authorization: `Bearer ${token}`,
+                },
+            })
+
+            if (response.ok) {
+                const data = await response.json()
+                setCompanies(prev => [...prev, ...data])
+                setNextCursor(response.headers.get("X-Next-Cursor"))
+            }
+        } catch (error) {
+            console.error("Error fetching companies:", error)
+        } finally {
+            setIsLoadingMore(false)
+        }
+    }
 
     const fetchReadyCompanies = React.useCallback(async () => {
         setIsReadyLoading(true)
@@ -121,6 +180,32 @@ export default function CompaniesPage() {
         fileInputRef.current?.click()
     }
 
+    const waitForImportJob = async (jobId: number, token: string, toastId: string | number) => {
+        while (true) {
+            await new Promise((resolve) => setTimeout(resolve, 1000))
+            const response = await fetch(`http://localhost:8000/jobs/${jobId}`, {
+                headers: {
+                    Authorization: `Bearer ${token}`,
+                },
+            })
+            if (!response.ok) {
+                const errorData = await response.json()
+                throw new Error(errorData.detail || t('error'))
+            }
+            const job = await response.json()
+            if (job.status === "completed") {
+                return job
+            }
+            if (job.status === "failed" || job.status === "cancelled") {
+                throw new Error(job.error || job.status)
+            }
+            toast.loading(t('uploadingCompanies'), {
+                id: toastId,
+                description: `${job.counters.processed ?? 0} rows`,
+            })
+        }
+    }
+
     const processFile = async (file: File) => {
         if (file.type !== "text/csv" && !file.name.endsWith(".csv")) {
             toast.error(t('pleaseUploadCsv'))
@@ -140,7 +225,9 @@ export default function CompaniesPage() {
                 return
             }
 
-            const response = await fetch("http://localhost:8000/companies/upload", {
+            // Large files are imported by a background job on the server; we poll its progress
+            const background = file.size > BACKGROUND_IMPORT_THRESHOLD
+            const response = await fetch(`http://localhost:8000/companies/upload${background ? "?background=true" : ""}`, {
                 method: "POST",
                 headers: {
                     Authorization: `Bearer ${token}`,
@@ -162,10 +249,18 @@ export default function CompaniesPage() {
 
             const data = await response.json()
 
-            setImportResult({
-                inserted: data.inserted_count,
-                total: data.total_in_csv
-            })
+            if (background) {
+                const job = await waitForImportJob(data.job_id, token, loadingToast)
+                setImportResult({
+                    inserted: job.counters.inserted ?? 0,
+                    total: job.counters.total ?? 0
+                })
+            } else {
+                setImportResult({
+                    inserted: data.inserted_count,
+                    total: data.total_in_csv
+                })
+            }
             setIsSuccessDialogOpen(true)
 
             setTimeout(() => {
@@ -216,9 +311,6 @@ export default function CompaniesPage() {
         }
     }
 
-    const [sortConfig, setSortConfig] = React.useState<{ key: string, direction: 'asc' | 'desc' | null }>({ key: '', direction: null })
-    const [filters, setFilters] = React.useState({ name: '', employees: '', location: '' })
-
     const handleSort = (key: string) => {
         let direction: 'asc' | 'desc' | null = 'asc'
         if (sortConfig.key === key && sortConfig.direction === 'asc') {
@@ -233,43 +325,6 @@ export default function CompaniesPage() {
         setFilters(prev => ({ ...prev, [key]: value }))
     }
 
-    const filteredAndSortedCompanies = React.useMemo(() => {
-        let result = [...companies]
-
-        if (filters.name) {
-            result = result.filter(c => c.name.toLowerCase().includes(filters.name.toLowerCase()))
-        }
-        if (filters.location) {
-            result = result.filter(c => c.location && c.location.toLowerCase().includes(filters.location.toLowerCase()))
-        }
-        if (filters.employees) {
-            const val = filters.employees.trim()
-            if (val.startsWith('>')) {
-                const num = parseInt(val.slice(1))
-                if (!isNaN(num)) result = result.filter(c => c.employees > num)
-            } else if (val.startsWith('<')) {
-                const num = parseInt(val.slice(1))
-                if (!isNaN(num)) result = result.filter(c => c.employees < num)
-            } else {
-                const num = parseInt(val)
-                if (!isNaN(num)) result = result.filter(c => c.employees === num)
-            }
-        }
-
-        if (sortConfig.key && sortConfig.direction) {
-            result.sort((a, b) => {
-                const aValue = a[sortConfig.key]
-                const bValue = b[sortConfig.key]
-
-                if (aValue === bValue) return 0
-                const comparison = aValue > bValue ? 1 : -1
-                return sortConfig.direction === 'asc' ? comparison : -comparison
-            })
-        }
-
-        return result
-    }, [companies, sortConfig, filters])
-
     const handleEnrich = async () => {
         const loadingToast = toast.loading(t('enrichingData'))
 
@@ -336,7 +391,7 @@ export default function CompaniesPage() {
                 </div>
                 <div className="flex items-center gap-4">
                     <span className="text-sm font-medium text-muted-foreground mr-2">
-                        {t('total')}: {filteredAndSortedCompanies.length} {t('active')} / {readyCompanies.length} {t('ready')}
+                        {t('total')}: {totalCompanies ?? companies.length} {t('active')} / {readyCompanies.length} {t('ready')}
                     </span>
                     <Dialog open={isDialogOpen} onOpenChange={setIsDialogOpen}>
                         <DialogTrigger asChild>
@@ -395,7 +450,7 @@ export default function CompaniesPage() {
                     </TabsList>
                     <TabsContent value="all">
                         <CompaniesTable
-                            companies={filteredAndSortedCompanies}
+                            companies={companies}
                             isLoading={isLoading}
                             onUpdate={refreshAll}
                             onEnrich={handleEnrich}
@@ -404,6 +459,13 @@ export default function CompaniesPage() {
                             filters={filters}
                             onFilterChange={handleFilterChange}
                         />
+                        {nextCursor && (
+                            <div className="flex justify-center py-4">
+                                <Button variant="outline" onClick={loadMoreCompanies} disabled={isLoadingMore}>
+                                    {t('loadMore')} ({companies.length} / {totalCompanies ?? '?'})
+                                </Button>
+                            </div>
+                        )}
                     </TabsContent>
                     <TabsContent value="ready">
                         <ReadyCompaniesTable
@@ -23,6 +23,7 @@ import { toast } from "sonner"
 import { Input } from "@/components/ui/input"
 import { useLanguage } from "@/components/language-provider"
 import { formatCompanyName } from "@/lib/utils"
+import { waitForJob } from "@/lib/api"
 
 import { ReadyCompanyDialog } from "./ready-company-dialog"
 
@@ -116,22 +117,6 @@ export function ReadyCompaniesTable({
             return
         }
 
-        for (const company of selectedCompanies) {
-            const missingFields: string[] = []
-            if (!company.company_name?.trim()) missingFields.push(t('companyName'))
-            if (!company.location?.trim()) missingFields.push(t('location'))
-            if (!company.name?.trim()) missingFields.push(t('contactName'))
-            if (!company.sur_name?.trim()) missingFields.push(t('surname'))
-            if (!company.phone_number?.trim()) missingFields.push(t('phone'))
-
-            if (missingFields.length > 0) {
-                toast.error(`${t('error')}: ${missingFields.join(", ")}`, {
-                    duration: 5000,
-                })
-                return
-            }
-        }
-
         const loadingToast = toast.loading(t('loading'))
         try {
             const token = localStorage.getItem("token")
@@ -154,8 +139,23 @@ export function ReadyCompaniesTable({
             const data = await response.json()
 
             if (response.ok) {
-                toast.success(t('success'))
-                setSelectedIds(new Set())
+                // The server moves every complete company and reports the rest with the missing fields
+                if (data.moved.length > 0) {
+                    toast.success(t('success'), {
+                        description: `${t('movedToKanban')}: ${data.moved.length}`
+                    })
+                }
+                if (data.rejected.length > 0) {
+                    const names = new Map(selectedCompanies.map(c => [String(c.id), c.company_name]))
+                    toast.error(`${t('notMovedToKanban')}: ${data.rejected.length}`, {
+                        description: data.rejected
+                            .map((r: { id: number, missing_fields: string[], reason: string }) =>
+                                `${names.get(String(r.id)) ?? r.id}: ${r.missing_fields.length > 0 ? r.missing_fields.join(", ") : r.reason}`)
+                            .join("\n"),
+                        duration: 8000,
+                    })
+                }
+                setSelectedIds(new Set(data.rejected.map((r: { id: number }) => r.id)))
                 onUpdate()
             } else {
                 toast.error(data.detail || t('error'))
@@ -184,63 +184,33 @@ export function ReadyCompaniesTable({
 
             if (companiesToProcess.length === 0) return
 
-            // 2. Chunk into groups of 5
-            const chunkSize = 5
-            const chunks = []
-            for (let i = 0; i < companiesToProcess.length; i += chunkSize) {
-                chunks.push(companiesToProcess.slice(i, i + chunkSize))
-            }
-
-            let updatedCount = 0
+            // 2. The backend finds decision makers and saves them in a background job; we only poll its progress
+            const jobResponse = await fetch("http://localhost:8000/ready-companies/ai-enrich-decision-makers", {
+                method: "POST",
+                headers: {
+                    "Content-Type": "application/json",
+                    Authorization: `Bearer ${token}`,
+                },
+                body: JSON.stringify({ ids: companiesToProcess.map(c => c.id) }),
+            })
 
-            // 3. Process each chunk
-            for (const chunk of chunks) {
-                const payload = {
-                    companies: chunk.map(c => ({
-                        id: c.id,
-                        company_name: c.company_name,
-                        location: c.location
-                    }))
-                }
+            if (!jobResponse.ok) {
+                console.error("Bulk AI DM request failed")
+                toast.error(t('error'))
+                return
+            }
 
-                const aiResponse = await fetch("http://localhost:8000/ready-companies/ai-bulk-find-decision-maker", {
-                    method: "POST",
-                    headers: {
-                        "Content-Type": "application/json",
-                        Authorization: `Bearer ${token}`,
-                    },
-                    body: JSON.stringify(payload),
+            const { job_id } = await jobResponse.json()
+            const job = await waitForJob(job_id, token, (progress) => {
+                toast.loading(t('loading'), {
+                    id: loadingToast,
+                    description: `${progress.counters.processed ?? 0} / ${progress.counters.total ?? companiesToProcess.length}`,
                 })
-
-                if (!aiResponse.ok) {
-                    console.error("Bulk AI DM request failed")
-                    continue
-                }
-
-                const aiResults = await aiResponse.json()
-
-                // Prepare updates for Bulk Enrich Endpoint
-                const updates = aiResults.map((result: any) => ({
-                    id: result.id,
-                    name: result.name,
-                    sur_name: result.sur_name,
-                    phone_number: result.phone_number
-                })).filter((u: any) => u.name || u.sur_name || u.phone_number)
-
-                if (updates.length > 0) {
-                    const saveResponse = await fetch("http://localhost:8000/ready-companies/bulk-enrich", {
-                        method: "PATCH",
-                        headers: {
-                            "Content-Type": "application/json",
-                            Authorization: `Bearer ${token}`,
-                        },
-                        body: JSON.stringify(updates),
-                    })
-
-                    if (saveResponse.ok) {
-                        updatedCount += updates.length
-                    }
-                }
+            })
+            const updatedCount = job.counters.updated ?? 0
+            const unanswered = (job.counters.missing ?? 0) + (job.counters.failed ?? 0)
+            if (unanswered > 0) {
+                console.warn(`No decision maker returned for ${unanswered} companies`)
             }
 
             if (updatedCount > 0) {
@@ -296,8 +266,23 @@ export function ReadyCompaniesTable({
             })
 
             if (response.ok) {
-                toast.success(t('success'))
-                setSelectedIds(new Set())
+                // The server moves every complete company and reports the rest with the missing fields
+                if (data.moved.length > 0) {
+                    toast.success(t('success'), {
+                        description: `${t('movedToKanban')}: ${data.moved.length}`
+                    })
+                }
+                if (data.rejected.length > 0) {
+                    const names = new Map(selectedCompanies.map(c => [String(c.id), c.company_name]))
+                    toast.error(`${t('notMovedToKanban')}: ${data.rejected.length}`, {
+                        description: data.rejected
+                            .map((r: { id: number, missing_fields: string[], reason: string }) =>
+                                `${names.get(String(r.id)) ?? r.id}: ${r.missing_fields.length > 0 ? r.missing_fields.join(", ") : r.reason}`)
+                            .join("\n"),
+                        duration: 8000,
+                    })
+                }
+                setSelectedIds(new Set(data.rejected.map((r: { id: number }) => r.id)))
                 onUpdate()
             } else {
                 toast.error(t('error'))
@@ -443,12 +428,15 @@ export function ReadyCompaniesTable({
                                                             const loadingToast = toast.loading(t('loading'))
                                                             try {
                                                                 const token = localStorage.getItem("token")
-                                                                for (const id of Array.from(selectedIds)) {
-                                                                    await fetch(`http://localhost:8000/ready-companies/${id}/archive`, {
-                                                                        method: "POST",
-                                                                        headers: { Authorization: `Bearer ${token}` }
-                                                                    })
-                                                                }
+                                                                const response = await fetch("http://localhost:8000/ready-companies/bulk-archive", {
+                                                                    method: "POST",
+                                                                    headers: {
+                                                                        "Content-Type": "application/json",
+                                                                        Authorization: `Bearer ${token}`,
+                                                                    },
+                                                                    body: JSON.stringify(Array.from(selectedIds).map(Number)),
+                                                                })
+                                                                if (!response.ok) throw new Error(`Archive failed: ${response.status}`)
                                                                 toast.success(t('archivedSuccessfully'))
                                                                 onUpdate()
                                                                 setSelectedIds(new Set())
@@ -116,8 +116,8 @@ export function VoiceAIQueue() {
 
             if (response.ok) {
                 const result = await response.json()
-                toast.success(`${t('listSentSuccessfully')} (${result.sent_count})`)
-                // Refresh queue — sent companies no longer have scheduled_at
+                // Calls go out in the background as their scheduled times come
+                toast.success(`${t('listQueuedForCalling')} (${result.queued_count})`)
                 await fetchQueue()
             } else {
                 const err = await response.json().catch(() => null)
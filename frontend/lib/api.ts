@@ -44,3 +44,31 @@ export async function register(
 
     return response.json()
 }
+
+// Poll a background job (/jobs/{id}) until it finishes; resolves with the completed job
+export async function waitForJob(
+    jobId: number,
+    token: string,
+    onProgress?: (job: any) => void
+): Promise<any> {
+    while (true) {
+        await new Promise((resolve) => setTimeout(resolve, 1000))
+        const response = await fetch(`${API_URL}/jobs/${jobId}`, {
+            headers: {
+                Authorization: `Bearer ${token}`,
+            },
+        })
+        if (!response.ok) {
+            const error = await response.json()
+            throw new Error(error.detail || "Job status request failed")
+        }
+        const job = await response.json()
+        if (job.status === "completed") {
+            return job
+        }
+        if (job.status === "failed" || job.status === "cancelled") {
+            throw new Error(job.error || job.status)
+        }
+        onProgress?.(job)
+    }
+}
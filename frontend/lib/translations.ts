@@ -158,6 +158,9 @@ export const translations = {
         orDragAndDrop: "or drag and drop",
         csvLimit: "CSV file (max. 10MB)",
         duplicatesSkipped: "Duplicates were automatically skipped.",
+        loadMore: "Load more",
+        movedToKanban: "Moved to Kanban",
+        notMovedToKanban: "Not moved to Kanban",
         pleaseUploadCsv: "Please upload a CSV file",
         uploadingCompanies: "Uploading companies...",
         enrichingData: "Enriching data...",
@@ -171,7 +174,7 @@ export const translations = {
         savedToDatabase: "Saved to database.",
         sendList: "Send List",
         sendingList: "Sending...",
-        listSentSuccessfully: "List sent successfully!",
+        listQueuedForCalling: "List queued for calling",
         sent: "Sent",
     },
     ru: {
@@ -330,6 +333,9 @@ export const translations = {
         orDragAndDrop: "или перетащите файл",
         csvLimit: "CSV файл (макс. 10МБ)",
         duplicatesSkipped: "Дубликаты были автоматически пропущены.",
+        loadMore: "Загрузить ещё",
+        movedToKanban: "Перемещено в Канбан",
+        notMovedToKanban: "Не перемещено в Канбан",
         pleaseUploadCsv: "Пожалуйста, загрузите CSV файл",
         uploadingCompanies: "Загрузка компаний...",
         enrichingData: "Обогащение данных...",
@@ -343,7 +349,7 @@ export const translations = {
         savedToDatabase: "Сохранено в базу данных.",
         sendList: "Отправить список",
         sendingList: "Отправка...",
-        listSentSuccessfully: "Список успешно отправлен!",
+        listQueuedForCalling: "Список поставлен в очередь на звонки",
         sent: "Отправлено",
     }
 };
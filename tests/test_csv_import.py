@@ -99,3 +99,35 @@ def test_upload_invalid_file():
     files = {"file": ("test.txt", "some content", "text/plain")}
     response = client.post("/companies/upload", files=files)
     assert response.status_code == 400
+
+def test_upload_companies_quoted_multiline_and_bom():
+    csv_content = '\ufeffCompany Name,Employees,Location\n"Quoted, Corp",10,"New\nYork"\nPlain LLC,20,Paris\n'
+
+    files = {"file": ("test.csv", csv_content.encode("utf-8"), "text/csv")}
+    response = client.post("/companies/upload", files=files)
+
+    assert response.status_code == 201
+    assert response.json()["inserted_count"] == 2
+
+    response = client.get("/companies")
+    data = {c["name"]: c for c in response.json()}
+    assert data["Quoted, Corp"]["location"] == "New\nYork"
+    assert data["Plain LLC"]["employees"] == 20
+
+def test_upload_companies_skips_existing_names_case_insensitively():
+    csv_content = """Company Name,Employees
+Dup Corp,10
+dup corp,20"""
+
+    files = {"file": ("test.csv", csv_content, "text/csv")}
+    response = client.post("/companies/upload", files=files)
+    assert response.json()["inserted_count"] == 1
+    assert response.json()["skipped_count"] == 1
+
+    files = {"file": ("test.csv", "Company Name\nDUP CORP", "text/csv")}
+    response = client.post("/companies/upload", files=files)
+    assert response.json()["inserted_count"] == 0
+    assert response.json()["skipped_count"] == 1
+
+    response = client.get("/companies")
+    assert [c["employees"] for c in response.json()] == [10]